@@ -6,21 +6,102 @@ class Settings(BaseModel):
     RERANKER_MODEL: str = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
     OLLAMA_MODEL: str = os.getenv("OLLAMA_MODEL", "wizardlm2:latest")
     OLLAMA_HOST: str = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+    OLLAMA_TIMEOUT: float = float(os.getenv("OLLAMA_TIMEOUT", 120))
+    OLLAMA_MAX_CONNECTIONS: int = int(os.getenv("OLLAMA_MAX_CONNECTIONS", 16))
 
+    # Threads for blocking work (embedding, reranking, FAISS)
+    WORKER_THREADS: int = int(os.getenv("WORKER_THREADS", 8))
+    # Processes for CPU-bound PDF text extraction (ranges of pages in parallel)
+    PDF_WORKERS: int = int(os.getenv("PDF_WORKERS", 4))
+    # Threads hashing and chunking local files for /ingest-local (kept off WORKER_THREADS)
+    INGEST_LOAD_THREADS: int = int(os.getenv("INGEST_LOAD_THREADS", 4))
+    # Background ingestion jobs running at once, and how many may wait behind them
+    JOB_CONCURRENCY: int = int(os.getenv("JOB_CONCURRENCY", 2))
+    JOB_QUEUE_LIMIT: int = int(os.getenv("JOB_QUEUE_LIMIT", 32))
+
+    # External sources are fetched concurrently, each behind its own token bucket;
+    # whatever has arrived when the per-query deadline expires gets ingested
+    FETCH_THREADS: int = int(os.getenv("FETCH_THREADS", 8))
+    INGEST_DEADLINE_SECONDS: float = float(os.getenv("INGEST_DEADLINE_SECONDS", 20))
+    SOURCE_RATE_PER_SECOND: float = float(os.getenv("SOURCE_RATE_PER_SECOND", 2))
+    SOURCE_RATE_BURST: int = int(os.getenv("SOURCE_RATE_BURST", 2))
+    # Default (connect, read) timeout for source API requests on the shared session
+    SOURCE_CONNECT_TIMEOUT: float = float(os.getenv("SOURCE_CONNECT_TIMEOUT", 5))
+    SOURCE_READ_TIMEOUT: float = float(os.getenv("SOURCE_READ_TIMEOUT", 15))
+    # Per-source circuit breaker: open when >= BREAKER_ERROR_RATE of the last BREAKER_WINDOW
+    # requests failed or took over BREAKER_SLOW_SECONDS; probe again after the cooldown
+    BREAKER_ERROR_RATE: float = float(os.getenv("BREAKER_ERROR_RATE", 0.5))
+    BREAKER_MIN_CALLS: int = int(os.getenv("BREAKER_MIN_CALLS", 5))
+    BREAKER_WINDOW: int = int(os.getenv("BREAKER_WINDOW", 20))
+    BREAKER_SLOW_SECONDS: float = float(os.getenv("BREAKER_SLOW_SECONDS", 8))
+    BREAKER_COOLDOWN_SECONDS: float = float(os.getenv("BREAKER_COOLDOWN_SECONDS", 30))
+
+    # Index snapshots + write-ahead log; a snapshot is taken once the log reaches
+    # INDEX_SNAPSHOT_WAL_MB or is INDEX_SNAPSHOT_SECONDS old
+    INDEX_DIR: str = os.getenv("INDEX_DIR", "./data/index")
+    INDEX_SNAPSHOT_SECONDS: float = float(os.getenv("INDEX_SNAPSHOT_SECONDS", 300))
+    INDEX_SNAPSHOT_WAL_MB: int = int(os.getenv("INDEX_SNAPSHOT_WAL_MB", 64))
+    # Vector index type: flat (exact), hnsw or ivfpq (see app/rag/ann_index.py)
+    INDEX_TYPE: str = os.getenv("INDEX_TYPE", "flat").lower()
+    INDEX_HNSW_M: int = int(os.getenv("INDEX_HNSW_M", 32))
+    INDEX_HNSW_EF_CONSTRUCTION: int = int(os.getenv("INDEX_HNSW_EF_CONSTRUCTION", 200))
+    INDEX_HNSW_EF_SEARCH: int = int(os.getenv("INDEX_HNSW_EF_SEARCH", 64))
+    # IVF lists (0 = ~4*sqrt(chunks)), lists probed per search, PQ sub-quantizers
+    INDEX_IVF_NLIST: int = int(os.getenv("INDEX_IVF_NLIST", 0))
+    INDEX_IVF_NPROBE: int = int(os.getenv("INDEX_IVF_NPROBE", 16))
+    INDEX_PQ_M: int = int(os.getenv("INDEX_PQ_M", 48))
+    # ivfpq stays flat until this many chunks exist to train on
+    INDEX_TRAIN_MIN: int = int(os.getenv("INDEX_TRAIN_MIN", 20000))
+    # Rebuild hnsw/ivfpq indexes once this fraction of their slots are deleted chunks
+    INDEX_COMPACT_RATIO: float = float(os.getenv("INDEX_COMPACT_RATIO", 0.2))
+    # Indexes saved by older versions; imported once when INDEX_DIR has no snapshot yet
     VECTOR_INDEX_PATH: str = os.getenv("VECTOR_INDEX_PATH", "./data/index/faiss")
     BM25_INDEX_PATH: str = os.getenv("BM25_INDEX_PATH", "./data/index/bm25.pkl")
     CACHE_DB_PATH: str = os.getenv("CACHE_DB_PATH", "./data/cache.sqlite")
+    CORPUS_DB_PATH: str = os.getenv("CORPUS_DB_PATH", "./data/corpus.sqlite")
+    # Optional sqlite spill file for the query-embedding LRU ("" keeps it in memory only)
+    QUERY_EMBEDDING_CACHE_PATH: str = os.getenv("QUERY_EMBEDDING_CACHE_PATH", "")
+    QUERY_EMBEDDING_CACHE_SIZE: int = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 1024))
+    QUERY_EMBEDDING_CACHE_DISK_SIZE: int = int(os.getenv("QUERY_EMBEDDING_CACHE_DISK_SIZE", 100000))
+
+    # Answer cache: exact + near-duplicate (cosine >= ANSWER_CACHE_SIMILARITY) query reuse
+    ANSWER_CACHE_TTL_SECONDS: int = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", 3600))
+    ANSWER_CACHE_MAX_ENTRIES: int = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1000))
+    ANSWER_CACHE_SIMILARITY: float = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.95))
 
-    CHUNK_SIZE: int = int(os.getenv("CHUNK_SIZE", 900))
-    CHUNK_OVERLAP: int = int(os.getenv("CHUNK_OVERLAP", 180))
+    # How long fetched source documents (and per-query source searches) stay fresh
+    CORPUS_TTL_SECONDS: int = int(os.getenv("CORPUS_TTL_SECONDS", 86400))
+
+    # On-disk cache of raw source payloads; offline mode serves from it only
+    SOURCE_CACHE_DIR: str = os.getenv("SOURCE_CACHE_DIR", "./data/source_cache")
+    SOURCE_CACHE_TTL_SECONDS: int = int(os.getenv("SOURCE_CACHE_TTL_SECONDS", 86400))
+    SOURCE_CACHE_MAX_MB: int = int(os.getenv("SOURCE_CACHE_MAX_MB", 512))
+    SOURCE_CACHE_OFFLINE: bool = os.getenv("SOURCE_CACHE_OFFLINE", "false").lower() in ("1", "true", "yes")
+    # Resolved labels for Wikidata ids referenced in claims (Q5 -> "human")
+    WIKIDATA_LABELS_DB_PATH: str = os.getenv("WIKIDATA_LABELS_DB_PATH", "./data/wikidata_labels.sqlite")
+
+    # Chunk sizes in tokens of the embedding model's tokenizer (all-MiniLM-L6-v2 reads 256)
+    CHUNK_TOKENS: int = int(os.getenv("CHUNK_TOKENS", 200))
+    CHUNK_OVERLAP_TOKENS: int = int(os.getenv("CHUNK_OVERLAP_TOKENS", 40))
 
     RETRIEVE_K: int = int(os.getenv("RETRIEVE_K", 20))
     RERANK_TOP_K: int = int(os.getenv("RERANK_TOP_K", 5))
     CONTEXT_TOP_K: int = int(os.getenv("CONTEXT_TOP_K", 4))
 
+    # Hybrid fusion: "rrf" (reciprocal-rank) or "weighted" (min-max normalized scores)
+    FUSION_METHOD: str = os.getenv("FUSION_METHOD", "rrf")
+    RRF_K: int = int(os.getenv("RRF_K", 60))
+    HYBRID_ALPHA: float = float(os.getenv("HYBRID_ALPHA", 0.5))  # dense weight for "weighted"
+
     MIN_RERANK_SCORE: float = float(os.getenv("MIN_RERANK_SCORE", 0.4))
     MIN_CITATION_COVERAGE: float = float(os.getenv("MIN_CITATION_COVERAGE", 0.6))
+    # Abort a streamed answer with no citation marker after this many characters (0 = never)
+    REASK_CITATION_WINDOW_CHARS: int = int(os.getenv("REASK_CITATION_WINDOW_CHARS", 600))
+    # When retrieval alone forces a re-ask, also generate the normal answer and keep it if it cites
+    REASK_SPECULATIVE: bool = os.getenv("REASK_SPECULATIVE", "false").lower() in ("1", "true", "yes")
     MAX_CONTEXT_TOKENS: int = int(os.getenv("MAX_CONTEXT_TOKENS", 3200))
+    # HuggingFace tokenizer used to count context tokens (ideally the Ollama model's own)
+    CONTEXT_TOKENIZER: str = os.getenv("CONTEXT_TOKENIZER", os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
 
     HOST: str = os.getenv("HOST", "0.0.0.0")
     PORT: int = int(os.getenv("PORT", 8000))
@@ -4,13 +4,51 @@ from langchain_community.vectorstores import FAISS
 from app.config import settings
 from app.rag.reranker import CrossEncoderReranker
 from app.rag.caching import SqliteCache
+from app.rag.corpus import CorpusRegistry
+from app.rag.bm25_index import BM25Index
+from app.rag.index_store import IndexStore
+from app.rag.docstore import SqliteDocstore
+from app.rag import ann_index
+from app.rag.chunking import TokenChunker
+from app.rag.embedding_cache import QueryEmbeddingCache
+from app.rag.rate_limit import TokenBucket
+from app.rag.circuit_breaker import CircuitBreaker
+from app.rag.source_cache import SourceCache
+from app.rag.wikidata_labels import LabelCache
+from app.jobs import JobManager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
+import asyncio
+import contextvars
+import functools
+import httpx
+import multiprocessing
+import requests
 import os
 
 _embeddings = None
+_tokenizer = None
+_embedding_tokenizer = None
+_chunker = None
+_query_embeddings = None
 _vectorstore = None
+_bm25_index = None
+_index_store = None
 _reranker = None
 _cache = None
+_corpus = None
+_source_cache = None
+_wikidata_labels = None
+_executor = None
+_fetch_executor = None
+_pdf_executor = None
+_load_executor = None
+_jobs = None
+_rate_limiters = {}
+_circuit_breakers = {}
+_ollama_client = None
+_http_session = None
+_multiverse_ingester = None
 
 
 def embeddings():
@@ -20,17 +58,131 @@ def embeddings():
     return _embeddings
 
 
+def tokenizer():
+    """Tokenizer used to measure prompt context against MAX_CONTEXT_TOKENS"""
+    global _tokenizer
+    if _tokenizer is None:
+        from transformers import AutoTokenizer
+        _tokenizer = AutoTokenizer.from_pretrained(settings.CONTEXT_TOKENIZER)
+    return _tokenizer
+
+
+def embedding_tokenizer():
+    """Tokenizer of the embedding model, used to size chunks"""
+    global _embedding_tokenizer
+    if settings.CONTEXT_TOKENIZER == settings.EMBEDDING_MODEL:
+        return tokenizer()
+    if _embedding_tokenizer is None:
+        from transformers import AutoTokenizer
+        _embedding_tokenizer = AutoTokenizer.from_pretrained(settings.EMBEDDING_MODEL)
+    return _embedding_tokenizer
+
+
+def chunker():
+    global _chunker
+    if _chunker is None:
+        _chunker = TokenChunker(embedding_tokenizer(), settings.CHUNK_TOKENS, settings.CHUNK_OVERLAP_TOKENS)
+    return _chunker
+
+
+def query_embeddings():
+    """Shared LRU of query vectors; use this instead of embeddings().embed_query for queries"""
+    global _query_embeddings
+    if _query_embeddings is None:
+        spill_path = settings.QUERY_EMBEDDING_CACHE_PATH or None
+        if spill_path:
+            Path(spill_path).parent.mkdir(parents=True, exist_ok=True)
+        _query_embeddings = QueryEmbeddingCache(
+            embeddings().embed_query,
+            settings.EMBEDDING_MODEL,
+            maxsize=settings.QUERY_EMBEDDING_CACHE_SIZE,
+            spill_path=spill_path,
+            spill_maxsize=settings.QUERY_EMBEDDING_CACHE_DISK_SIZE
+        )
+    return _query_embeddings
+
+
+def index_store():
+    global _index_store
+    if _index_store is None:
+        _index_store = IndexStore(
+            settings.INDEX_DIR,
+            snapshot_seconds=settings.INDEX_SNAPSHOT_SECONDS,
+            snapshot_wal_bytes=settings.INDEX_SNAPSHOT_WAL_MB * 1024 * 1024
+        )
+    return _index_store
+
+
+def _load_indexes():
+    """Load the latest snapshot (or legacy index files) and replay the index log on top"""
+    global _vectorstore, _bm25_index
+    store = index_store()
+    with store.lock:
+        if _vectorstore is not None:
+            return
+        loaded = store.load(embeddings())
+        if loaded is not None:
+            vs, bm25, seq = loaded
+        else:
+            seq = 0
+            bm25 = BM25Index.from_pickle(settings.BM25_INDEX_PATH)
+            if os.path.isdir(settings.VECTOR_INDEX_PATH):
+                vs = FAISS.load_local(settings.VECTOR_INDEX_PATH, embeddings(), allow_dangerous_deserialization=True)
+            else:
+                vs = _empty_vectorstore()
+        ann_index.tune(vs.index)
+        converted = not isinstance(vs.docstore, SqliteDocstore)
+        if converted:
+            # Pickled InMemoryDocstore from an older layout: move it into SQLite
+            docstore = SqliteDocstore()
+            docstore.add(dict(vs.docstore._dict))
+            vs.docstore = docstore
+        if bm25 is None or len(bm25) != len(vs.docstore):
+            # Missing or out of sync with FAISS: rebuild once from the docstore
+            docs = list(vs.docstore.items())
+            bm25 = BM25Index()
+            bm25.add([i for i, _ in docs], (doc.page_content for _, doc in docs))
+        # Pickled BM25 or rebuilt one: write it to SQLite right away
+        converted = converted or bm25.path is None
+        store.replay(vs, bm25, after_seq=seq)
+        _bm25_index = bm25
+        _vectorstore = vs
+        if loaded is None or converted:
+            # First start on this layout: snapshot whatever was imported
+            store.snapshot(vs, bm25)
+
+
 def vectorstore():
-    global _vectorstore
     if _vectorstore is None:
-        Path(settings.VECTOR_INDEX_PATH).parent.mkdir(parents=True, exist_ok=True)
-        if os.path.isdir(settings.VECTOR_INDEX_PATH):
-            _vectorstore = FAISS.load_local(settings.VECTOR_INDEX_PATH, embeddings(), allow_dangerous_deserialization=True)
-        else:
-            _vectorstore = FAISS.from_texts([""], embeddings())  # empty placeholder
+        _load_indexes()
     return _vectorstore
 
 
+def _empty_vectorstore():
+    dim = len(embeddings().embed_query("dimension probe"))
+    return FAISS(embeddings(), ann_index.new_index(ann_index.initial_type(), dim), SqliteDocstore(), {})
+
+
+def reset_vectorstore():
+    """Replace the vectorstore with an empty one in memory (see indexing.reset_indexes)"""
+    global _vectorstore
+    _vectorstore = _empty_vectorstore()
+    return _vectorstore
+
+
+def bm25_index():
+    if _bm25_index is None:
+        _load_indexes()
+    return _bm25_index
+
+
+def reset_bm25_index():
+    """Replace the BM25 index with an empty one in memory (see indexing.reset_indexes)"""
+    global _bm25_index
+    _bm25_index = BM25Index()
+    return _bm25_index
+
+
 def reranker():
     global _reranker
     if _reranker is None:
@@ -42,6 +194,200 @@ def cache():
     global _cache
     if _cache is None:
         Path(settings.CACHE_DB_PATH).parent.mkdir(parents=True, exist_ok=True)
-        _cache = SqliteCache(settings.CACHE_DB_PATH)
+        _cache = SqliteCache(
+            settings.CACHE_DB_PATH,
+            ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+            max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+            similarity_threshold=settings.ANSWER_CACHE_SIMILARITY
+        )
     return _cache
 
+
+
+def corpus():
+    global _corpus
+    if _corpus is None:
+        Path(settings.CORPUS_DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+        _corpus = CorpusRegistry(settings.CORPUS_DB_PATH, settings.CORPUS_TTL_SECONDS)
+    return _corpus
+
+
+def source_cache():
+    global _source_cache
+    if _source_cache is None:
+        _source_cache = SourceCache(
+            settings.SOURCE_CACHE_DIR,
+            ttl_seconds=settings.SOURCE_CACHE_TTL_SECONDS,
+            max_bytes=settings.SOURCE_CACHE_MAX_MB * 1024 * 1024,
+            offline=settings.SOURCE_CACHE_OFFLINE,
+            breaker_for=circuit_breaker
+        )
+    return _source_cache
+
+
+def wikidata_labels():
+    global _wikidata_labels
+    if _wikidata_labels is None:
+        Path(settings.WIKIDATA_LABELS_DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+        _wikidata_labels = LabelCache(settings.WIKIDATA_LABELS_DB_PATH)
+    return _wikidata_labels
+
+
+def executor():
+    """Bounded pool for blocking work (model inference, FAISS, ingestion)"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.WORKER_THREADS, thread_name_prefix="citeright")
+    return _executor
+
+
+def fetch_executor():
+    """Separate pool for external source fetches, so they never wait behind (or starve) run_blocking"""
+    global _fetch_executor
+    if _fetch_executor is None:
+        _fetch_executor = ThreadPoolExecutor(max_workers=settings.FETCH_THREADS, thread_name_prefix="citeright-fetch")
+    return _fetch_executor
+
+
+def pdf_executor():
+    """Process pool for PDF text extraction, which is CPU-bound pure Python"""
+    global _pdf_executor
+    if _pdf_executor is None:
+        # spawn: workers only import pypdf instead of inheriting the models and threads of this process
+        _pdf_executor = ProcessPoolExecutor(max_workers=settings.PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pdf_executor
+
+
+def load_executor():
+    """Pool for reading and chunking local files during ingestion, so it never occupies run_blocking"""
+    global _load_executor
+    if _load_executor is None:
+        _load_executor = ThreadPoolExecutor(max_workers=settings.INGEST_LOAD_THREADS, thread_name_prefix="citeright-load")
+    return _load_executor
+
+
+def jobs():
+    """Bounded background queue for ingestion jobs"""
+    global _jobs
+    if _jobs is None:
+        _jobs = JobManager(settings.JOB_CONCURRENCY, settings.JOB_QUEUE_LIMIT)
+    return _jobs
+
+
+def rate_limiter(source: str) -> TokenBucket:
+    """Process-wide token bucket for one external source"""
+    limiter = _rate_limiters.get(source)
+    if limiter is None:
+        limiter = _rate_limiters.setdefault(
+            source, TokenBucket(settings.SOURCE_RATE_PER_SECOND, settings.SOURCE_RATE_BURST)
+        )
+    return limiter
+
+
+def circuit_breaker(source: str) -> CircuitBreaker:
+    """Process-wide circuit breaker for one external source"""
+    breaker = _circuit_breakers.get(source)
+    if breaker is None:
+        breaker = _circuit_breakers.setdefault(source, CircuitBreaker(
+            source,
+            error_rate=settings.BREAKER_ERROR_RATE,
+            min_calls=settings.BREAKER_MIN_CALLS,
+            window=settings.BREAKER_WINDOW,
+            slow_seconds=settings.BREAKER_SLOW_SECONDS,
+            cooldown_seconds=settings.BREAKER_COOLDOWN_SECONDS
+        ))
+    return breaker
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call on the bounded executor without blocking the event loop"""
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor(), call)
+
+
+def ollama_client():
+    """Long-lived keep-alive client for the Ollama API"""
+    global _ollama_client
+    if _ollama_client is None:
+        _ollama_client = httpx.AsyncClient(
+            base_url=settings.OLLAMA_HOST,
+            timeout=httpx.Timeout(settings.OLLAMA_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=settings.OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.OLLAMA_MAX_CONNECTIONS
+            )
+        )
+    return _ollama_client
+
+
+class _TimeoutAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter that applies a default timeout to requests made without one"""
+
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def mount_source_adapter(session: requests.Session) -> requests.Session:
+    """Give a session the source API timeouts and connection pooling"""
+    # One pool per source host, each big enough for every fetch thread at once
+    adapter = _TimeoutAdapter(
+        (settings.SOURCE_CONNECT_TIMEOUT, settings.SOURCE_READ_TIMEOUT),
+        pool_connections=8,
+        pool_maxsize=max(settings.WORKER_THREADS, settings.FETCH_THREADS)
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def http_session():
+    """Shared keep-alive session for blocking source API calls"""
+    global _http_session
+    if _http_session is None:
+        _http_session = mount_source_adapter(requests.Session())
+    return _http_session
+
+
+def multiverse_ingester():
+    """Process-wide MultiSourceIngester; its source clients are built once and reused by every query"""
+    global _multiverse_ingester
+    if _multiverse_ingester is None:
+        from app.rag.multiverse_ingester import MultiSourceIngester
+        _multiverse_ingester = MultiSourceIngester()
+    return _multiverse_ingester
+
+
+async def close_clients():
+    global _ollama_client, _http_session, _executor, _fetch_executor, _pdf_executor, _load_executor, _jobs, _index_store
+    if _jobs is not None:
+        _jobs.shutdown()
+        _jobs = None
+    if _index_store is not None:
+        if _vectorstore is not None:
+            await run_blocking(_index_store.close, _vectorstore, _bm25_index)
+        _index_store = None
+    if _ollama_client is not None:
+        await _ollama_client.aclose()
+        _ollama_client = None
+    if _http_session is not None:
+        _http_session.close()
+        _http_session = None
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+    if _fetch_executor is not None:
+        _fetch_executor.shutdown(wait=False, cancel_futures=True)
+        _fetch_executor = None
+    if _pdf_executor is not None:
+        _pdf_executor.shutdown(wait=False, cancel_futures=True)
+        _pdf_executor = None
+    if _load_executor is not None:
+        _load_executor.shutdown(wait=False, cancel_futures=True)
+        _load_executor = None
@@ -0,0 +1,157 @@
+"""
+Background ingestion jobs for CiteRight-Multiverse
+
+Ingestion endpoints submit their work here and return a job id at once. Jobs run
+on a bounded pool (JOB_CONCURRENCY at a time, JOB_QUEUE_LIMIT waiting) and report
+progress per stage (fetch, chunk, embed, index) through `report_progress`, which
+is also where a cancelled job stops.
+"""
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+_FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job at its next progress report after cancellation was requested"""
+
+
+class QueueFull(Exception):
+    """Too many jobs are already waiting"""
+
+
+class Job:
+    def __init__(self, kind: str, params: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = QUEUED
+        self.stage: Optional[str] = None
+        self.progress: Dict[str, Dict[str, Optional[int]]] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_requested = False
+        self.future = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+# The job whose work is running in this context (None outside jobs)
+_current_job: ContextVar[Optional[Job]] = ContextVar("current_job", default=None)
+
+
+def report_progress(stage: str, done: Optional[int] = None, total: Optional[int] = None):
+    """Record progress of the current job's stage; raises JobCancelled if the job was cancelled.
+
+    A no-op outside a job, so ingestion code can call it unconditionally.
+    """
+    job = _current_job.get()
+    if job is None:
+        return
+    if job.cancel_requested:
+        raise JobCancelled(job.id)
+    job.stage = stage
+    entry = job.progress.setdefault(stage, {"done": None, "total": None})
+    if done is not None:
+        entry["done"] = done
+    if total is not None:
+        entry["total"] = total
+
+
+class JobManager:
+    def __init__(self, concurrency: int, queue_limit: int, history: int = 200):
+        self.queue_limit = queue_limit
+        self.history = history
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="citeright-job")
+
+    def submit(self, kind: str, fn: Callable[..., Any], *args, params: Optional[Dict[str, Any]] = None,
+               on_done: Optional[Callable[[], None]] = None, **kwargs) -> Job:
+        """Queue `fn(*args, **kwargs)` as a job; `on_done` runs after it however it ends (even if never started)"""
+        job = Job(kind, params or {})
+        with self._lock:
+            if sum(1 for j in self._jobs.values() if j.status == QUEUED) >= self.queue_limit:
+                raise QueueFull(f"{self.queue_limit} jobs already queued")
+            self._jobs[job.id] = job
+            self._trim()
+            ctx = contextvars.copy_context()
+            job.future = self._pool.submit(ctx.run, self._run, job, fn, args, kwargs)
+        if on_done is not None:
+            job.future.add_done_callback(lambda _: on_done())
+        return job
+
+    def _run(self, job: Job, fn, args, kwargs):
+        if job.cancel_requested:
+            job.status, job.finished_at = CANCELLED, time.time()
+            return
+        job.status, job.started_at = RUNNING, time.time()
+        token = _current_job.set(job)
+        try:
+            job.result = fn(*args, **kwargs)
+            job.status = SUCCEEDED
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            logger.exception(f"Job {job.id} ({job.kind}) failed")
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            _current_job.reset(token)
+            job.finished_at = time.time()
+
+    def _trim(self):
+        """Forget the oldest finished jobs beyond `history` (lock held)"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in _FINISHED]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued job outright, or ask a running one to stop at its next progress report"""
+        job = self.get(job_id)
+        if job is None or job.status in _FINISHED:
+            return job
+        job.cancel_requested = True
+        if job.future is not None and job.future.cancel():
+            job.status, job.finished_at = CANCELLED, time.time()
+        return job
+
+    def shutdown(self):
+        with self._lock:
+            for job in self._jobs.values():
+                job.cancel_requested = True
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -1,16 +1,36 @@
-import time, orjson, sys
+import orjson, sys
 from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+from app.metrics import track_stage
+
+# Per-request stage timings; run_blocking copies the context, so worker threads write here too
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("timings", default=None)
+
+@contextmanager
+def collect_timings():
+    """Collect the ms spent in every `timer` stage within this block (summed per stage)"""
+    timings: Dict[str, float] = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
 
 @contextmanager
 def timer(name: str):
-    t0 = time.perf_counter()
+    """Time a stage; yields a Stopwatch whose `paused()` blocks are left out (wrap yields to slow consumers in it)"""
+    watch = None
     try:
-        yield
+        with track_stage(name) as watch:
+            yield watch
     finally:
-        t1 = time.perf_counter()
-        log_json({"metric": "latency", "stage": name, "ms": round((t1 - t0) * 1000, 2)})
+        ms = round(watch.elapsed() * 1000, 2)
+        timings = _timings.get()
+        if timings is not None:
+            timings[name] = round(timings.get(name, 0.0) + ms, 2)
+        log_json({"metric": "latency", "stage": name, "ms": ms})
 
 def log_json(payload: dict):
     sys.stdout.write(orjson.dumps(payload).decode() + "\n")
     sys.stdout.flush()
-
@@ -1,42 +1,65 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from typing import List, Optional
 from app.models import IngestRequest, QueryRequest, QueryResponse, MultiverseIngestRequest
-from app.rag.ingest import ingest_paths
-from app.rag.multiverse_ingester import ingest_multiverse_content, ingest_specific_multiverse_content
-from app.rag.pdf_processor import process_uploaded_pdf
+from app.rag.ingest import ingest_paths, ingest_pdf, check_paths
+from app.rag.multiverse_ingester import ingest_multiverse_content, ingest_specific_multiverse_content, SOURCE_ORIGINS
 from app.rag.retriever import hybrid_search
 from app.rag.reranker import CrossEncoderReranker
-from app.rag.generator import generate_with_ollama
-from app.rag.selective_reask import should_reask
-from app.rag.utils import build_context, format_citations, chunk_text, diversify_sources
+from app.rag.selective_reask import generate_with_reask
+from app.rag.utils import pack_context, format_citations, diversify_sources
 from app.rag.evaluator import evaluate_answer
-from app.logging_utils import timer, log_json
-from app.deps import reranker, cache, vectorstore
+from app.logging_utils import timer, log_json, collect_timings
+from app.metrics import CACHE_STATS, render as render_metrics
+from app.rag.indexing import reset_indexes, chunks_indexed
+from app.rag.generator import PROMPT_VERSION
+from app.deps import reranker, cache, corpus, query_embeddings, source_cache, multiverse_ingester, jobs, run_blocking, close_clients
 from app.config import settings
+from app.jobs import QueueFull
+import orjson
+import os
+import shutil
+import tempfile
 
 app = FastAPI(title="CiteRight")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
-@app.post("/ingest")
-def ingest(req: IngestRequest):
+@app.on_event("startup")
+async def startup():
+    # Build the source clients once, before the first query pays for it
+    await run_blocking(multiverse_ingester)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_clients()
+
+def _submit_job(kind: str, fn, *args, params: dict, on_done=None) -> dict:
+    """Queue ingestion work as a background job; poll GET /jobs/{job_id} for progress"""
+    try:
+        job = jobs().submit(kind, fn, *args, params=params, on_done=on_done)
+    except QueueFull as e:
+        if on_done is not None:
+            on_done()
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"job_id": job.id, "status": job.status}
+
+def _ingest_job(paths: List[str]):
     with timer("ingest"):
-        res = ingest_paths(req.paths)
-        vectorstore().save_local(settings.VECTOR_INDEX_PATH)
-        return res
+        # ingest_paths saves both indexes itself when anything changed
+        return ingest_paths(paths)
 
-@app.post("/ingest-multiverse")
-def ingest_multiverse(req: MultiverseIngestRequest):
+@app.post("/ingest", status_code=202)
+def ingest(req: IngestRequest):
+    try:
+        check_paths(req.paths)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _submit_job("ingest", _ingest_job, req.paths, params={"paths": req.paths})
+
+def _ingest_multiverse_job(req: MultiverseIngestRequest):
     with timer("ingest_multiverse"):
-        # Clear cache and vectorstore before new ingestion to avoid stale data
-        cache().clear_all()
-        
-        # Clear existing vectorstore to start fresh
-        from app.deps import embeddings
-        from langchain_community.vectorstores import FAISS
-        vs = FAISS.from_texts([""], embeddings())
-        vs.save_local(settings.VECTOR_INDEX_PATH)
-        
+        # The corpus is persistent: only missing or stale documents get fetched and embedded
         if req.specific_content:
             res = ingest_specific_multiverse_content(**req.specific_content)
         else:
@@ -49,155 +72,254 @@ def ingest_multiverse(req: MultiverseIngestRequest):
             )
         return res
 
+@app.post("/ingest-multiverse", status_code=202)
+def ingest_multiverse(req: MultiverseIngestRequest):
+    return _submit_job("ingest_multiverse", _ingest_multiverse_job, req, params=req.dict())
+
+@app.get("/jobs")
+def list_jobs():
+    """All queued, running and recently finished jobs, newest first"""
+    return {"jobs": [job.to_dict() for job in reversed(jobs().list())]}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Status, current stage and per-stage progress ({done, total}) of a job; `result` once it succeeded"""
+    job = jobs().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancel a queued job, or stop a running one at its next progress checkpoint"""
+    job = jobs().cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
 @app.post("/clear-data")
 def clear_data():
     """Clear all cached data and vectorstore"""
     with timer("clear_data"):
         try:
-            # Clear cache
+            # Clear caches and corpus registry
             cache().clear_all()
+            source_cache().clear_all()
+            corpus().clear_all()
             
-            # Clear vectorstore by creating a new empty one
-            from app.deps import embeddings
-            from langchain_community.vectorstores import FAISS
-            vs = FAISS.from_texts([""], embeddings())
-            vs.save_local(settings.VECTOR_INDEX_PATH)
+            # Clear vectorstore and BM25 index by replacing them with empty ones
+            reset_indexes()
             
             return {"message": "All data cleared successfully"}
         except Exception as e:
             return {"error": str(e)}
 
-@app.post("/upload-pdf")
-def upload_pdf(file: UploadFile = File(...)):
-    """Upload and process a PDF file"""
+@app.get("/cache/stats")
+def cache_stats():
+    """Hit/miss counters for the answer, query-embedding and source payload caches"""
+    return {"answers": cache().stats(), "query_embeddings": query_embeddings().stats(), "sources": source_cache().stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text exposition: stage/source latency histograms, in-flight gauges, counters"""
+    for name, stats in cache_stats().items():
+        for stat, value in stats.items():
+            CACHE_STATS.set(value, cache=name, stat=stat)
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+def _upload_pdf_job(path: str, filename: str):
     with timer("upload_pdf"):
-        try:
-            # Validate file type
-            if not file.filename.lower().endswith('.pdf'):
-                return {"error": "Only PDF files are supported"}
-            
-            # Read file content
-            pdf_content = file.file.read()
-            
-            # Process PDF
-            pdf_documents = process_uploaded_pdf(pdf_content, file.filename)
-            
-            if not pdf_documents:
-                return {"error": "Failed to extract text from PDF"}
-            
-            # Process and chunk the content
-            processed_chunks = []
-            for doc in pdf_documents:
-                chunks = chunk_text(doc['content'])
-                for i, chunk in enumerate(chunks):
-                    metadata = {
-                        "source": doc.get('source', file.filename),
-                        "origin": doc.get('origin', 'User Upload'),
-                        "license": doc.get('license', 'User Provided'),
-                        "url": doc.get('url', ''),
-                        "chunk_index": i,
-                        "total_chunks": len(chunks),
-                        "title": doc.get('title', file.filename),
-                        "summary": doc.get('summary', ''),
-                        **doc.get('metadata', {})
-                    }
-                    processed_chunks.append({
-                        "content": chunk,
-                        "metadata": metadata
-                    })
-            
-            # Add to vectorstore
-            if processed_chunks:
-                vs = vectorstore()
-                texts = [chunk['content'] for chunk in processed_chunks]
-                metas = [chunk['metadata'] for chunk in processed_chunks]
-                
-                vs.add_texts(texts=texts, metadatas=metas)
-                vs.save_local(settings.VECTOR_INDEX_PATH)
-            
-            return {
-                "message": f"Successfully processed PDF: {file.filename}",
-                "chunks_added": len(processed_chunks),
-                "filename": file.filename,
-                "page_count": pdf_documents[0].get('metadata', {}).get('page_count', 0)
-            }
-            
-        except Exception as e:
-            return {"error": f"Failed to process PDF: {str(e)}"}
+        res = ingest_pdf(path, filename)
+        if not res["chunks"]:
+            raise ValueError("Failed to extract text from PDF")
+        return {
+            "message": f"Successfully processed PDF: {filename}",
+            "chunks_added": res["chunks_added"],
+            "filename": filename,
+            "page_count": res["page_count"]
+        }
 
-@app.post("/query", response_model=QueryResponse)
-def query(req: QueryRequest):
-    q = req.query.strip()
+@app.post("/upload-pdf", status_code=202)
+def upload_pdf(file: UploadFile = File(...)):
+    """Upload a PDF and queue it for processing"""
+    # Validate file type
+    if not (file.filename or '').lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    
+    # Spool the upload to disk; the job reads pages from the file, never all at once
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as spool:
+        shutil.copyfileobj(file.file, spool, 1024 * 1024)
+    return _submit_job(
+        "upload_pdf", _upload_pdf_job, spool.name, file.filename,
+        params={"filename": file.filename},
+        on_done=lambda: os.unlink(spool.name)
+    )
 
-    # PDF-only mode: Don't clear, don't ingest, just filter results later
+def _cache_scope(req: QueryRequest) -> str:
+    """Everything besides the query text that determines the answer"""
+    return cache().make_scope(
+        sources=sorted(req.sources or []),
+        pdf_only=bool(req.pdf_only),
+        max_per_source=req.max_per_source,
+        top_k=req.top_k,
+        enable_evaluation=bool(req.enable_evaluation),
+        model=settings.OLLAMA_MODEL,
+        prompt=PROMPT_VERSION
+    )
+
+
+def _chunk_ids(top_docs) -> List[str]:
+    return [d.metadata["chunk_id"] for d in top_docs if d.metadata.get("chunk_id")]
+
+
+async def _cached_answer(req: QueryRequest, q: str):
+    """Look up an answer for this (or a near-duplicate) query; returns (response or None, query vector)"""
+    with timer("cache_lookup"):
+        query_vector = await run_blocking(query_embeddings().embed, q)
+        cached = await run_blocking(cache().get, q, _cache_scope(req), query_vector, chunks_indexed)
+    log_json({"metric": "answer_cache", "hit": cached is not None})
+    return cached, query_vector
+
+
+async def _retrieve(req: QueryRequest, q: str):
+    """Ingest what the query needs, then retrieve, rerank and diversify; returns (docs, scores)"""
+    # Restrict retrieval to the origins this query asked for
+    origins = None
+
+    # PDF-only mode: Don't ingest, only search uploaded documents
     if req.pdf_only:
         log_json({"metric": "query_mode", "mode": "pdf_only", "query": q})
-        # Skip clearing and ingestion - we'll filter by origin="User Upload" later
-        
-    else:
-        # Always clear cache and vectorstore for fresh results
-        cache().clear_all()
+        origins = {"User Upload"}
         
-        # Clear existing vectorstore to start fresh
-        from app.deps import embeddings
-        from langchain_community.vectorstores import FAISS
-        vs = FAISS.from_texts([""], embeddings())
-        vs.save_local(settings.VECTOR_INDEX_PATH)
-
-        # If sources are specified, ingest content from those sources first
-        if req.sources:
-            log_json({"metric": "query_sources", "sources": req.sources, "query": q})
-            ingest_multiverse_content(
+    elif req.sources:
+        # Fetch and embed only what the persistent corpus is missing for these sources
+        log_json({"metric": "query_sources", "sources": req.sources, "query": q})
+        with timer("ingest"):
+            await run_blocking(
+                ingest_multiverse_content,
                 query=q,
                 sources=req.sources,
                 max_per_source=req.max_per_source
             )
-
-    timings = {}
+        origins = {SOURCE_ORIGINS[s] for s in req.sources if s in SOURCE_ORIGINS}
 
     # Retrieval
     with timer("retrieve"):
-        candidates = hybrid_search(q, k=req.top_k or settings.RETRIEVE_K)
+        candidates = await run_blocking(hybrid_search, q, k=req.top_k or settings.RETRIEVE_K, origins=origins)
 
-    # PDF-only mode: Filter to only User Upload documents
     if req.pdf_only:
-        candidates = [doc for doc in candidates if doc.metadata.get('origin') == 'User Upload']
-        log_json({"metric": "pdf_only_filter", "original_count": len(candidates), "filtered_count": len(candidates)})
+        log_json({"metric": "pdf_only_filter", "filtered_count": len(candidates)})
 
     # Rerank
     with timer("rerank"):
-        top_docs, scores = reranker().rerank(q, candidates, top_k=settings.RERANK_TOP_K)
+        top_docs, scores = await run_blocking(reranker().rerank, q, candidates, top_k=settings.RERANK_TOP_K)
     
     # Diversify sources to ensure balanced representation (skip if pdf_only)
     if not req.pdf_only:
         top_docs = diversify_sources(top_docs, max_per_source=2)
 
-    # Context build
-    context = build_context(top_docs, settings.CONTEXT_TOP_K)
+    return top_docs, scores
 
-    # Generate
-    with timer("generate"):
-        answer = generate_with_ollama(q, context)
 
-    # Decide re-ask
-    used_reask = False
-    if should_reask(scores, used_context_chunks=len(top_docs), answer_text=answer):
-        used_reask = True
-        # Simple refinement: append instruction to be stricter + use different top-k slice
-        alt_context = build_context(top_docs, max(1, settings.CONTEXT_TOP_K - 1))
-        answer = generate_with_ollama(q + " (be strictly extractive; cite)", alt_context)
+def _reask_args(q: str, top_docs):
+    """Stricter query + a builder for the narrower context used when the first answer looks unreliable"""
+    async def strict_context():
+        return await run_blocking(pack_context, top_docs, settings.MAX_CONTEXT_TOKENS, max(1, settings.CONTEXT_TOP_K - 1))
+    return q + " (be strictly extractive; cite)", strict_context
 
-    cites = format_citations(top_docs)
 
-    # Optional evaluation layer
+async def _evaluate(req: QueryRequest, q: str, context: str, answer: str):
+    """Optional evaluation layer; returns (answer, evaluation)"""
     evaluation = None
     if req.enable_evaluation:
         with timer("evaluate"):
-            evaluation = evaluate_answer(q, context, answer)
+            evaluation = await evaluate_answer(q, context, answer)
             # Use evaluated answer if available
             if evaluation and not evaluation.get("evaluation_failed"):
                 answer = evaluation.get("final_answer", answer)
+    return answer, evaluation
+
+
+@app.post("/query", response_model=QueryResponse)
+async def query(req: QueryRequest):
+    q = req.query.strip()
+    with collect_timings() as timings:
+        # Common questions skip retrieval and generation entirely
+        cached, query_vector = await _cached_answer(req, q)
+        if cached is not None:
+            return QueryResponse(**cached, timings_ms=timings)
+
+        top_docs, scores = await _retrieve(req, q)
+
+        # Context build
+        context = await run_blocking(pack_context, top_docs, settings.MAX_CONTEXT_TOKENS, settings.CONTEXT_TOP_K)
+
+        # Generate, re-asking with a stricter prompt when the answer looks unreliable
+        async for kind, value in generate_with_reask(q, context, *_reask_args(q, top_docs), scores, len(top_docs)):
+            if kind == "final":
+                answer, used_reask = value
+
+        cites = format_citations(top_docs)
+
+        answer, evaluation = await _evaluate(req, q, context, answer)
+
+        response = {"answer": answer, "citations": cites, "used_reask": used_reask, "evaluation": evaluation}
+        await run_blocking(cache().set, q, _cache_scope(req), response, query_vector, _chunk_ids(top_docs))
+
+        log_json({"metric": "query", "used_reask": used_reask, "evaluation_enabled": req.enable_evaluation})
+        return QueryResponse(**response, timings_ms=timings)
+
+
+def _ndjson(event: dict) -> bytes:
+    return orjson.dumps(event) + b"\n"
+
+
+@app.post("/query/stream")
+async def query_stream(req: QueryRequest):
+    """Stream a query as NDJSON events.
+
+    Emits `citations` once retrieval is done, then one `token` event per Ollama token,
+    a `reask` event if the answer is regenerated (clients should discard the tokens
+    received so far), and finally `done` with the full answer and evaluation metadata.
+    """
+    q = req.query.strip()
+
+    async def events():
+        with collect_timings() as timings:
+            try:
+                cached, query_vector = await _cached_answer(req, q)
+                if cached is not None:
+                    yield _ndjson({"type": "citations", "citations": cached["citations"]})
+                    yield _ndjson({"type": "token", "text": cached["answer"]})
+                    yield _ndjson({"type": "done", **cached, "timings_ms": timings})
+                    return
+
+                top_docs, scores = await _retrieve(req, q)
+                yield _ndjson({"type": "citations", "citations": format_citations(top_docs)})
+
+                context = await run_blocking(pack_context, top_docs, settings.MAX_CONTEXT_TOKENS, settings.CONTEXT_TOP_K)
+                async for kind, value in generate_with_reask(q, context, *_reask_args(q, top_docs), scores, len(top_docs)):
+                    if kind == "token":
+                        yield _ndjson({"type": "token", "text": value})
+                    elif kind == "reask":
+                        yield _ndjson({"type": "reask"})
+                    else:
+                        answer, used_reask = value
+
+                answer, evaluation = await _evaluate(req, q, context, answer)
+
+                response = {
+                    "answer": answer,
+                    "citations": format_citations(top_docs),
+                    "used_reask": used_reask,
+                    "evaluation": evaluation
+                }
+                await run_blocking(cache().set, q, _cache_scope(req), response, query_vector, _chunk_ids(top_docs))
 
-    log_json({"metric": "query", "used_reask": used_reask, "evaluation_enabled": req.enable_evaluation})
-    return QueryResponse(answer=answer, citations=cites, used_reask=used_reask, timings_ms=timings, evaluation=evaluation)
+                log_json({"metric": "query_stream", "used_reask": used_reask, "evaluation_enabled": req.enable_evaluation})
+                yield _ndjson({"type": "done", **response, "timings_ms": timings})
+            except Exception as e:
+                log_json({"metric": "query_stream_error", "error": str(e)})
+                yield _ndjson({"type": "error", "error": str(e)})
 
+    return StreamingResponse(events(), media_type="application/x-ndjson")
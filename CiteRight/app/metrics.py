@@ -0,0 +1,166 @@
+"""
+Minimal Prometheus metrics for CiteRight (text exposition format, no extra dependency)
+"""
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry: List["_Metric"] = []
+
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_fmt_labels(self.labels, k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = _LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = buckets
+        self._values: Dict[Tuple[str, ...], List[float]] = {}  # bucket counts..., sum, count
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, row in self._values.items():
+                for bound, count in zip(self.buckets, row):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {row[-1]}")
+                lines.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {row[-2]}")
+                lines.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {row[-1]}")
+        return lines
+
+
+STAGE_LATENCY = Histogram("citeright_stage_latency_seconds", "Latency of pipeline stages", ("stage",))
+STAGE_IN_FLIGHT = Gauge("citeright_stage_in_flight", "Pipeline stages currently running", ("stage",))
+STAGE_TOTAL = Counter("citeright_stage_total", "Completed pipeline stages by outcome", ("stage", "outcome"))
+SOURCE_LATENCY = Histogram("citeright_source_fetch_seconds", "Latency of external source fetches", ("source",))
+SOURCE_IN_FLIGHT = Gauge("citeright_source_fetch_in_flight", "External source fetches currently running", ("source",))
+SOURCE_TOTAL = Counter("citeright_source_fetch_total", "External source fetches by outcome", ("source", "outcome"))
+SOURCE_CIRCUIT = Gauge("citeright_source_circuit_state", "Source circuit breaker state (0 closed, 1 half-open, 2 open)", ("source",))
+CACHE_STATS = Gauge("citeright_cache", "Cache counters and sizes at scrape time", ("cache", "stat"))
+
+
+class Stopwatch:
+    """Wall time since creation, minus the time spent in `paused()` blocks"""
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._paused = 0.0
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start - self._paused
+
+    @contextmanager
+    def paused(self):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._paused += time.perf_counter() - t0
+
+
+@contextmanager
+def track(latency: Histogram, in_flight: Gauge, total: Counter, **labels):
+    """Observe latency, in-flight count and outcome of a block; yields its Stopwatch.
+
+    Time inside `watch.paused()` (e.g. a generator waiting on its consumer) is not counted.
+    """
+    watch = Stopwatch()
+    in_flight.inc(**labels)
+    outcome = "ok"
+    try:
+        yield watch
+    except (asyncio.CancelledError, GeneratorExit):
+        outcome = "cancelled"
+        raise
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        latency.observe(watch.elapsed(), **labels)
+        in_flight.dec(**labels)
+        total.inc(outcome=outcome, **labels)
+
+
+def track_stage(stage: str):
+    return track(STAGE_LATENCY, STAGE_IN_FLIGHT, STAGE_TOTAL, stage=stage)
+
+
+def track_source(source: str):
+    return track(SOURCE_LATENCY, SOURCE_IN_FLIGHT, SOURCE_TOTAL, source=source)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,287 @@
+"""
+Vector index types for CiteRight-Multiverse
+
+INDEX_TYPE selects the FAISS index behind the vectorstore, built with
+`faiss.index_factory`:
+    flat   exact L2 scan (LangChain's default)
+    hnsw   HNSW graph over full vectors; no training, searched with efSearch
+    ivfpq  inverted lists over product-quantized vectors; trained on the corpus,
+           searched with nprobe
+
+A snapshot's index is opened memory-mapped (IO_FLAG_MMAP_IFC, faiss >= 1.11), so
+workers share its pages through the OS cache and startup reads next to nothing;
+a mapped index is never modified. Chunks added since the snapshot go to a small
+in-memory flat delta index (positions continue after the base index), searched
+alongside it and merged into the next snapshot's index.
+
+Deleted chunks are tombstoned: they leave the docstore and the position -> id map
+but keep their slot in the index, and searches over-fetch past them. `rebuild_if_needed` runs at
+snapshot time and rebuilds the index when the configured type differs (an ivfpq
+corpus stays flat until INDEX_TRAIN_MIN chunks exist to train on), when
+tombstones pass INDEX_COMPACT_RATIO, or when an ivfpq corpus outgrew its lists.
+Rebuilds train and add the original float32 vectors kept in the docstore, so
+repeated rebuilds of an ivfpq index don't compound its quantization error; chunks
+without a stored vector fall back to the index's own reconstruction.
+"""
+import logging
+import math
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from langchain.docstore.document import Document
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+FLAT, HNSW, IVFPQ = "flat", "hnsw", "ivfpq"
+INDEX_TYPES = (FLAT, HNSW, IVFPQ)
+
+_TRAIN_SAMPLE = 100_000  # vectors used to train IVF centroids and PQ codebooks
+
+
+def index_type(index) -> str:
+    import faiss
+    if isinstance(index, faiss.IndexHNSW):
+        return HNSW
+    if faiss.try_extract_index_ivf(index) is not None:
+        return IVFPQ
+    return FLAT
+
+
+def _nlist(n: int) -> int:
+    """IVF list count: INDEX_IVF_NLIST, or ~4*sqrt(n) with at least 39 training points per list"""
+    if settings.INDEX_IVF_NLIST > 0:
+        return settings.INDEX_IVF_NLIST
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def _pq_m(dim: int) -> int:
+    """Largest sub-quantizer count <= INDEX_PQ_M that divides the dimension"""
+    m = min(settings.INDEX_PQ_M, dim)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def factory_string(kind: str, dim: int, n: int = 0, nlist: Optional[int] = None, pq_m: Optional[int] = None,
+                   hnsw_m: Optional[int] = None) -> str:
+    if kind == HNSW:
+        return f"HNSW{hnsw_m or settings.INDEX_HNSW_M},Flat"
+    if kind == IVFPQ:
+        return f"IVF{nlist or _nlist(n)},PQ{pq_m or _pq_m(dim)}x8"
+    if kind == FLAT:
+        return "Flat"
+    raise ValueError(f"Unknown index type {kind!r}; expected one of {', '.join(INDEX_TYPES)}")
+
+
+def read_index(path: str):
+    """Open a saved index memory-mapped where this faiss supports it (read into memory otherwise) and tune it"""
+    import faiss
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    return tune(faiss.read_index(path, flag) if flag is not None else faiss.read_index(path))
+
+
+def merged_index(base, delta_vectors: np.ndarray):
+    """An in-memory copy of `base` with the delta's vectors appended, for the next snapshot"""
+    import faiss
+    if not len(delta_vectors):
+        return base
+    index = faiss.deserialize_index(faiss.serialize_index(base))
+    index.add(delta_vectors)
+    return index
+
+
+def tune(index, ef_search: Optional[int] = None, nprobe: Optional[int] = None):
+    """Apply the search-time knobs (efSearch for HNSW, nprobe for IVF)"""
+    import faiss
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search or settings.INDEX_HNSW_EF_SEARCH
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe or settings.INDEX_IVF_NPROBE
+    return index
+
+
+def new_index(kind: str, dim: int, train: Optional[np.ndarray] = None, **options):
+    """An empty index of the given type; ivfpq is trained on `train` first"""
+    import faiss
+    n = 0 if train is None else len(train)
+    index = faiss.index_factory(dim, factory_string(kind, dim, n, **options), faiss.METRIC_L2)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = settings.INDEX_HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        if train is None:
+            raise ValueError(f"{kind} index needs training vectors")
+        if n > _TRAIN_SAMPLE:
+            train = train[np.random.default_rng(0).choice(n, _TRAIN_SAMPLE, replace=False)]
+        index.train(train)
+    return tune(index)
+
+
+def initial_type() -> str:
+    """Type for a new, empty vectorstore: ivfpq has nothing to train on yet and starts flat"""
+    return FLAT if settings.INDEX_TYPE == IVFPQ else settings.INDEX_TYPE
+
+
+def _new_delta(vs):
+    import faiss
+    return faiss.IndexFlat(vs.index.d, vs.index.metric_type)
+
+
+def delta(vs):
+    """The vectorstore's in-memory index of chunks added since its base index was written, or None"""
+    return getattr(vs, "delta_index", None)
+
+
+def delta_vectors(vs) -> np.ndarray:
+    index = delta(vs)
+    if index is None or not index.ntotal:
+        return np.zeros((0, vs.index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def ntotal(vs) -> int:
+    """Index positions in use, tombstones included: base index then delta"""
+    index = delta(vs)
+    return vs.index.ntotal + (index.ntotal if index is not None else 0)
+
+
+def add_vectors(vs, texts: List[str], vectors, metadatas: List[Dict[str, Any]], ids: List[str]):
+    """Add embedded chunks to the delta index; positions continue after tombstones"""
+    import faiss
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if vs._normalize_L2:
+        faiss.normalize_L2(vectors)
+    start = ntotal(vs)
+    vs.docstore.add({i: Document(page_content=t, metadata=m) for i, t, m in zip(ids, texts, metadatas)},
+                    vectors=dict(zip(ids, vectors)))
+    if delta(vs) is None:
+        vs.delta_index = _new_delta(vs)
+    vs.delta_index.add(vectors)
+    vs.index_to_docstore_id.update({start + j: i for j, i in enumerate(ids)})
+
+
+def remove_vectors(vs, ids: List[str]):
+    """Remove chunks by tombstoning their positions"""
+    dead = set(ids)
+    vs.index_to_docstore_id = {p: i for p, i in vs.index_to_docstore_id.items() if i not in dead}
+    vs.docstore.delete(list(dead))
+
+
+def tombstones(vs) -> int:
+    return ntotal(vs) - len(vs.index_to_docstore_id)
+
+
+def rebase(vs, path: str, merged: int):
+    """Swap in the snapshot index at `path`, which holds the base plus the first `merged` delta vectors"""
+    remaining = delta_vectors(vs)[merged:]
+    vs.index = read_index(path)
+    vs.delta_index = _new_delta(vs)
+    vs.delta_index.add(remaining)
+
+
+def search(vs, vector: np.ndarray, k: int) -> Tuple[List[str], np.ndarray]:
+    """Chunk ids and distances of the `k` nearest live chunks to one (1, dim) query"""
+    import faiss
+    mapping = vs.index_to_docstore_id
+    live, total = len(mapping), ntotal(vs)
+    if live == 0:
+        return [], np.zeros(0, dtype=np.float32)
+    # Over-fetch in proportion to tombstoned slots so `k` live hits usually remain
+    fetch = math.ceil(k * total / live)
+    distances, positions = [], []
+    for index, offset in ((vs.index, 0), (delta(vs), vs.index.ntotal)):
+        if index is not None and index.ntotal:
+            d, p = index.search(vector, min(fetch, index.ntotal))
+            distances.append(d[0])
+            positions.append(np.where(p[0] == -1, -1, p[0] + offset))
+    distances, positions = np.concatenate(distances), np.concatenate(positions)
+    descending = vs.index.metric_type == faiss.METRIC_INNER_PRODUCT
+    order = np.argsort(-distances if descending else distances, kind="stable")
+    ids, keep = [], []
+    for j in order:
+        p = positions[j]
+        chunk_id = mapping.get(int(p)) if p != -1 else None
+        if chunk_id is not None:
+            ids.append(chunk_id)
+            keep.append(j)
+            if len(ids) == k:
+                break
+    return ids, distances[keep]
+
+
+def _reconstruct(vs, positions: np.ndarray) -> np.ndarray:
+    """Vectors at base or delta positions, as the indexes hold them"""
+    import faiss
+    base_n = vs.index.ntotal
+    vectors = np.zeros((len(positions), vs.index.d), dtype=np.float32)
+    in_base = positions < base_n
+    if in_base.any():
+        ivf = faiss.try_extract_index_ivf(vs.index)
+        if ivf is not None:
+            ivf.make_direct_map()
+        vectors[in_base] = vs.index.reconstruct_batch(positions[in_base])
+    if not in_base.all():
+        vectors[~in_base] = delta(vs).reconstruct_batch(positions[~in_base] - base_n)
+    return vectors
+
+
+def live_vectors(vs, positions: np.ndarray) -> np.ndarray:
+    """Vectors at these index positions: as stored in the docstore, else reconstructed.
+
+    Vectors reconstructed from a lossless (flat or HNSW) index are stored back, so
+    a corpus from before the docstore kept them has them after its next rebuild.
+    """
+    ids = [vs.index_to_docstore_id[int(p)] for p in positions]
+    stored = vs.docstore.vectors(ids)
+    vectors = np.zeros((len(ids), vs.index.d), dtype=np.float32)
+    missing = []
+    for j, chunk_id in enumerate(ids):
+        if chunk_id in stored:
+            vectors[j] = stored[chunk_id]
+        else:
+            missing.append(j)
+    if missing:
+        vectors[missing] = _reconstruct(vs, positions[missing])
+        if index_type(vs.index) != IVFPQ:
+            vs.docstore.set_vectors({ids[j]: vectors[j] for j in missing})
+        logger.info(f"{len(missing)} of {len(ids)} vectors reconstructed from the {index_type(vs.index)} index")
+    return vectors
+
+
+def _rebuild_reason(vs) -> Optional[str]:
+    current, wanted = index_type(vs.index), settings.INDEX_TYPE
+    live = len(vs.index_to_docstore_id)
+    if wanted != current:
+        if wanted == IVFPQ and live < settings.INDEX_TRAIN_MIN:
+            return None if current == FLAT else f"{current} -> flat until {settings.INDEX_TRAIN_MIN} chunks"
+        return f"{current} -> {wanted}"
+    if tombstones(vs) > settings.INDEX_COMPACT_RATIO * ntotal(vs):
+        return f"{tombstones(vs)} tombstones"
+    if current == IVFPQ and settings.INDEX_IVF_NLIST <= 0:
+        import faiss
+        if _nlist(live) >= 2 * faiss.try_extract_index_ivf(vs.index).nlist:
+            return f"{live} chunks outgrew the IVF lists"
+    return None
+
+
+def rebuild_if_needed(vs, search_lock=None) -> bool:
+    """Rebuild (and retrain) the index from its live vectors when due; caller holds the index lock.
+
+    The new index is built while searches go on and swapped in under `search_lock`'s write side.
+    """
+    reason = _rebuild_reason(vs)
+    if reason is None:
+        return False
+    positions = np.array(sorted(vs.index_to_docstore_id), dtype=np.int64)
+    vectors = live_vectors(vs, positions)
+    kind = settings.INDEX_TYPE if settings.INDEX_TYPE != IVFPQ or len(positions) >= settings.INDEX_TRAIN_MIN else FLAT
+    index = new_index(kind, vs.index.d, train=vectors if kind == IVFPQ else None)
+    if len(vectors):
+        index.add(vectors)
+    mapping = {j: vs.index_to_docstore_id[int(p)] for j, p in enumerate(positions)}
+    with search_lock.write() if search_lock is not None else nullcontext():
+        vs.index, vs.index_to_docstore_id = index, mapping
+        vs.delta_index = None
+    logger.info(f"Rebuilt vector index as {kind} over {len(positions)} chunks ({reason})")
+    return True
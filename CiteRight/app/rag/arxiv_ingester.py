@@ -4,27 +4,51 @@ arXiv data ingestion module for CiteRight-Multiverse
 import arxiv
 from typing import List, Dict, Any
 import logging
+from app.rag.corpus import split_arxiv_id
+from app.deps import rate_limiter, circuit_breaker, source_cache, mount_source_adapter
 
 logger = logging.getLogger(__name__)
 
+_ID_BATCH_SIZE = 100  # ids per export-API page
+
 class ArxivIngester:
     def __init__(self):
         """Initialize arXiv ingester"""
-        pass
+        self.client = arxiv.Client(page_size=_ID_BATCH_SIZE)
+        # The client keeps its own requests session and sets no timeout on it
+        if getattr(self.client, "_session", None) is not None:
+            mount_source_adapter(self.client._session)
         
     def search_papers(self, query: str, max_results: int = 10) -> List[Dict[str, Any]]:
         """Search arXiv for papers related to query"""
         try:
-            # Create search query
-            search = arxiv.Search(
-                query=query,
-                max_results=max_results,
-                sort_by=arxiv.SortCriterion.Relevance,
-                sort_order=arxiv.SortOrder.Descending
+            return source_cache().fetch(
+                "arxiv",
+                {"op": "search", "query": query, "max_results": max_results},
+                lambda _: (self._search_papers(query, max_results), None),
+                limiter=rate_limiter("arxiv")
             )
             
-            papers = []
-            for result in search.results():
+        except Exception as e:
+            logger.error(f"arXiv search failed: {e}")
+            return []
+    
+    def _search_papers(self, query: str, max_results: int) -> List[Dict[str, Any]]:
+        # Create search query
+        search = arxiv.Search(
+            query=query,
+            max_results=max_results,
+            sort_by=arxiv.SortCriterion.Relevance,
+            sort_order=arxiv.SortOrder.Descending
+        )
+        
+        return self._collect(search)
+    
+    def _collect(self, search: arxiv.Search) -> List[Dict[str, Any]]:
+        """Run a search on the shared client, behind the source's circuit breaker"""
+        papers = []
+        with circuit_breaker("arxiv").guard():
+            for result in self.client.results(search):
                 try:
                     paper = self._process_paper(result)
                     if paper:
@@ -32,32 +56,45 @@ class ArxivIngester:
                 except Exception as e:
                     logger.warning(f"Failed to process paper {result.entry_id}: {e}")
                     continue
-                    
-            return papers
-            
-        except Exception as e:
-            logger.error(f"arXiv search failed: {e}")
-            return []
+                
+        return papers
     
     def get_paper_by_id(self, paper_id: str) -> Dict[str, Any]:
         """Get a specific arXiv paper by ID"""
+        papers = self.get_papers_by_ids([paper_id])
+        return papers[0] if papers else None
+    
+    def get_papers_by_ids(self, paper_ids: List[str]) -> List[Dict[str, Any]]:
+        """Get several papers (latest versions) with paged `id_list` export-API requests"""
+        # Versions are dropped: the latest version is fetched and the registry tracks it
+        base_ids = list(dict.fromkeys(split_arxiv_id(paper_id)[0] for paper_id in paper_ids))
         try:
-            # Remove version suffix if present
-            clean_id = paper_id.split('v')[0]
-            
-            search = arxiv.Search(
-                id_list=[clean_id],
-                max_results=1
+            papers = source_cache().fetch_many(
+                "arxiv",
+                {base_id: {"op": "paper", "id": base_id} for base_id in base_ids},
+                self._fetch_papers,
+                batch_size=_ID_BATCH_SIZE,
+                limiter=rate_limiter("arxiv")
             )
-            
-            for result in search.results():
-                return self._process_paper(result)
-                
-            return None
+            return [papers[base_id] for base_id in base_ids if base_id in papers]
             
         except Exception as e:
-            logger.error(f"Failed to get paper {paper_id}: {e}")
-            return None
+            logger.error(f"Failed to get papers {paper_ids}: {e}")
+            return []
+    
+    def _fetch_papers(self, base_ids: List[str]) -> Dict[str, Any]:
+        """Fetch papers by base id; returns {base_id: (paper, updated timestamp)}"""
+        search = arxiv.Search(
+            id_list=base_ids,
+            max_results=len(base_ids)
+        )
+        
+        papers = {}
+        for paper in self._collect(search):
+            base_id = split_arxiv_id(paper['metadata']['arxiv_id'])[0]
+            papers[base_id] = (paper, paper['metadata']['updated'])
+                
+        return papers
     
     def get_recent_papers(self, category: str = None, max_results: int = 10) -> List[Dict[str, Any]]:
         """Get recent papers from arXiv"""
@@ -70,17 +107,7 @@ class ArxivIngester:
                 sort_order=arxiv.SortOrder.Descending
             )
             
-            papers = []
-            for result in search.results():
-                try:
-                    paper = self._process_paper(result)
-                    if paper:
-                        papers.append(paper)
-                except Exception as e:
-                    logger.warning(f"Failed to process paper {result.entry_id}: {e}")
-                    continue
-                    
-            return papers
+            return self._collect(search)
             
         except Exception as e:
             logger.error(f"Failed to get recent papers: {e}")
@@ -113,16 +140,19 @@ class ArxivIngester:
                 
             content = "\n\n".join(content_parts)
             
+            # get_short_id() keeps old-style archive prefixes (solv-int/9901001v1)
+            short_id = result.get_short_id()
+            
             return {
                 "title": result.title,
                 "content": content,
                 "summary": f"{result.title} - {abstract[:200]}...",
                 "url": result.entry_id,
-                "source": f"arXiv:{result.entry_id.split('/')[-1]}",
+                "source": f"arXiv:{short_id}",
                 "origin": "arXiv",
                 "license": "CC BY 4.0",
                 "metadata": {
-                    "arxiv_id": result.entry_id.split('/')[-1],
+                    "arxiv_id": short_id,
                     "authors": authors,
                     "categories": categories,
                     "published": result.published.isoformat() if result.published else None,
@@ -0,0 +1,262 @@
+"""
+Incremental BM25 inverted index for CiteRight-Multiverse
+
+Holds postings keyed by the same chunk ids as the FAISS docstore, so chunks can be
+appended or deleted without re-tokenizing the corpus and the chunk text itself is
+only ever stored once (in the docstore).
+
+Like the docstore, the postings live in the current index snapshot's `bm25.sqlite`,
+opened read-only: a query reads the rows of its own terms, so startup doesn't
+unpickle the whole index. Chunks added or deleted since that snapshot are held in
+an in-memory overlay (they are also in the index log); the next snapshot writes a
+new database from the old one plus the overlay and the index is rebased onto it.
+"""
+import math
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+import orjson
+
+# Per term: the chunk ids containing it and an int32 (term frequency, chunk length) pair for each
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, ids BLOB, stats BLOB) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, len INTEGER, terms BLOB) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER) WITHOUT ROWID",
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return text.lower().split()
+
+
+def _open_read_only(path: str) -> sqlite3.Connection:
+    con = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+    con.execute("PRAGMA mmap_size=268435456")  # read through the page cache, not private buffers
+    return con
+
+
+def _decode(row) -> Tuple[List[str], np.ndarray]:
+    return orjson.loads(row[0]), np.frombuffer(row[1], dtype=np.int32).reshape(-1, 2)
+
+
+class BM25Index:
+    def __init__(self, path: Optional[str] = None, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self.path = path
+        self._con = _open_read_only(path) if path else None
+        self._base_docs, self._base_len = self._base_totals()
+        # Overlay: chunks added since the base database
+        self._postings: Dict[str, Dict[str, int]] = {}  # term -> {chunk_id: term frequency}
+        self._doc_tf: Dict[str, Dict[str, int]] = {}  # chunk_id -> {term: frequency}
+        self._doc_lens: Dict[str, int] = {}
+        self._overlay_len = 0
+        # Ids hidden from the base database -> (their length there or None, stamp of the deletion)
+        self._deleted: Dict[str, Tuple[Optional[int], int]] = {}
+        self._deleted_docs = 0
+        self._deleted_len = 0
+        self._stamp = 0
+
+    def _base_totals(self) -> Tuple[int, int]:
+        if self._con is None:
+            return 0, 0
+        meta = dict(self._con.execute("SELECT key, value FROM meta").fetchall())
+        return meta.get("docs", 0), meta.get("total_len", 0)
+
+    def _base_len_of(self, chunk_id: str) -> Optional[int]:
+        if self._con is None:
+            return None
+        with self._lock:
+            row = self._con.execute("SELECT len FROM docs WHERE id=?", (chunk_id,)).fetchone()
+        return row[0] if row else None
+
+    def __len__(self) -> int:
+        return self._base_docs - self._deleted_docs + len(self._doc_lens)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        if chunk_id in self._doc_lens:
+            return True
+        return chunk_id not in self._deleted and self._base_len_of(chunk_id) is not None
+
+    @property
+    def total_len(self) -> int:
+        return self._base_len - self._deleted_len + self._overlay_len
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]):
+        """Append chunks; an id that is already indexed is replaced"""
+        for chunk_id, text in zip(ids, texts):
+            if chunk_id in self:
+                self.delete([chunk_id])
+            tf: Dict[str, int] = {}
+            for tok in tokenize(text):
+                tf[tok] = tf.get(tok, 0) + 1
+            self._add_tf(chunk_id, tf)
+
+    def _add_tf(self, chunk_id: str, tf: Dict[str, int]):
+        for term, count in tf.items():
+            self._postings.setdefault(term, {})[chunk_id] = count
+        self._doc_tf[chunk_id] = tf
+        self._doc_lens[chunk_id] = sum(tf.values())
+        self._overlay_len += self._doc_lens[chunk_id]
+
+    def _drop_overlay(self, chunk_id: str):
+        for term in self._doc_tf.pop(chunk_id):
+            posting = self._postings[term]
+            posting.pop(chunk_id, None)
+            if not posting:
+                del self._postings[term]
+        self._overlay_len -= self._doc_lens.pop(chunk_id)
+
+    def delete(self, ids: Iterable[str]):
+        for chunk_id in ids:
+            if chunk_id in self._doc_tf:
+                self._drop_overlay(chunk_id)
+            # Re-stamped even if already hidden, so a snapshot taken before this doesn't unhide it
+            self._hide(chunk_id)
+
+    def _hide(self, chunk_id: str):
+        previous = self._deleted.get(chunk_id)
+        if previous is not None and previous[0] is not None:
+            self._deleted_docs -= 1
+            self._deleted_len -= previous[0]
+        length = self._base_len_of(chunk_id)
+        self._stamp += 1
+        self._deleted[chunk_id] = (length, self._stamp)
+        if length is not None:
+            self._deleted_docs += 1
+            self._deleted_len += length
+
+    def _term_postings(self, term: str) -> Tuple[List[str], np.ndarray]:
+        """Live chunk ids containing a term, with their (tf, length) rows"""
+        ids: List[str] = []
+        stats = np.zeros((0, 2), dtype=np.int32)
+        if self._con is not None:
+            with self._lock:
+                row = self._con.execute("SELECT ids, stats FROM terms WHERE term=?", (term,)).fetchone()
+            if row:
+                ids, stats = _decode(row)
+                if self._deleted:
+                    keep = [j for j, chunk_id in enumerate(ids) if chunk_id not in self._deleted]
+                    if len(keep) < len(ids):
+                        ids, stats = [ids[j] for j in keep], stats[keep]
+        overlay = self._postings.get(term)
+        if overlay:
+            ids = ids + list(overlay)
+            stats = np.vstack([stats, np.array([(tf, self._doc_lens[i]) for i, tf in overlay.items()], dtype=np.int32)])
+        return ids, stats
+
+    def get_scores(self, query: str) -> Tuple[List[str], np.ndarray]:
+        """Okapi BM25 scores for every chunk containing at least one query term"""
+        n_docs = len(self)
+        if not n_docs:
+            return [], np.zeros(0, dtype=np.float32)
+        avgdl = self.total_len / n_docs
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            ids, stats = self._term_postings(term)
+            if not ids:
+                continue
+            # Lucene-style idf: always positive, so very common terms never subtract score
+            idf = math.log(1 + (n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            tf, lens = stats[:, 0].astype(np.float64), stats[:, 1].astype(np.float64)
+            contrib = idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * lens / avgdl))
+            for chunk_id, score in zip(ids, contrib.tolist()):
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + score
+        return list(scores), np.fromiter(scores.values(), dtype=np.float32, count=len(scores))
+
+    # Snapshots
+
+    def pending(self) -> Tuple[Optional[str], Dict[str, Dict[str, int]], Dict[str, Tuple[Optional[int], int]]]:
+        """(base database, copy of the overlay) for `write` (caller holds the index lock)"""
+        return self.path, dict(self._doc_tf), dict(self._deleted)
+
+    @staticmethod
+    def write(path: str, base: Optional[str], added: Dict[str, Dict[str, int]], deleted: Iterable[str]):
+        """Write a base database plus an overlay captured by `pending` to a new file"""
+        if base:
+            shutil.copyfile(base, path)
+        con = sqlite3.connect(path)
+        try:
+            with con:
+                for statement in _SCHEMA:
+                    con.execute(statement)
+                # Re-added ids replace their old row too
+                gone = set(deleted) | set(added)
+                removed: Dict[str, Set[str]] = {}
+                for chunk_id in gone:
+                    row = con.execute("SELECT terms FROM docs WHERE id=?", (chunk_id,)).fetchone()
+                    for term in orjson.loads(row[0]) if row else ():
+                        removed.setdefault(term, set()).add(chunk_id)
+                appended: Dict[str, List[Tuple[str, int, int]]] = {}
+                for chunk_id, tf in added.items():
+                    length = sum(tf.values())
+                    for term, count in tf.items():
+                        appended.setdefault(term, []).append((chunk_id, count, length))
+
+                for term in removed.keys() | appended.keys():
+                    row = con.execute("SELECT ids, stats FROM terms WHERE term=?", (term,)).fetchone()
+                    ids, stats = _decode(row) if row else ([], np.zeros((0, 2), dtype=np.int32))
+                    if term in removed:
+                        keep = [j for j, chunk_id in enumerate(ids) if chunk_id not in removed[term]]
+                        ids, stats = [ids[j] for j in keep], stats[keep]
+                    if term in appended:
+                        ids = ids + [chunk_id for chunk_id, _, _ in appended[term]]
+                        stats = np.vstack([stats, np.array([(c, n) for _, c, n in appended[term]], dtype=np.int32)])
+                    if ids:
+                        con.execute("REPLACE INTO terms (term, ids, stats) VALUES (?,?,?)",
+                                    (term, orjson.dumps(ids), stats.astype(np.int32).tobytes()))
+                    else:
+                        con.execute("DELETE FROM terms WHERE term=?", (term,))
+
+                con.executemany("DELETE FROM docs WHERE id=?", ((i,) for i in gone))
+                con.executemany(
+                    "INSERT INTO docs (id, len, terms) VALUES (?,?,?)",
+                    ((i, sum(tf.values()), orjson.dumps(list(tf))) for i, tf in added.items())
+                )
+                docs, total_len = con.execute("SELECT COUNT(*), COALESCE(SUM(len), 0) FROM docs").fetchone()
+                con.executemany("REPLACE INTO meta (key, value) VALUES (?,?)",
+                                (("docs", docs), ("total_len", total_len)))
+        finally:
+            con.close()
+        with open(path, "rb+") as f:
+            os.fsync(f.fileno())
+
+    def rebase(self, path: str, added: Dict[str, Dict[str, int]], deleted: Dict[str, Tuple[Optional[int], int]]):
+        """Switch to a database written by `write`; keep only overlay changes made after capture"""
+        con = _open_read_only(path)
+        with self._lock:
+            old, self._con, self.path = self._con, con, path
+        self._base_docs, self._base_len = self._base_totals()
+        for chunk_id, tf in added.items():
+            if self._doc_tf.get(chunk_id) is tf:
+                self._drop_overlay(chunk_id)
+        for chunk_id, marker in deleted.items():
+            if self._deleted.get(chunk_id) == marker:
+                del self._deleted[chunk_id]
+        # Deletions made after capture are re-counted against the new base
+        remaining = list(self._deleted)
+        self._deleted, self._deleted_docs, self._deleted_len = {}, 0, 0
+        for chunk_id in remaining:
+            self._hide(chunk_id)
+        if old is not None:
+            old.close()
+
+    @classmethod
+    def from_pickle(cls, path: str) -> Optional["BM25Index"]:
+        """Import an index pickled by older versions into the overlay; None if missing or unreadable"""
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            old = pickle.load(f)
+        state = getattr(old, "__dict__", {})
+        if not isinstance(old, cls) or "doc_terms" not in state:
+            return None
+        index = cls()
+        for chunk_id, terms in state["doc_terms"].items():
+            index._add_tf(chunk_id, {term: state["postings"][term][chunk_id] for term in terms})
+        return index
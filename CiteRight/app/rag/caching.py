@@ -1,27 +1,133 @@
-import sqlite3, time, json
-from typing import Optional
+import sqlite3, time, json, hashlib, threading
+from typing import Optional, Dict, Any, Callable, List
+import numpy as np
+
 
 class SqliteCache:
-    def __init__(self, path: str):
+    """Answer cache with exact and near-duplicate (embedding similarity) lookups.
+
+    Entries are partitioned by a scope string (sources, pdf_only, model, prompt, ...)
+    so an answer is only reused for an equivalent request. Each entry also records the
+    chunk ids the answer was generated from; a lookup given `is_current` drops entries
+    whose chunks are no longer all indexed, so ingesting unrelated content keeps them.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int = 3600, max_entries: int = 1000,
+                 similarity_threshold: float = 0.95):
         self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread=False)
         self._init()
 
     def _init(self):
-        with sqlite3.connect(self.path) as con:
-            con.execute("CREATE TABLE IF NOT EXISTS cache (q TEXT PRIMARY KEY, answer TEXT, citations TEXT, ts REAL)")
-
-    def get(self, q: str):
-        with sqlite3.connect(self.path) as con:
-            row = con.execute("SELECT answer, citations FROM cache WHERE q=?", (q,)).fetchone()
-            if row:
-                return row[0], json.loads(row[1])
+        with self._lock, self._con:
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.execute("PRAGMA synchronous=NORMAL")
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, scope TEXT, q TEXT, "
+                "embedding BLOB, response TEXT, created REAL, last_access REAL, chunk_ids TEXT)"
+            )
+            columns = {r[1] for r in self._con.execute("PRAGMA table_info(answers)")}
+            if "chunk_ids" not in columns:
+                self._con.execute("ALTER TABLE answers ADD COLUMN chunk_ids TEXT")
+            self._con.execute("CREATE INDEX IF NOT EXISTS answers_scope ON answers (scope, created)")
+            self._con.execute("CREATE INDEX IF NOT EXISTS answers_lru ON answers (last_access)")
+            # Exact-query table of older versions: its answers carry no scope, so none can be reused
+            self._con.execute("DROP TABLE IF EXISTS cache")
+
+    @staticmethod
+    def make_scope(**parts) -> str:
+        return json.dumps(parts, sort_keys=True)
+
+    @staticmethod
+    def _key(q: str, scope: str) -> str:
+        normalized = " ".join(q.lower().split())
+        return hashlib.sha256(f"{scope}\n{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, q: str, scope: str, embedding: Optional[np.ndarray] = None,
+            is_current: Optional[Callable[[List[str]], bool]] = None) -> Optional[Dict[str, Any]]:
+        """Return a cached response for `q` in `scope`, falling back to the most similar cached query.
+
+        With `is_current`, an entry is only served if `is_current(its chunk ids)` is true;
+        stale entries are deleted.
+        """
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            row = self._con.execute(
+                "SELECT key, response, chunk_ids FROM answers WHERE key=? AND created>?",
+                (self._key(q, scope), cutoff)
+            ).fetchone()
+            if row and self._current(row, is_current):
+                self.hits += 1
+                return self._touch(row)
+
+            if embedding is not None:
+                rows = self._con.execute(
+                    "SELECT key, response, chunk_ids, embedding FROM answers "
+                    "WHERE scope=? AND created>? AND embedding IS NOT NULL",
+                    (scope, cutoff)
+                ).fetchall()
+                if rows:
+                    matrix = np.stack([np.frombuffer(r[3], dtype=np.float32) for r in rows])
+                    query = np.asarray(embedding, dtype=np.float32)
+                    sims = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+                    best = int(np.argmax(sims))
+                    if sims[best] >= self.similarity_threshold and self._current(rows[best], is_current):
+                        self.semantic_hits += 1
+                        return self._touch(rows[best])
+
+            self.misses += 1
         return None
 
-    def set(self, q: str, answer: str, citations: list):
-        with sqlite3.connect(self.path) as con:
-            con.execute("REPLACE INTO cache (q, answer, citations, ts) VALUES (?,?,?,?)", (q, answer, json.dumps(citations), time.time()))
-    
-    def clear_all(self):
-        with sqlite3.connect(self.path) as con:
-            con.execute("DELETE FROM cache")
+    def _current(self, row, is_current: Optional[Callable[[List[str]], bool]]) -> bool:
+        """Whether a row's answer still rests on indexed chunks; deletes it if not (lock held)"""
+        if is_current is None or row[2] is None or is_current(json.loads(row[2])):
+            return True
+        with self._con:
+            self._con.execute("DELETE FROM answers WHERE key=?", (row[0],))
+        return False
+
+    def _touch(self, row) -> Dict[str, Any]:
+        with self._con:
+            self._con.execute("UPDATE answers SET last_access=? WHERE key=?", (time.time(), row[0]))
+        return json.loads(row[1])
 
+    def set(self, q: str, scope: str, response: Dict[str, Any], embedding: Optional[np.ndarray] = None,
+            chunk_ids: Optional[List[str]] = None):
+        now = time.time()
+        blob = np.asarray(embedding, dtype=np.float32).tobytes() if embedding is not None else None
+        with self._lock, self._con:
+            self._con.execute(
+                "REPLACE INTO answers (key, scope, q, embedding, response, created, last_access, chunk_ids) "
+                "VALUES (?,?,?,?,?,?,?,?)",
+                (self._key(q, scope), scope, q, blob, json.dumps(response), now, now,
+                 json.dumps(chunk_ids) if chunk_ids is not None else None)
+            )
+            # Expire by TTL, then evict least recently used entries beyond the size bound
+            self._con.execute("DELETE FROM answers WHERE created<=?", (now - self.ttl_seconds,))
+            self._con.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = self._con.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+                "size": size
+            }
+
+    def clear_all(self):
+        with self._lock, self._con:
+            self._con.execute("DELETE FROM answers")
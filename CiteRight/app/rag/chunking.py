@@ -0,0 +1,130 @@
+"""
+Token-aware chunking for CiteRight-Multiverse
+
+Text is cut into sentences and paragraphs in a single regex pass, the pieces are
+tokenized in batches with the embedding model's tokenizer, and consecutive pieces
+are packed into chunks of at most `max_tokens` tokens, so chunks fit the embedding
+model's input instead of a character budget. A chunk closes early at a paragraph
+break once it is half full, and the next chunk repeats up to `overlap_tokens` of
+trailing sentences (never across a paragraph break).
+
+Every chunk records its character offsets in the source text and its token count,
+so context packing can merge neighbouring chunks and budget tokens without
+re-tokenizing.
+"""
+import re
+from typing import Any, Dict, Iterator, List, NamedTuple
+
+# A paragraph break (group 1), whitespace after sentence punctuation, or a line break
+_BOUNDARY = re.compile(r"(\n[ \t]*\n\s*)|(?<=[.!?:;])\s+|\n\s*")
+_WORD = re.compile(r"\S+")
+_BATCH = 1024  # pieces tokenized per tokenizer call
+
+
+class _Piece(NamedTuple):
+    start: int
+    end: int
+    tokens: int
+    paragraph_end: bool
+
+
+class TokenChunker:
+    def __init__(self, tokenizer, max_tokens: int, overlap_tokens: int):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def _count(self, texts: List[str]) -> List[int]:
+        encoded = self.tokenizer(
+            texts, add_special_tokens=False, return_attention_mask=False, return_token_type_ids=False
+        )["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    def _pieces(self, text: str) -> Iterator[_Piece]:
+        """Sentences/lines as pieces, whitespace excluded, tokenized _BATCH at a time"""
+        batch = []
+        pos, stop = len(text) - len(text.lstrip()), len(text.rstrip())
+        for m in _BOUNDARY.finditer(text, pos, stop):
+            start, end = m.span()
+            if start > pos:
+                batch.append((pos, start, m.lastindex == 1))
+                if len(batch) >= _BATCH:
+                    yield from self._measure(text, batch)
+                    batch = []
+            pos = end
+        if pos < stop:
+            batch.append((pos, stop, True))
+        if batch:
+            yield from self._measure(text, batch)
+
+    def _measure(self, text: str, spans: List[tuple]) -> Iterator[_Piece]:
+        counts = self._count([text[s:e] for s, e, _ in spans])
+        for (start, end, paragraph_end), tokens in zip(spans, counts):
+            if tokens <= self.max_tokens:
+                yield _Piece(start, end, tokens, paragraph_end)
+            else:
+                yield from self._split_long(text, start, end, paragraph_end)
+
+    def _split_long(self, text: str, start: int, end: int, paragraph_end: bool) -> Iterator[_Piece]:
+        """Cut a sentence longer than a chunk at word boundaries (a single oversized word stays whole)"""
+        words = [(m.start(), m.end()) for m in _WORD.finditer(text, start, end)]
+        counts = self._count([text[s:e] for s, e in words])
+        piece_start, piece_end, tokens = None, None, 0
+        for (s, e), n in zip(words, counts):
+            if piece_start is not None and tokens + n > self.max_tokens:
+                yield _Piece(piece_start, piece_end, tokens, False)
+                piece_start, tokens = None, 0
+            if piece_start is None:
+                piece_start = s
+            piece_end = e
+            tokens += n
+        if piece_start is not None:
+            yield _Piece(piece_start, piece_end, tokens, paragraph_end)
+
+    def iter_chunks(self, text: str) -> Iterator[Dict[str, Any]]:
+        """Yield chunks as {text, char_start, char_end, token_count, overlap_tokens}"""
+        window: List[_Piece] = []
+        total = 0
+        carried = 0  # tokens at the front of `window` repeated from the previous chunk
+
+        def emit():
+            start, end = window[0].start, window[-1].end
+            return {
+                "text": text[start:end],
+                "char_start": start,
+                "char_end": end,
+                "token_count": total,
+                "overlap_tokens": carried
+            }
+
+        def carry():
+            # Trailing sentences of the emitted chunk that fit in the overlap budget
+            kept, tokens = [], 0
+            for piece in reversed(window[1:]):
+                if piece.paragraph_end or tokens + piece.tokens > self.overlap_tokens:
+                    break
+                kept.insert(0, piece)
+                tokens += piece.tokens
+            return kept, tokens
+
+        for piece in self._pieces(text):
+            if total + piece.tokens > self.max_tokens and total > carried:
+                yield emit()
+                window, total = carry()
+                carried = total
+            while window and total + piece.tokens > self.max_tokens:
+                # The carried overlap leaves no room for this piece; shed it from the front
+                total -= window.pop(0).tokens
+                carried = total
+            window.append(piece)
+            total += piece.tokens
+            if piece.paragraph_end and total >= self.max_tokens // 2:
+                yield emit()
+                window, total, carried = [], 0, 0
+        if window and total > carried:
+            yield emit()
+
+    def split(self, text: str) -> List[Dict[str, Any]]:
+        return list(self.iter_chunks(text))
@@ -0,0 +1,109 @@
+"""
+Per-source circuit breakers for CiteRight-Multiverse
+
+A source whose recent requests mostly fail or run slow is opened: its requests are
+refused without touching the network (callers fall back to cached payloads) until a
+cooldown passes, then a single probe request decides whether it closes again.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from app.rag.source_cache import FetchSkipped
+from app.metrics import SOURCE_CIRCUIT
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(FetchSkipped):
+    """The source's breaker is open, so no request was made"""
+
+
+class CircuitBreaker:
+    """Thread-safe breaker over the last `window` requests to one source.
+
+    A request counts as failed if it raises or takes longer than `slow_seconds`.
+    Once at least `min_calls` outcomes are recorded and the failed share reaches
+    `error_rate`, the breaker opens for `cooldown_seconds`.
+    """
+
+    def __init__(self, name: str, error_rate: float = 0.5, min_calls: int = 5, window: int = 20,
+                 slow_seconds: float = 8.0, cooldown_seconds: float = 30.0):
+        self.name = name
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.slow_seconds = slow_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self._outcomes = deque(maxlen=max(1, window))  # True = failed or slow
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        SOURCE_CIRCUIT.set(0, source=name)
+
+    def _current(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.cooldown_seconds:
+            return HALF_OPEN
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current(time.monotonic())
+
+    @property
+    def is_open(self) -> bool:
+        """True while requests are refused outright (a half-open breaker still lets its probe through)"""
+        return self.state == OPEN
+
+    def _set(self, state: str, now: float):
+        if state != self._state:
+            logger.warning(f"{self.name} circuit {self._state} -> {state}")
+        self._state = state
+        if state == OPEN:
+            self._opened_at = now
+        SOURCE_CIRCUIT.set(_STATE_VALUES[state], source=self.name)
+
+    def _admit(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            state = self._current(now)
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                self._set(HALF_OPEN, now)
+                return True
+            return False
+
+    def record(self, failed: bool):
+        with self._lock:
+            now = time.monotonic()
+            if self._probing:
+                self._probing = False
+                self._outcomes.clear()
+                self._set(OPEN if failed else CLOSED, now)
+                return
+            if self._state != CLOSED:
+                return  # a request admitted before the breaker opened
+            self._outcomes.append(failed)
+            if len(self._outcomes) >= self.min_calls and sum(self._outcomes) / len(self._outcomes) >= self.error_rate:
+                self._outcomes.clear()
+                self._set(OPEN, now)
+
+    @contextmanager
+    def guard(self):
+        """Wrap one network request: raises CircuitOpen if refused, records the outcome otherwise"""
+        if not self._admit():
+            raise CircuitOpen(f"{self.name}: circuit open")
+        t0 = time.monotonic()
+        failed = True
+        try:
+            yield
+            failed = time.monotonic() - t0 > self.slow_seconds
+        finally:
+            self.record(failed)
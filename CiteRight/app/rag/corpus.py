@@ -0,0 +1,173 @@
+"""
+Persistent corpus registry for CiteRight-Multiverse
+
+Tracks which source documents are already embedded in the vectorstore, keyed by
+(source, doc_id, revision), and which (source, query) searches were run recently,
+so /query only fetches and embeds content that is missing or stale. Local files
+get a manifest of (path, size, mtime, content hash) for the same purpose.
+"""
+import sqlite3
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+# New-style (2101.00001) and old-style (solv-int/9901001, math.GT/0309136) arXiv ids,
+# optionally prefixed by "arXiv:" or an abs/pdf URL and followed by a version
+_ARXIV_ID = re.compile(
+    r"^(?:arxiv:|https?://(?:www\.)?arxiv\.org/(?:abs|pdf)/)?"
+    r"(\d{4}\.\d{4,5}|[a-z][a-z\-]*(?:\.[a-z]{2})?/\d{7})(v\d+)?(?:\.pdf)?$",
+    re.IGNORECASE
+)
+
+
+def split_arxiv_id(paper_id: str) -> Tuple[str, str]:
+    """Split an arXiv id into (base id, version); version is "" when absent"""
+    paper_id = (paper_id or "").strip()
+    match = _ARXIV_ID.match(paper_id)
+    if not match:
+        return paper_id, ""
+    return match.group(1), match.group(2) or ""
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query string for use as a fetch-log key"""
+    return " ".join((query or "").lower().split())
+
+
+def document_key(item: Dict[str, Any]) -> Tuple[str, str, str]:
+    """Return the (source, doc_id, revision) key for a fetched content item"""
+    origin = item.get('origin', 'Unknown')
+    meta = item.get('metadata', {}) or {}
+
+    if origin == 'Wikipedia':
+        return "wikipedia", str(meta.get('page_id') or item.get('source', '')), str(meta.get('revision_id') or '')
+    if origin == 'StackExchange':
+        return "stackexchange", str(meta.get('question_id') or item.get('source', '')), str(meta.get('last_activity_date') or '')
+    if origin == 'arXiv':
+        base_id, version = split_arxiv_id(str(meta.get('arxiv_id') or item.get('source', '')))
+        return "arxiv", base_id, version or str(meta.get('updated') or '')
+    if origin == 'Wikidata':
+        return "wikidata", str(meta.get('entity_id') or item.get('source', '')), str(meta.get('revision_id') or '')
+
+    # Anything else is identified by its source name and revisioned by content
+    digest = hashlib.sha1(item.get('content', '').encode('utf-8')).hexdigest()[:16]
+    return origin.lower().replace(' ', '_'), str(item.get('source', 'unknown')), digest
+
+
+def chunk_ids_for(key: Tuple[str, str, str], num_chunks: int) -> List[str]:
+    """Deterministic vectorstore ids for the chunks of a document revision"""
+    source, doc_id, revision = key
+    return [f"{source}:{doc_id}:{revision}:{i}" for i in range(num_chunks)]
+
+
+class CorpusRegistry:
+    def __init__(self, path: str, ttl_seconds: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._init()
+
+    def _init(self):
+        with self._lock, self._con:
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "source TEXT, doc_id TEXT, revision TEXT, fetched_at REAL, chunk_ids TEXT, "
+                "PRIMARY KEY (source, doc_id))"
+            )
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS fetches ("
+                "source TEXT, query TEXT, max_items INTEGER, fetched_at REAL, "
+                "PRIMARY KEY (source, query))"
+            )
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT, chunk_ids TEXT)"
+            )
+
+    def get(self, source: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Return the registry entry for a document, if any"""
+        with self._lock:
+            row = self._con.execute(
+                "SELECT revision, fetched_at, chunk_ids FROM documents WHERE source=? AND doc_id=?",
+                (source, doc_id)
+            ).fetchone()
+        if not row:
+            return None
+        return {"revision": row[0], "fetched_at": row[1], "chunk_ids": json.loads(row[2])}
+
+    def is_fresh(self, source: str, doc_id: str) -> bool:
+        """True if the document was fetched within the TTL and need not be refetched"""
+        entry = self.get(source, doc_id)
+        return bool(entry) and (time.time() - entry["fetched_at"]) < self.ttl_seconds
+
+    def upsert(self, key: Tuple[str, str, str], chunk_ids: List[str]):
+        source, doc_id, revision = key
+        with self._lock, self._con:
+            self._con.execute(
+                "REPLACE INTO documents (source, doc_id, revision, fetched_at, chunk_ids) VALUES (?,?,?,?,?)",
+                (source, doc_id, revision, time.time(), json.dumps(chunk_ids))
+            )
+
+    def touch(self, source: str, doc_id: str):
+        """Mark an unchanged document as freshly fetched"""
+        with self._lock, self._con:
+            self._con.execute(
+                "UPDATE documents SET fetched_at=? WHERE source=? AND doc_id=?",
+                (time.time(), source, doc_id)
+            )
+
+    def recent_fetch(self, source: str, query: str, max_items: int) -> bool:
+        """True if this source was already searched for this query within the TTL"""
+        with self._lock:
+            row = self._con.execute(
+                "SELECT max_items, fetched_at FROM fetches WHERE source=? AND query=?",
+                (source, normalize_query(query))
+            ).fetchone()
+        return bool(row) and row[0] >= max_items and (time.time() - row[1]) < self.ttl_seconds
+
+    def record_fetch(self, source: str, query: str, max_items: int):
+        with self._lock, self._con:
+            self._con.execute(
+                "REPLACE INTO fetches (source, query, max_items, fetched_at) VALUES (?,?,?,?)",
+                (source, normalize_query(query), max_items, time.time())
+            )
+
+    def get_file(self, path: str) -> Optional[Dict[str, Any]]:
+        """Manifest entry for an ingested local file, if any"""
+        with self._lock:
+            row = self._con.execute(
+                "SELECT size, mtime_ns, digest, chunk_ids FROM files WHERE path=?", (path,)
+            ).fetchone()
+        if not row:
+            return None
+        return {"size": row[0], "mtime_ns": row[1], "digest": row[2], "chunk_ids": json.loads(row[3])}
+
+    def upsert_file(self, path: str, size: int, mtime_ns: int, digest: str, chunk_ids: List[str]):
+        with self._lock, self._con:
+            self._con.execute(
+                "REPLACE INTO files (path, size, mtime_ns, digest, chunk_ids) VALUES (?,?,?,?,?)",
+                (path, size, mtime_ns, digest, json.dumps(chunk_ids))
+            )
+
+    def files_under(self, directory: str) -> List[str]:
+        """Manifest paths inside a directory"""
+        prefix = directory.rstrip("/") + "/"
+        with self._lock:
+            rows = self._con.execute(
+                "SELECT path FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def delete_file(self, path: str):
+        with self._lock, self._con:
+            self._con.execute("DELETE FROM files WHERE path=?", (path,))
+
+    def clear_all(self):
+        with self._lock, self._con:
+            self._con.execute("DELETE FROM documents")
+            self._con.execute("DELETE FROM fetches")
+            self._con.execute("DELETE FROM files")
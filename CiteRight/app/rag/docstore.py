@@ -0,0 +1,167 @@
+"""
+SQLite-backed docstore for CiteRight-Multiverse
+
+Chunk text and metadata live in the current index snapshot's `docs.sqlite`, which
+is opened read-only and queried by id on demand, so startup doesn't unpickle the
+whole corpus and several workers share the same page cache. Chunks added or
+deleted since that snapshot are held in an in-memory overlay (they are also in the
+index log); the next snapshot writes a new database from the old one plus the
+overlay and the docstore is rebased onto it.
+
+Each chunk also keeps the float32 vector it was added to the index with, so
+rebuilding a lossy (IVF-PQ) index retrains on the original embeddings rather than
+on vectors reconstructed from its codes. Databases written before the column
+existed are migrated by the next snapshot; until then their vectors are missing.
+"""
+import os
+import shutil
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+import numpy as np
+import orjson
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain.docstore.document import Document
+
+_SCHEMA = "CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, text TEXT, metadata BLOB, vector BLOB) WITHOUT ROWID"
+_VECTOR_BATCH = 500  # ids per SELECT ... IN (...) when reading vectors
+
+
+def _has_vectors(con: sqlite3.Connection) -> bool:
+    return "vector" in {row[1] for row in con.execute("PRAGMA table_info(docs)")}
+
+
+def _open_read_only(path: str) -> sqlite3.Connection:
+    con = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+    con.execute("PRAGMA mmap_size=268435456")  # read through the page cache, not private buffers
+    return con
+
+
+class SqliteDocstore(Docstore, AddableMixin):
+    def __init__(self, path: Optional[str] = None):
+        self._lock = threading.Lock()
+        self.path = path
+        self._con = _open_read_only(path) if path else None
+        self._added: Dict[str, Document] = {}
+        self._deleted: Set[str] = set()  # ids hidden from the base database
+        self._vectors: Dict[str, bytes] = {}  # float32 vectors of added chunks, and backfilled ones
+        self._base_vectors = self._con is not None and _has_vectors(self._con)
+        # Live documents, kept up to date by add/delete; a rebase doesn't change it
+        self._count = self._con.execute("SELECT COUNT(*) FROM docs").fetchone()[0] if self._con else 0
+
+    def _base_get(self, doc_id: str) -> Optional[Document]:
+        if self._con is None:
+            return None
+        with self._lock:
+            row = self._con.execute("SELECT text, metadata FROM docs WHERE id=?", (doc_id,)).fetchone()
+        return Document(page_content=row[0], metadata=orjson.loads(row[1])) if row else None
+
+    def search(self, search: str) -> Union[str, Document]:
+        doc = self._added.get(search)
+        if doc is None and search not in self._deleted:
+            doc = self._base_get(search)
+        return doc if doc is not None else f"ID {search} not found."
+
+    def __contains__(self, doc_id: str) -> bool:
+        return isinstance(self.search(doc_id), Document)
+
+    def add(self, texts: Dict[str, Document], vectors: Optional[Dict[str, np.ndarray]] = None) -> None:
+        overlapping = [i for i in texts if i in self]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        for doc_id, doc in texts.items():
+            self._deleted.discard(doc_id)
+            self._added[doc_id] = doc
+        self._count += len(texts)
+        if vectors:
+            self.set_vectors(vectors)
+
+    def set_vectors(self, vectors: Dict[str, np.ndarray]) -> None:
+        """Record the index vectors of stored chunks (caller holds the index lock)"""
+        for doc_id, vector in vectors.items():
+            self._vectors[doc_id] = np.asarray(vector, dtype=np.float32).tobytes()
+
+    def vectors(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """Stored float32 vectors by id; ids without one (or not stored) are left out"""
+        found = {i: self._vectors[i] for i in ids if i in self._vectors}
+        wanted = [i for i in ids if i not in found and i not in self._deleted and i not in self._added]
+        if self._base_vectors and wanted:
+            with self._lock:
+                for start in range(0, len(wanted), _VECTOR_BATCH):
+                    batch = wanted[start:start + _VECTOR_BATCH]
+                    found.update(self._con.execute(
+                        f"SELECT id, vector FROM docs WHERE vector IS NOT NULL AND id IN ({','.join('?' * len(batch))})",
+                        batch
+                    ).fetchall())
+        return {i: np.frombuffer(v, dtype=np.float32) for i, v in found.items()}
+
+    def delete(self, ids: List) -> None:
+        for doc_id in ids:
+            self._vectors.pop(doc_id, None)
+            if self._added.pop(doc_id, None) is not None or (
+                doc_id not in self._deleted and self._base_get(doc_id) is not None
+            ):
+                self._count -= 1
+            self._deleted.add(doc_id)
+
+    def items(self) -> Iterator[Tuple[str, Document]]:
+        """Every stored (id, Document); reads the whole base database"""
+        if self._con is not None:
+            with self._lock:
+                rows = self._con.execute("SELECT id, text, metadata FROM docs").fetchall()
+            for doc_id, text, metadata in rows:
+                if doc_id not in self._deleted and doc_id not in self._added:
+                    yield doc_id, Document(page_content=text, metadata=orjson.loads(metadata))
+        yield from list(self._added.items())
+
+    def __len__(self) -> int:
+        return self._count
+
+    # Snapshots
+
+    def pending(self) -> Tuple[Optional[str], Dict[str, Document], Set[str], Dict[str, bytes]]:
+        """(base database, copy of the overlay) for `write` (caller holds the index lock)"""
+        return self.path, dict(self._added), set(self._deleted), dict(self._vectors)
+
+    @staticmethod
+    def write(path: str, base: Optional[str], added: Dict[str, Document], deleted: Set[str],
+              vectors: Dict[str, bytes]):
+        """Write a base database plus an overlay captured by `pending` to a new file"""
+        if base:
+            shutil.copyfile(base, path)
+        con = sqlite3.connect(path)
+        try:
+            with con:
+                con.execute(_SCHEMA)
+                if not _has_vectors(con):
+                    con.execute("ALTER TABLE docs ADD COLUMN vector BLOB")
+                con.executemany("DELETE FROM docs WHERE id=?", ((i,) for i in deleted))
+                con.executemany(
+                    "REPLACE INTO docs (id, text, metadata, vector) VALUES (?,?,?,?)",
+                    ((i, d.page_content, orjson.dumps(d.metadata, default=str), vectors.get(i))
+                     for i, d in added.items())
+                )
+                con.executemany(
+                    "UPDATE docs SET vector=? WHERE id=?",
+                    ((v, i) for i, v in vectors.items() if i not in added)
+                )
+        finally:
+            con.close()
+        with open(path, "rb+") as f:
+            os.fsync(f.fileno())
+
+    def rebase(self, path: str, added: Dict[str, Document], deleted: Set[str], vectors: Dict[str, bytes]):
+        """Switch to a database written by `write`; keep only overlay changes made after capture"""
+        con = _open_read_only(path)
+        with self._lock:
+            old, self._con, self.path = self._con, con, path
+            self._base_vectors = _has_vectors(con)
+        for doc_id, doc in added.items():
+            if self._added.get(doc_id) is doc:
+                del self._added[doc_id]
+        for doc_id, vector in vectors.items():
+            if self._vectors.get(doc_id) is vector:
+                del self._vectors[doc_id]
+        self._deleted -= deleted
+        if old is not None:
+            old.close()
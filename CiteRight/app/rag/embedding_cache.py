@@ -0,0 +1,124 @@
+"""
+Query embedding cache for CiteRight-Multiverse
+
+In-process LRU of query vectors keyed by (embedding model, normalized text), with an
+optional sqlite spill file so vectors survive restarts. The spill file is an LRU too,
+bounded at `spill_maxsize` rows. Retrieval, the answer cache and grounding checks can
+all share one embedding per query.
+"""
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Unicode- and whitespace-normalize a query (case is kept: it can change the embedding)"""
+    return " ".join(unicodedata.normalize("NFKC", text or "").split())
+
+
+class QueryEmbeddingCache:
+    def __init__(self, embed_fn: Callable[[str], List[float]], model_name: str,
+                 maxsize: int = 1024, spill_path: Optional[str] = None, spill_maxsize: int = 100000):
+        self.embed_fn = embed_fn
+        self.model_name = model_name
+        self.maxsize = maxsize
+        self.spill_maxsize = spill_maxsize
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._con = None
+        self._spilled = 0
+        if spill_path:
+            self._con = sqlite3.connect(spill_path, check_same_thread=False)
+            with self._con:
+                self._con.execute(
+                    "CREATE TABLE IF NOT EXISTS query_embeddings "
+                    "(model TEXT, text TEXT, vector BLOB, last_access REAL, PRIMARY KEY (model, text))"
+                )
+                columns = {r[1] for r in self._con.execute("PRAGMA table_info(query_embeddings)")}
+                if "last_access" not in columns:
+                    # Spill files written before the size bound: treat every row as equally old
+                    self._con.execute("ALTER TABLE query_embeddings ADD COLUMN last_access REAL DEFAULT 0")
+                self._con.execute("CREATE INDEX IF NOT EXISTS query_embeddings_lru ON query_embeddings (last_access)")
+            self._spilled = self._con.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+            with self._con:
+                self._evict()
+
+    def embed(self, text: str) -> np.ndarray:
+        """Return the (read-only, float32) embedding of a query, computing it at most once"""
+        key = normalize_text(text)
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return vector
+            if self._con is not None:
+                row = self._con.execute(
+                    "SELECT vector FROM query_embeddings WHERE model=? AND text=?",
+                    (self.model_name, key)
+                ).fetchone()
+                if row:
+                    self.disk_hits += 1
+                    with self._con:
+                        self._con.execute(
+                            "UPDATE query_embeddings SET last_access=? WHERE model=? AND text=?",
+                            (time.time(), self.model_name, key)
+                        )
+                    return self._remember(key, np.frombuffer(row[0], dtype=np.float32))
+
+        # Encode outside the lock so concurrent misses don't serialize on the model
+        vector = np.asarray(self.embed_fn(key), dtype=np.float32)
+        with self._lock:
+            self.misses += 1
+            if self._con is not None:
+                with self._con:
+                    inserted = self._con.execute(
+                        "INSERT OR IGNORE INTO query_embeddings (model, text, vector, last_access) VALUES (?,?,?,?)",
+                        (self.model_name, key, vector.tobytes(), time.time())
+                    ).rowcount
+                    self._spilled += inserted
+                    self._evict()
+            return self._remember(key, vector)
+
+    def _evict(self):
+        """Drop the least recently used spilled vectors beyond `spill_maxsize` (lock and transaction held)"""
+        if self._spilled <= self.spill_maxsize:
+            return
+        self._spilled -= self._con.execute(
+            "DELETE FROM query_embeddings WHERE rowid IN "
+            "(SELECT rowid FROM query_embeddings ORDER BY last_access LIMIT ?)",
+            (self._spilled - self.spill_maxsize,)
+        ).rowcount
+
+    def _remember(self, key: str, vector: np.ndarray) -> np.ndarray:
+        vector.setflags(write=False)
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+        return vector
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "size": len(self._lru),
+                "spilled": self._spilled
+            }
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            if self._con is not None:
+                with self._con:
+                    self._con.execute("DELETE FROM query_embeddings")
+                self._spilled = 0
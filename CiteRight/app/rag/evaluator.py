@@ -1,11 +1,11 @@
 """
 Post-generation evaluation and auditing layer for CiteRight-Multiverse
 """
-import requests
 import json
 import logging
 from typing import Dict, Any, List
 from app.config import settings
+from app.deps import ollama_client
 
 logger = logging.getLogger(__name__)
 
@@ -53,7 +53,7 @@ Follow all citation and license rules from CiteRight-Multiverse.
 IMPORTANT: Return ONLY valid JSON. Do not include any text before or after the JSON object."""
 
 
-def evaluate_answer(query: str, context: str, previous_response: str) -> Dict[str, Any]:
+async def evaluate_answer(query: str, context: str, previous_response: str) -> Dict[str, Any]:
     """
     Evaluate and enhance the generated answer using the evaluator prompt
     
@@ -80,8 +80,8 @@ def evaluate_answer(query: str, context: str, previous_response: str) -> Dict[st
             }
         }
         
-        response = requests.post(
-            f"{settings.OLLAMA_HOST}/api/generate",
+        response = await ollama_client().post(
+            "/api/generate",
             json=payload,
             timeout=180
         )
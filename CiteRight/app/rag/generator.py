@@ -1,5 +1,8 @@
-import requests
+import hashlib
+import json
+from typing import AsyncIterator
 from app.config import settings
+from app.deps import ollama_client
 
 PROMPT = (
     "You are CiteRight-Multiverse, a local retrieval-augmented assistant designed for offline factual synthesis.\n\n"
@@ -24,16 +27,36 @@ PROMPT = (
     "User Query:\n{query}\n\n"
     "Respond using only the retrieved information and follow all citation and licensing rules above."
 )
+# Part of the answer cache scope, so editing the prompt retires answers generated with the old one
+PROMPT_VERSION = hashlib.sha256(PROMPT.encode("utf-8")).hexdigest()[:12]
 
 
-def generate_with_ollama(query: str, context: str) -> str:
-    payload = {
+def _payload(query: str, context: str, stream: bool) -> dict:
+    return {
         "model": settings.OLLAMA_MODEL,
         "prompt": PROMPT.format(context=context, query=query),
-        "stream": False,
+        "stream": stream,
         "options": {"temperature": 0.2}
     }
-    r = requests.post(f"{settings.OLLAMA_HOST}/api/generate", json=payload, timeout=120)
+
+
+async def generate_with_ollama(query: str, context: str) -> str:
+    r = await ollama_client().post("/api/generate", json=_payload(query, context, False))
     r.raise_for_status()
     return r.json().get("response", "")
 
+
+async def stream_with_ollama(query: str, context: str) -> AsyncIterator[str]:
+    """Yield response tokens as Ollama produces them (its stream is NDJSON, one object per token)"""
+    async with ollama_client().stream("POST", "/api/generate", json=_payload(query, context, True)) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            token = chunk.get("response", "")
+            if token:
+                yield token
+            if chunk.get("done"):
+                break
+
@@ -0,0 +1,349 @@
+"""
+Write-behind persistence for the CiteRight-Multiverse indexes
+
+Chunk additions (with their embeddings, so replay never re-embeds) and deletions
+are appended to a write-ahead log instead of rewriting the FAISS index, docstore
+and BM25 index on every ingest. Once the log grows past a size or age limit, a
+compacted snapshot is written in the background into a fresh versioned directory
+and made current by atomically replacing the CURRENT pointer; the log segments it
+covers are then deleted. On startup the current snapshot is loaded and the log is
+replayed on top of it.
+
+Snapshots are opened without deserializing the corpus: the vector index is
+memory-mapped (changes since go to an in-memory delta index), and chunk text,
+metadata and BM25 postings stay in the snapshot's SQLite databases, read by id or
+term. Each of them keeps later changes in an overlay until the next snapshot.
+
+Layout under the index directory:
+    CURRENT                      name of the current snapshot
+    snapshots/snap-<seq>-<ns>/   index.faiss, docs.sqlite, ids.json (position -> chunk id),
+                                 bm25.sqlite, meta.json
+    wal.log, wal-<seq>.log       live log segment, segments rotated out by snapshots
+"""
+import base64
+import logging
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+import orjson
+from app.rag.bm25_index import BM25Index
+from app.rag import ann_index
+from app.rag.ann_index import add_vectors, remove_vectors, rebuild_if_needed, read_index
+from app.rag.docstore import SqliteDocstore
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("<II")  # payload length, crc32 of payload
+_KEEP_SNAPSHOTS = 2
+
+
+def apply_record(vs, bm25: BM25Index, record: Dict[str, Any]):
+    """Apply one logged change to the in-memory indexes"""
+    if record["op"] == "add":
+        vectors = np.frombuffer(base64.b64decode(record["vectors"]), dtype=np.float32).reshape(len(record["ids"]), -1)
+        add_vectors(vs, record["texts"], vectors, record["metadatas"], record["ids"])
+        bm25.add(record["ids"], record["texts"])
+    elif record["op"] == "delete":
+        existing = [i for i in record["ids"] if i in vs.docstore]
+        if existing:
+            remove_vectors(vs, existing)
+            bm25.delete(existing)
+
+
+def add_record(ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]], vectors) -> Dict[str, Any]:
+    return {
+        "op": "add",
+        "ids": ids,
+        "texts": texts,
+        "metadatas": metadatas,
+        # float32 like the FAISS index itself; a quarter of the size of JSON floats
+        "vectors": base64.b64encode(np.asarray(vectors, dtype=np.float32).tobytes()).decode("ascii")
+    }
+
+
+class ReadWriteLock:
+    """Shared for readers, exclusive for one writer; waiting writers hold off new readers.
+
+    Not reentrant: a thread must not take either side while it holds one.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+def _fsync_dir(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class IndexStore:
+    def __init__(self, root: str, snapshot_seconds: float, snapshot_wal_bytes: int):
+        self.root = Path(root)
+        self.snapshot_seconds = snapshot_seconds
+        self.snapshot_wal_bytes = snapshot_wal_bytes
+        (self.root / "snapshots").mkdir(parents=True, exist_ok=True)
+        self.wal_path = self.root / "wal.log"
+        # Held while the indexes change and the change is logged, and while a snapshot is serialized
+        self.lock = threading.RLock()
+        # Searches hold the read side; the in-memory indexes only change under the write side
+        self.search_lock = ReadWriteLock()
+        self._seq = 0
+        self._wal = None
+        self._wal_bytes = 0
+        self._last_snapshot = time.monotonic()
+        self._snapshot_thread: Optional[threading.Thread] = None
+        self._generation = 0  # bumped by reset() so snapshots of replaced indexes are dropped
+        # Serializes writing snapshot files; CURRENT only ever moves to a later snapshot
+        self._write_lock = threading.Lock()
+        self._current: Optional[str] = None
+
+    # Loading
+
+    def load(self, embeddings) -> Optional[Tuple[Any, Optional[BM25Index], int]]:
+        """(vectorstore, bm25 index, log sequence it includes) of the current snapshot, or None"""
+        from langchain_community.vectorstores import FAISS
+        try:
+            name = (self.root / "CURRENT").read_text().strip()
+        except FileNotFoundError:
+            return None
+        self._current = name
+        snap = self.root / "snapshots" / name
+        if (snap / "faiss").is_dir():
+            # Written before the SQLite docstore; converted by the next snapshot
+            vs = FAISS.load_local(str(snap / "faiss"), embeddings, allow_dangerous_deserialization=True)
+        else:
+            ids = orjson.loads((snap / "ids.json").read_bytes())
+            vs = FAISS(
+                embeddings,
+                read_index(str(snap / "index.faiss")),
+                SqliteDocstore(str(snap / "docs.sqlite")),
+                {p: i for p, i in enumerate(ids) if i is not None}
+            )
+        meta = orjson.loads((snap / "meta.json").read_bytes())
+        if (snap / "bm25.sqlite").exists():
+            bm25 = BM25Index(str(snap / "bm25.sqlite"))
+        else:
+            bm25 = BM25Index.from_pickle(str(snap / "bm25.pkl"))  # converted by the next snapshot
+        return vs, bm25, meta["seq"]
+
+    def _segments(self) -> List[Path]:
+        rotated = sorted(self.root.glob("wal-*.log"))
+        return rotated + ([self.wal_path] if self.wal_path.exists() else [])
+
+    def _read(self, path: Path) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """(end offset, record) for every intact record; stops at a torn or corrupt tail"""
+        with open(path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            length, crc = _HEADER.unpack_from(data, offset)
+            payload = data[offset + _HEADER.size:offset + _HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                logger.warning(f"Index log {path.name}: dropping torn record at byte {offset}")
+                return
+            offset += _HEADER.size + length
+            yield offset, orjson.loads(payload)
+
+    def replay(self, vs, bm25: BM25Index, after_seq: int) -> int:
+        """Apply logged changes newer than the snapshot, then open the log for appending; returns how many"""
+        applied = 0
+        self._seq = after_seq
+        good_end = 0
+        for path in self._segments():
+            for good_end, record in self._read(path):
+                if record["seq"] <= after_seq:
+                    continue
+                try:
+                    apply_record(vs, bm25, record)
+                    applied += 1
+                except Exception as e:
+                    logger.warning(f"Index log: skipping record {record['seq']}: {e}")
+                self._seq = record["seq"]
+        if self.wal_path.exists():
+            # Cut a torn tail so new records follow the last intact one
+            if good_end < self.wal_path.stat().st_size:
+                os.truncate(self.wal_path, good_end)
+            self._wal_bytes = good_end
+        self._wal = open(self.wal_path, "ab")
+        if applied:
+            logger.info(f"Replayed {applied} index log records")
+        return applied
+
+    # Writing
+
+    def append(self, record: Dict[str, Any]):
+        """Durably log one change (caller holds `lock`)"""
+        self._seq += 1
+        payload = orjson.dumps({**record, "seq": self._seq}, default=str)
+        self._wal.write(_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self._wal.flush()
+        os.fsync(self._wal.fileno())
+        self._wal_bytes += _HEADER.size + len(payload)
+
+    def snapshot_due(self) -> bool:
+        return self._wal_bytes > 0 and (
+            self._wal_bytes >= self.snapshot_wal_bytes
+            or time.monotonic() - self._last_snapshot >= self.snapshot_seconds
+        )
+
+    def maybe_snapshot(self, vs, bm25: BM25Index):
+        """Start a background snapshot if the log is big or old enough and none is running"""
+        if not self.snapshot_due():
+            return
+        with self.lock:
+            if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+                return
+            self._snapshot_thread = threading.Thread(
+                target=self._snapshot_safely, args=(vs, bm25, self._generation),
+                name="citeright-snapshot", daemon=True
+            )
+            self._snapshot_thread.start()
+
+    def _snapshot_safely(self, vs, bm25: BM25Index, generation: int):
+        try:
+            self.snapshot(vs, bm25, generation)
+        except Exception as e:
+            logger.error(f"Index snapshot failed (the log still has every change): {e}")
+
+    def snapshot(self, vs, bm25: BM25Index, generation: Optional[int] = None):
+        """Write a compacted snapshot of the current state and drop the log it covers"""
+        import faiss
+        with self.lock:
+            if generation is not None and generation != self._generation:
+                return
+            # Capture under the lock (writers wait, searches don't), then write unlocked:
+            # the base index is never modified, and later adds only extend the delta
+            seq = self._seq
+            rebuild_if_needed(vs, self.search_lock)  # type change, retraining or tombstone compaction
+            base, delta_vectors = vs.index, ann_index.delta_vectors(vs)
+            mapping = vs.index_to_docstore_id
+            ids_bytes = orjson.dumps([mapping.get(p) for p in range(base.ntotal + len(delta_vectors))])
+            docs_store, generation = vs.docstore, self._generation
+            docs_base, docs_added, docs_deleted, docs_vectors = docs_store.pending()
+            bm25_base, bm25_added, bm25_deleted = bm25.pending()
+            if self._wal is not None:
+                self._wal.close()
+                if self.wal_path.exists():
+                    os.replace(self.wal_path, self.root / f"wal-{seq:012d}.log")
+                self._wal = open(self.wal_path, "ab")
+            self._wal_bytes = 0
+            self._last_snapshot = time.monotonic()
+
+        # Unique even when a reset snapshots the same sequence again
+        name = f"snap-{seq:012d}-{time.time_ns()}"
+        with self._write_lock:
+            snapshots = self.root / "snapshots"
+            tmp = snapshots / f".tmp-{name}"
+            tmp.mkdir(parents=True)
+            SqliteDocstore.write(str(tmp / "docs.sqlite"), docs_base, docs_added, docs_deleted, docs_vectors)
+            BM25Index.write(str(tmp / "bm25.sqlite"), bm25_base, bm25_added, bm25_deleted)
+            faiss.write_index(ann_index.merged_index(base, delta_vectors), str(tmp / "index.faiss"))
+            with open(tmp / "index.faiss", "rb+") as f:
+                os.fsync(f.fileno())
+            for path, data in (
+                (tmp / "ids.json", ids_bytes),
+                (tmp / "meta.json", orjson.dumps({"seq": seq, "created_at": time.time()}))
+            ):
+                with open(path, "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp, snapshots / name)
+            if self._current is not None and self._current > name:
+                # A later snapshot finished first; this one is already superseded
+                shutil.rmtree(snapshots / name, ignore_errors=True)
+                return
+
+            pointer = self.root / "CURRENT.tmp"
+            with open(pointer, "w") as f:
+                f.write(name)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(pointer, self.root / "CURRENT")
+            _fsync_dir(self.root)
+            self._current = name
+
+            # Everything up to `seq` is in the snapshot now
+            for segment in self.root.glob("wal-*.log"):
+                if int(segment.stem.split("-")[1]) <= seq:
+                    segment.unlink()
+            older = sorted(p for p in snapshots.glob("snap-*") if p.name < name)
+            for old in older[:max(0, len(older) - (_KEEP_SNAPSHOTS - 1))]:
+                shutil.rmtree(old, ignore_errors=True)
+            for leftover in snapshots.glob(".tmp-*"):
+                if leftover.name < f".tmp-{name}":
+                    shutil.rmtree(leftover, ignore_errors=True)
+        logger.info(f"Index snapshot {name} written")
+
+        with self.lock:
+            if self._current != name or self._generation != generation:
+                return
+            # Serve from the new files, dropping the overlays (and delta vectors) they contain
+            with self.search_lock.write():
+                docs_store.rebase(str(snapshots / name / "docs.sqlite"), docs_added, docs_deleted, docs_vectors)
+                bm25.rebase(str(snapshots / name / "bm25.sqlite"), bm25_added, bm25_deleted)
+                if vs.index is base:
+                    ann_index.rebase(vs, str(snapshots / name / "index.faiss"), len(delta_vectors))
+
+    def reset(self, vs, bm25: BM25Index):
+        """Start over from (empty) indexes by snapshotting them right away.
+
+        The old log is only dropped by the snapshot once CURRENT points at the new
+        state, so a crash part-way through a reset restarts from the old one.
+        """
+        with self.lock:
+            self._generation += 1
+            self.snapshot(vs, bm25)
+
+    def close(self, vs, bm25: BM25Index):
+        """Snapshot pending changes so the next start has nothing to replay"""
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+        if self._wal_bytes > 0:
+            self.snapshot(vs, bm25)
+        with self.lock:
+            if self._wal is not None:
+                self._wal.close()
+                self._wal = None
@@ -0,0 +1,74 @@
+"""
+Index maintenance for CiteRight-Multiverse
+
+All chunk additions and deletions go through here so the FAISS vectorstore and the
+BM25 inverted index share chunk ids and never drift apart. Every change is applied
+in memory and appended to the index log, which makes it durable; full snapshots are
+written behind, see index_store. Changes are applied under the write side of the
+store's search lock, so retrieval never sees an index half-way through an update.
+"""
+import uuid
+from typing import Dict, Any, List, Optional
+from app.deps import vectorstore, bm25_index, reset_vectorstore, reset_bm25_index, embeddings, index_store
+from app.rag.index_store import add_record, apply_record
+
+
+def add_chunks(texts: List[str], metadatas: List[Dict[str, Any]], ids: Optional[List[str]] = None) -> List[str]:
+    """Embed and add chunks to both indexes; returns their chunk ids"""
+    if ids is None:
+        ids = [str(uuid.uuid4()) for _ in texts]
+    vectorstore()  # load the indexes before taking the lock
+    # Embed outside the lock; the vectors go into the log so replay never re-embeds
+    vectors = embeddings().embed_documents(list(texts))
+    record = add_record(ids, list(texts), list(metadatas), vectors)
+    store = index_store()
+    with store.lock:
+        # Read under the lock: a reset may have replaced the indexes since
+        vs, bm25 = vectorstore(), bm25_index()
+        with store.search_lock.write():
+            apply_record(vs, bm25, record)
+        store.append(record)
+    return ids
+
+
+def delete_chunks(ids: List[str]) -> List[str]:
+    """Remove chunks from both indexes; unknown ids are ignored"""
+    vectorstore()  # load the indexes before taking the lock
+    store = index_store()
+    with store.lock:
+        vs, bm25 = vectorstore(), bm25_index()
+        existing = [i for i in dict.fromkeys(ids) if i in vs.docstore]
+        if existing:
+            record = {"op": "delete", "ids": existing}
+            with store.search_lock.write():
+                apply_record(vs, bm25, record)
+            store.append(record)
+    return existing
+
+
+def missing_chunks(ids: List[str]) -> List[str]:
+    """The ids among these that are not in the index"""
+    vectorstore()  # load the indexes before taking the search lock
+    with index_store().search_lock.read():
+        docstore = vectorstore().docstore
+        return [i for i in ids if i not in docstore]
+
+
+def chunks_indexed(ids: List[str]) -> bool:
+    """Whether every one of these chunks is still in the index"""
+    return not missing_chunks(ids)
+
+
+def save_indexes():
+    """Changes are durable once logged; this only starts a background snapshot when one is due"""
+    index_store().maybe_snapshot(vectorstore(), bm25_index())
+
+
+def reset_indexes():
+    """Empty both indexes, in memory and on disk"""
+    vectorstore()  # make sure the old state is loaded before it is replaced
+    store = index_store()
+    with store.lock:
+        with store.search_lock.write():
+            vs, bm25 = reset_vectorstore(), reset_bm25_index()
+        store.reset(vs, bm25)
@@ -1,52 +1,225 @@
+"""
+Local file ingestion for CiteRight-Multiverse
+
+Files are tracked in the corpus registry's manifest by (path, size, mtime, content
+hash): unchanged files are skipped without being read, touched-but-identical files
+only update their manifest entry, and changed or deleted files have their old
+chunks removed.
+"""
+import hashlib
+import logging
+from concurrent.futures import FIRST_COMPLETED, wait
 from pathlib import Path
-from typing import Iterable
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from app.rag.utils import chunk_text
+from app.rag.indexing import add_chunks, delete_chunks, missing_chunks, save_indexes
+from app.rag.corpus import chunk_ids_for
+from app.rag.pdf_processor import PDFProcessor
 from app.config import settings
-from app.deps import vectorstore, embeddings
+from app.deps import corpus, load_executor, pdf_executor
+from app.jobs import report_progress
+
+logger = logging.getLogger(__name__)
+
+_INDEX_BATCH = 256  # chunks embedded and added per add_chunks call while streaming a PDF
+_SUPPORTED = {".txt", ".md", ".pdf"}
 
 
-def _read_file(p: Path) -> str:
+def _digest(p: Path) -> str:
+    h = hashlib.sha256()
+    with open(p, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_chunks(p: Path) -> List[Tuple[str, Dict[str, Any]]]:
+    """(chunk, extra metadata) for a supported file; PDF chunks carry their `page` (offsets are per page)"""
     suf = p.suffix.lower()
     if suf in {".txt", ".md"}:
-        return p.read_text(encoding="utf-8", errors="ignore")
-    # Simple PDF fallback via pypdf if you add it; here we keep text-only for portability
+        return chunk_text(p.read_text(encoding="utf-8", errors="ignore"))
+    if suf == ".pdf":
+        return [
+            (ch, {**span, "page": page_num})
+            for page_num, page_text in PDFProcessor().iter_pages(str(p), pdf_executor())
+            for ch, span in chunk_text(page_text)
+        ]
     raise ValueError(f"Unsupported file type: {p}")
 
 
-def ingest_paths(paths: Iterable[str]):
-    vs = vectorstore()
-    texts = []
-    metas = []
+def _load(p: Path, known_digest: Optional[str]) -> Tuple[str, Optional[List[Tuple[str, Dict[str, Any]]]]]:
+    """Hash a file and, unless the hash is already indexed, chunk it (runs on the load pool)"""
+    digest = _digest(p)
+    if digest == known_digest:
+        return digest, None
+    return digest, _read_chunks(p)
+
+
+def check_paths(paths: Iterable[str]):
+    """Raise ValueError for a path that doesn't exist or a file ingest_paths can't read"""
     for raw in paths:
         p = Path(raw)
+        if not p.exists():
+            raise ValueError(f"Path not found: {raw}")
+        if p.is_file() and p.suffix.lower() not in _SUPPORTED:
+            raise ValueError(f"Unsupported file type {p.suffix or '(none)'} for {raw}; expected one of {', '.join(sorted(_SUPPORTED))}")
+
+
+def ingest_paths(paths: Iterable[str]):
+    """Index new and changed .txt/.md/.pdf files under the given files and directories"""
+    registry = corpus()
+    files, dirs = [], []
+    for raw in paths:
+        p = Path(raw).resolve()
         if p.is_dir():
-            for f in p.rglob("*.txt"):
-                txt = _read_file(f)
-                for ch in chunk_text(txt):
-                    texts.append(ch)
-                    # Enhanced metadata for CiteRight-Multiverse
-                    metas.append({
-                        "source": f.name,
-                        "origin": "Local Document",
-                        "license": "Unknown",
-                        "url": "",
-                        "path": str(f)
-                    })
+            dirs.append(p)
+            files.extend(f for f in sorted(p.rglob("*")) if f.suffix.lower() in _SUPPORTED and f.is_file())
+        else:
+            files.append(p)
+    files = list(dict.fromkeys(files))
+    
+    # Cheap check first: same size and mtime as when it was indexed means unchanged
+    candidates = []
+    unchanged = 0
+    for f in files:
+        st = f.stat()
+        entry = registry.get_file(str(f))
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            unchanged += 1
         else:
-            txt = _read_file(p)
-            for ch in chunk_text(txt):
-                texts.append(ch)
-                # Enhanced metadata for CiteRight-Multiverse
-                metas.append({
-                    "source": p.name,
-                    "origin": "Local Document", 
+            candidates.append((f, st, entry))
+    
+    # Files that disappeared from an ingested directory lose their chunks
+    seen = {str(f) for f in files}
+    stale_ids = []
+    removed = 0
+    for d in dirs:
+        for path in registry.files_under(str(d)):
+            if path not in seen:
+                stale_ids.extend(registry.get_file(path)["chunk_ids"])
+                registry.delete_file(path)
+                removed += 1
+    if stale_ids:
+        delete_chunks(stale_ids)
+    
+    added = 0
+    indexed = 0
+    done = 0
+    # Files load on their own pool, at most two per thread ahead of indexing, so a big
+    # directory neither buffers every file's chunks nor starves the query pool
+    todo = iter(candidates)
+    loading = {}
+
+    def load_next():
+        c = next(todo, None)
+        if c is not None:
+            loading[load_executor().submit(_load, c[0], c[2]["digest"] if c[2] else None)] = c
+
+    try:
+        for _ in range(2 * settings.INGEST_LOAD_THREADS):
+            load_next()
+        while loading:
+            finished, _ = wait(loading, return_when=FIRST_COMPLETED)
+            for future in finished:
+                f, st, entry = loading.pop(future)
+                load_next()
+                digest, chunks = future.result()
+                done += 1
+                report_progress("fetch", done=done, total=len(candidates))
+                if chunks is None:
+                    # Touched but identical: keep its chunks, remember the new stat
+                    registry.upsert_file(str(f), st.st_size, st.st_mtime_ns, digest, entry["chunk_ids"])
+                    unchanged += 1
+                    continue
+
+                report_progress("chunk", done=added + len(chunks))
+                ids = chunk_ids_for(("local", str(f), digest[:16]), len(chunks))
+                metas = [{
+                    # Enhanced metadata for CiteRight-Multiverse
+                    "source": f.name,
+                    "origin": "Local Document",
                     "license": "Unknown",
                     "url": "",
-                    "path": str(p)
-                })
+                    "path": str(f),
+                    "chunk_index": i,
+                    **extra
+                } for i, (_, extra) in enumerate(chunks)]
+                # No progress reports (where cancellation strikes) until the manifest has the new ids.
+                # Drop the previous revision (and any leftovers with the same ids) before adding
+                stale_ids.extend(delete_chunks((entry["chunk_ids"] if entry else []) + ids))
+                if chunks:
+                    add_chunks([ch for ch, _ in chunks], metas, ids)
+                registry.upsert_file(str(f), st.st_size, st.st_mtime_ns, digest, ids)
+                added += len(chunks)
+                indexed += 1
+                report_progress("embed", done=added)
+    finally:
+        for future in loading:
+            future.cancel()
+
+    if added or stale_ids:
+        report_progress("index")
+        save_indexes()
+    return {"chunks_added": added, "files_indexed": indexed, "files_unchanged": unchanged, "files_removed": removed}
+
+def ingest_pdf(path: str, filename: str) -> Dict[str, Any]:
+    """Chunk and index a PDF on disk page by page, in bounded memory.
+
+    Pages are extracted in parallel on the PDF process pool and chunked as they
+    arrive; every chunk records its `page`. Chunks never span two pages. Chunk ids
+    come from the file's content hash, page and chunk index, so re-uploading the
+    same PDF adds nothing new, and a cancelled or failed job removes the chunks it added.
+    """
+    processor = PDFProcessor()
+    doc = processor.describe_pdf(path, filename)
+    base = {
+        "source": doc["source"],
+        "origin": doc["origin"],
+        "license": doc["license"],
+        "url": doc["url"],
+        "title": doc["title"],
+        "summary": doc["summary"],
+        **doc["metadata"]
+    }
+    page_count = doc["metadata"].get("page_count", 0)
+    prefix = f"pdf:{_digest(Path(path))[:16]}"
+    texts, metas, ids = [], [], []
+    added_ids: List[str] = []
+    chunks = 0
 
-    if texts:
-        vs.add_texts(texts=texts, metadatas=metas)
-        vs.save_local(settings.VECTOR_INDEX_PATH)
-    return {"chunks_added": len(texts)}
+    def flush():
+        new = set(missing_chunks(ids))
+        keep = [i for i, chunk_id in enumerate(ids) if chunk_id in new]
+        if keep:
+            # Recorded first so a failure inside add_chunks is cleaned up too (unknown ids are ignored)
+            added_ids.extend(ids[i] for i in keep)
+            add_chunks([texts[i] for i in keep], [metas[i] for i in keep], [ids[i] for i in keep])
 
+    try:
+        for page_num, page_text in processor.iter_pages(path, pdf_executor()):
+            report_progress("fetch", done=page_num, total=page_count)
+            for chunk, span in chunk_text(page_text):
+                metas.append({**base, **span, "chunk_index": chunks, "page": page_num})
+                ids.append(f"{prefix}:{page_num}:{chunks}")
+                texts.append(chunk)
+                chunks += 1
+            report_progress("chunk", done=chunks)
+            if len(texts) >= _INDEX_BATCH:
+                flush()
+                report_progress("embed", done=chunks)
+                texts, metas, ids = [], [], []
+        report_progress("chunk", total=chunks)
+        if texts:
+            flush()
+            report_progress("embed", done=chunks, total=chunks)
+    except Exception as e:
+        # Cancelled or failed: don't leave part of the document behind
+        if added_ids:
+            delete_chunks(added_ids)
+            logger.info(f"Ingest of {filename} stopped ({type(e).__name__}): removed its {len(added_ids)} new chunks")
+        raise
+    report_progress("index")
+    if added_ids:
+        save_indexes()
+    report_progress("index", done=1, total=1)
+    return {"chunks_added": len(added_ids), "chunks": chunks, "page_count": page_count}
@@ -1,20 +1,35 @@
 """
 Multi-source ingestion system for CiteRight-Multiverse
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Tuple
+from concurrent.futures import wait, FIRST_COMPLETED
+import contextvars
 import logging
-from pathlib import Path
+import time
 
 from app.rag.wikipedia_ingester import WikipediaIngester
 from app.rag.stackexchange_ingester import StackExchangeIngester
 from app.rag.arxiv_ingester import ArxivIngester
 from app.rag.wikidata_ingester import WikidataIngester
+from app.rag.corpus import document_key, chunk_ids_for, split_arxiv_id
 from app.rag.utils import chunk_text
-from app.deps import vectorstore
+from app.rag.indexing import add_chunks, delete_chunks, save_indexes
+from app.rag.rate_limit import Deadline
+from app.deps import corpus, fetch_executor, circuit_breaker, multiverse_ingester
+from app.metrics import track_source
+from app.jobs import report_progress
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Source name -> `origin` metadata value of the chunks it produces
+SOURCE_ORIGINS = {
+    'wikipedia': 'Wikipedia',
+    'stackexchange': 'StackExchange',
+    'arxiv': 'arXiv',
+    'wikidata': 'Wikidata'
+}
+
 class MultiSourceIngester:
     def __init__(self):
         """Initialize multi-source ingester"""
@@ -34,46 +49,87 @@ class MultiSourceIngester:
             
         all_content = []
         source_stats = {}
+        cached_sources = []
+        registry = corpus()
+        deadline_at = time.monotonic() + settings.INGEST_DEADLINE_SECONDS
+        pending = {}
         
         for source in sources:
+            if source not in SOURCE_ORIGINS:
+                logger.warning(f"Unknown source: {source}")
+                continue
+
+            # Searched recently: its results are already in the persistent index
+            if registry.recent_fetch(source, query, max_per_source):
+                cached_sources.append(source)
+                source_stats[source] = {"count": 0, "latency_ms": 0.0, "truncated": False, "degraded": False}
+                continue
+
+            ctx = contextvars.copy_context()
+            future = fetch_executor().submit(ctx.run, self._fetch_source, source, query, max_per_source, Deadline(deadline_at))
+            pending[future] = source
+
+        # Fetch all sources concurrently; stop waiting at the deadline
+        not_done = set(pending)
+        report_progress("fetch", done=0, total=len(pending))
+        while not_done:
+            finished, not_done = wait(not_done, timeout=max(0.0, deadline_at - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not finished:
+                break
+            report_progress("fetch", done=len(pending) - len(not_done))
+        done = set(pending) - not_done
+        for future in not_done:
+            future.cancel()
+            source = pending[future]
+            logger.warning(f"{source} missed the ingest deadline; skipping it for this query")
+            source_stats[source] = {"count": 0, "latency_ms": round(settings.INGEST_DEADLINE_SECONDS * 1000, 2),
+                                    "truncated": True, "degraded": circuit_breaker(source).is_open}
+
+        for future in done:
+            source = pending[future]
             try:
-                if source == 'wikipedia':
-                    content = self.wikipedia.search_and_ingest(query, max_per_source)
-                elif source == 'stackexchange':
-                    content = self.stackexchange.search_questions(query, max_per_source)
-                elif source == 'arxiv':
-                    content = self.arxiv.search_papers(query, max_per_source)
-                elif source == 'wikidata':
-                    content = self.wikidata.search_entities(query, max_per_source)
-                else:
-                    logger.warning(f"Unknown source: {source}")
-                    continue
-                    
-                source_stats[source] = len(content)
+                content, latency_ms, truncated, degraded = future.result()
+                source_stats[source] = {"count": len(content), "latency_ms": latency_ms, "truncated": truncated, "degraded": degraded}
                 all_content.extend(content)
-                
+                # A partial or cache-only answer is not recorded, so the next query asks the source again
+                if not truncated and not degraded:
+                    registry.record_fetch(source, query, max_per_source)
             except Exception as e:
                 logger.error(f"Failed to ingest from {source}: {e}")
-                source_stats[source] = 0
+                source_stats[source] = {"count": 0, "latency_ms": 0.0, "truncated": False, "degraded": False}
                 
-        # Process and chunk all content
-        processed_chunks = self._process_content_chunks(all_content)
-        
-        # Add to vectorstore
-        if processed_chunks:
-            vs = vectorstore()
-            texts = [chunk['content'] for chunk in processed_chunks]
-            metas = [chunk['metadata'] for chunk in processed_chunks]
-            
-            vs.add_texts(texts=texts, metadatas=metas)
-            vs.save_local(settings.VECTOR_INDEX_PATH)
+        # Chunk and embed only what is new or changed
+        total_chunks = self._index_content(all_content)
             
         return {
-            "total_chunks": len(processed_chunks),
+            "total_chunks": total_chunks,
             "source_stats": source_stats,
-            "sources_used": sources
+            "sources_used": sources,
+            "cached_sources": cached_sources
         }
     
+    def _fetch_source(self, source: str, query: str, max_per_source: int, deadline: Deadline):
+        """Fetch one source (runs on the fetch pool); returns (content, latency_ms, truncated, degraded).
+
+        `degraded` means the source's circuit breaker was open, so only cached payloads
+        were used; the query still retrieves whatever of the source is already indexed.
+        """
+        t0 = time.perf_counter()
+        breaker = circuit_breaker(source)
+        degraded = breaker.is_open
+        # Network requests are rate limited inside the ingesters, so cache hits cost no tokens
+        with track_source(source):
+            if source == 'wikipedia':
+                content = self.wikipedia.search_and_ingest(query, max_per_source, deadline=deadline)
+            elif source == 'stackexchange':
+                content = self.stackexchange.search_questions(query, max_per_source, deadline=deadline)
+            elif source == 'arxiv':
+                content = self.arxiv.search_papers(query, max_per_source)
+            elif source == 'wikidata':
+                content = self.wikidata.search_entities(query, max_per_source, deadline=deadline)
+        # Looping ingesters return what they have when the deadline hits
+        return content, round((time.perf_counter() - t0) * 1000, 2), deadline.expired, degraded or breaker.is_open
+    
     def ingest_specific_content(self, 
                               wikipedia_titles: List[str] = None,
                               stackexchange_questions: List[int] = None,
@@ -83,71 +139,127 @@ class MultiSourceIngester:
         
         all_content = []
         source_stats = {}
+        registry = corpus()
+        requested = sum(1 for ids in (wikipedia_titles, stackexchange_questions, arxiv_ids, wikidata_ids) if ids)
+        report_progress("fetch", done=0, total=requested)
         
-        # Wikipedia specific articles
+        def fetch(source: str, ingest):
+            content, source_stats[source] = self._fetch_specific(source, ingest)
+            all_content.extend(content)
+            report_progress("fetch", done=len(source_stats))
+
+        # Wikipedia specific articles: one batched revision lookup, then only changed pages
         if wikipedia_titles:
-            try:
+            def wikipedia():
+                revisions = self.wikipedia.get_revisions(wikipedia_titles)
+                stale_titles = []
                 for title in wikipedia_titles:
-                    article = self.wikipedia.get_article_by_title(title)
-                    if article:
-                        all_content.append(article)
-                source_stats['wikipedia'] = len([a for a in all_content if a.get('origin') == 'Wikipedia'])
-            except Exception as e:
-                logger.error(f"Failed to ingest Wikipedia articles: {e}")
-                source_stats['wikipedia'] = 0
+                    info = revisions.get(title)
+                    entry = registry.get("wikipedia", str(info['page_id'])) if info else None
+                    if entry and entry["revision"] == str(info['revision_id']):
+                        registry.touch("wikipedia", str(info['page_id']))
+                    else:
+                        stale_titles.append(title)
+                return self.wikipedia.get_articles_by_titles(stale_titles, revisions)
+            fetch('wikipedia', wikipedia)
         
         # StackExchange specific questions
         if stackexchange_questions:
-            try:
-                for question_id in stackexchange_questions:
-                    question = self.stackexchange.get_question_with_answers(question_id)
-                    if question:
-                        all_content.append(question)
-                source_stats['stackexchange'] = len([a for a in all_content if a.get('origin') == 'StackExchange'])
-            except Exception as e:
-                logger.error(f"Failed to ingest StackExchange questions: {e}")
-                source_stats['stackexchange'] = 0
+            fetch('stackexchange', lambda: self.stackexchange.get_questions_with_answers([
+                question_id for question_id in stackexchange_questions
+                if not registry.is_fresh("stackexchange", str(question_id))
+            ]))
         
         # arXiv specific papers
         if arxiv_ids:
-            try:
-                for paper_id in arxiv_ids:
-                    paper = self.arxiv.get_paper_by_id(paper_id)
-                    if paper:
-                        all_content.append(paper)
-                source_stats['arxiv'] = len([a for a in all_content if a.get('origin') == 'arXiv'])
-            except Exception as e:
-                logger.error(f"Failed to ingest arXiv papers: {e}")
-                source_stats['arxiv'] = 0
+            fetch('arxiv', lambda: self.arxiv.get_papers_by_ids([
+                paper_id for paper_id in arxiv_ids
+                if not registry.is_fresh("arxiv", split_arxiv_id(paper_id)[0])
+            ]))
         
         # Wikidata specific entities
         if wikidata_ids:
-            try:
-                for entity_id in wikidata_ids:
-                    entity = self.wikidata.get_entity_by_id(entity_id)
-                    if entity:
-                        all_content.append(entity)
-                source_stats['wikidata'] = len([a for a in all_content if a.get('origin') == 'Wikidata'])
-            except Exception as e:
-                logger.error(f"Failed to ingest Wikidata entities: {e}")
-                source_stats['wikidata'] = 0
+            fetch('wikidata', lambda: self.wikidata.get_entities_by_ids([
+                entity_id for entity_id in wikidata_ids if not registry.is_fresh("wikidata", entity_id)
+            ]))
         
-        # Process and chunk all content
-        processed_chunks = self._process_content_chunks(all_content)
-        
-        # Add to vectorstore
-        if processed_chunks:
-            vs = vectorstore()
-            texts = [chunk['content'] for chunk in processed_chunks]
-            metas = [chunk['metadata'] for chunk in processed_chunks]
-            
-            vs.add_texts(texts=texts, metadatas=metas)
-            vs.save_local(settings.VECTOR_INDEX_PATH)
+        # Chunk and embed only what is new or changed
+        total_chunks = self._index_content(all_content)
             
         return {
-            "total_chunks": len(processed_chunks),
+            "total_chunks": total_chunks,
             "source_stats": source_stats
         }
+
+    def _fetch_specific(self, source: str, ingest) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Run one source's part of ingest_specific_content; returns (content, stats shaped like ingest_from_sources')"""
+        t0 = time.perf_counter()
+        breaker = circuit_breaker(source)
+        degraded = breaker.is_open
+        try:
+            with track_source(source):
+                content = ingest()
+        except Exception as e:
+            logger.error(f"Failed to ingest specific {source} content: {e}")
+            content = []
+        return content, {
+            "count": len(content),
+            "latency_ms": round((time.perf_counter() - t0) * 1000, 2),
+            "truncated": False,
+            "degraded": degraded or breaker.is_open
+        }
+    
+    def _index_content(self, content_list: List[Dict[str, Any]]) -> int:
+        """Add new or changed content to the vectorstore, replacing outdated revisions"""
+        registry = corpus()
+        texts, metas, ids = [], [], []
+        stale_ids = []
+        indexed = []
+        seen = set()
+        
+        for done, item in enumerate(content_list, 1):
+            report_progress("chunk", done=done, total=len(content_list))
+            key = document_key(item)
+            if key in seen:
+                continue
+            seen.add(key)
+            
+            entry = registry.get(key[0], key[1])
+            if entry and entry["revision"] == key[2]:
+                # Same revision already embedded; just refresh its TTL
+                registry.touch(key[0], key[1])
+                continue
+                
+            chunks = self._process_content_chunks([item])
+            if not chunks:
+                continue
+            if entry:
+                stale_ids.extend(entry["chunk_ids"])
+                
+            chunk_ids = chunk_ids_for(key, len(chunks))
+            texts.extend(chunk['content'] for chunk in chunks)
+            metas.extend(chunk['metadata'] for chunk in chunks)
+            ids.extend(chunk_ids)
+            indexed.append((key, chunk_ids))
+        
+        if texts:
+            report_progress("embed", done=0, total=len(texts))
+        # No progress reports (where cancellation strikes) from here until the registry
+        # knows the new chunks, so a cancelled job never leaves unregistered chunks behind.
+        # Drop outdated revisions (and any leftovers with the same ids) before adding
+        stale_ids = delete_chunks(stale_ids + ids)
+        if texts:
+            add_chunks(texts, metas, ids)
+        for key, chunk_ids in indexed:
+            registry.upsert(key, chunk_ids)
+
+        if texts:
+            report_progress("embed", done=len(texts))
+        if texts or stale_ids:
+            report_progress("index")
+            save_indexes()
+            
+        return len(texts)
     
     def _process_content_chunks(self, content_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Process content list into chunks with proper metadata"""
@@ -158,7 +270,7 @@ class MultiSourceIngester:
                 # Chunk the content
                 chunks = chunk_text(item['content'])
                 
-                for i, chunk in enumerate(chunks):
+                for i, (chunk, span) in enumerate(chunks):
                     # Create metadata for each chunk
                     metadata = {
                         "source": item.get('source', 'unknown'),
@@ -169,6 +281,7 @@ class MultiSourceIngester:
                         "total_chunks": len(chunks),
                         "title": item.get('title', ''),
                         "summary": item.get('summary', ''),
+                        **span,
                         **item.get('metadata', {})
                     }
                     
@@ -189,13 +302,13 @@ class MultiSourceIngester:
             "wikipedia": {
                 "description": "Wikipedia articles",
                 "license": "CC BY-SA 3.0",
-                "api": "wikipedia library",
+                "api": "MediaWiki Action API",
                 "rate_limit": "Built-in throttling"
             },
             "stackexchange": {
                 "description": "StackExchange Q&A content",
                 "license": "CC BY-SA 4.0", 
-                "api": "StackAPI",
+                "api": "StackExchange API 2.3",
                 "rate_limit": "API key recommended"
             },
             "arxiv": {
@@ -218,10 +331,8 @@ def ingest_multiverse_content(query: str,
                             sources: List[str] = None,
                             max_per_source: int = 5) -> Dict[str, Any]:
     """Convenience function to ingest from multiple sources"""
-    ingester = MultiSourceIngester()
-    return ingester.ingest_from_sources(query, sources, max_per_source)
+    return multiverse_ingester().ingest_from_sources(query, sources, max_per_source)
 
 def ingest_specific_multiverse_content(**kwargs) -> Dict[str, Any]:
     """Convenience function to ingest specific content"""
-    ingester = MultiSourceIngester()
-    return ingester.ingest_specific_content(**kwargs)
+    return multiverse_ingester().ingest_specific_content(**kwargs)
@@ -2,16 +2,88 @@
 PDF processing module for CiteRight-Multiverse
 """
 import io
-from typing import List, Dict, Any
+from collections import deque
+from concurrent.futures import Executor
+from itertools import repeat
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from pypdf import PdfReader
 import logging
+from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+_PAGES_PER_TASK = 16  # pages extracted per worker task
+
+
+def _extract_pages(reader: PdfReader, start: int, stop: int) -> List[Tuple[int, str]]:
+    pages = []
+    for page_num in range(start, stop):
+        try:
+            pages.append((page_num + 1, reader.pages[page_num].extract_text() or ""))
+        except Exception as e:
+            logger.warning(f"Failed to extract text from page {page_num + 1}: {e}")
+    return pages
+
+
+def _extract_page_range(path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """(page number, text) for pages [start, stop) of a PDF on disk; runs in a worker process"""
+    return _extract_pages(PdfReader(path), start, stop)
+
+
 class PDFProcessor:
     def __init__(self):
         """Initialize PDF processor"""
         pass
+    
+    def iter_pages(self, path: str, executor: Optional[Executor] = None,
+                   in_flight: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """Yield (page number, text) for a PDF on disk, in page order.
+
+        With an executor, ranges of pages are extracted in parallel (each worker opens
+        the file itself, so no page content crosses the process boundary on the way in)
+        while earlier pages are already being consumed. At most `in_flight` ranges
+        (default twice PDF_WORKERS) are submitted ahead of the consumer, so a slow
+        consumer doesn't pile up extracted text for the whole document.
+        """
+        page_count = len(PdfReader(path).pages)
+        starts = range(0, page_count, _PAGES_PER_TASK)
+        stops = [min(start + _PAGES_PER_TASK, page_count) for start in starts]
+        if executor is None or len(starts) <= 1:
+            for pages in map(_extract_page_range, repeat(path), starts, stops):
+                yield from pages
+            return
+
+        ranges = iter(zip(starts, stops))
+        pending = deque()
+
+        def submit_next():
+            page_range = next(ranges, None)
+            if page_range is not None:
+                pending.append(executor.submit(_extract_page_range, path, *page_range))
+
+        try:
+            for _ in range(in_flight or 2 * settings.PDF_WORKERS):
+                submit_next()
+            while pending:
+                pages = pending.popleft().result()
+                submit_next()
+                yield from pages
+        finally:
+            for future in pending:
+                future.cancel()
+    
+    def describe_pdf(self, path: str, filename: str) -> Dict[str, Any]:
+        """Document-level fields (title, origin, PDF metadata) shared by every chunk of a PDF on disk"""
+        metadata = self._extract_metadata(PdfReader(path), filename)
+        return {
+            "title": metadata.get("title") or filename,
+            "summary": f"PDF Document: {filename}",
+            "url": "",
+            "source": filename,
+            "origin": "User Upload",
+            "license": "User Provided",
+            "metadata": metadata
+        }
         
     def process_pdf(self, pdf_content: bytes, filename: str = "uploaded.pdf") -> List[Dict[str, Any]]:
         """Process uploaded PDF content"""
@@ -21,15 +93,11 @@ class PDFProcessor:
             reader = PdfReader(pdf_stream)
             
             # Extract text from all pages
-            full_text = ""
-            for page_num, page in enumerate(reader.pages):
-                try:
-                    page_text = page.extract_text()
-                    if page_text.strip():
-                        full_text += f"\n\n--- Page {page_num + 1} ---\n\n{page_text}"
-                except Exception as e:
-                    logger.warning(f"Failed to extract text from page {page_num + 1}: {e}")
-                    continue
+            full_text = "".join(
+                f"\n\n--- Page {page_num} ---\n\n{page_text}"
+                for page_num, page_text in _extract_pages(reader, 0, len(reader.pages))
+                if page_text.strip()
+            )
             
             if not full_text.strip():
                 logger.warning("No text could be extracted from PDF")
@@ -0,0 +1,57 @@
+"""
+Token-bucket rate limiting for CiteRight-Multiverse source fetches
+"""
+import threading
+import time
+from typing import Optional
+
+
+class Deadline:
+    """Absolute time.monotonic() cutoff that remembers whether anyone gave up because of it"""
+
+    def __init__(self, at: float):
+        self.at = at
+        self.hit = False
+
+    def remaining(self) -> float:
+        return max(0.0, self.at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.hit or time.monotonic() >= self.at
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, deadline: Optional[Deadline] = None) -> bool:
+        """Take one token, waiting for it if needed.
+
+        Returns False without taking a token (and marks the deadline as hit) if it
+        would not be available before `deadline`.
+        """
+        if self.rate <= 0:
+            return True
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline.at:
+                deadline.hit = True
+                return False
+            time.sleep(wait)
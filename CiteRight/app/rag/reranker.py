@@ -7,7 +7,7 @@ class CrossEncoderReranker:
 
     def rerank(self, query: str, docs: List, top_k: int = 5):
         if not docs:
-            return []
+            return [], []
         pairs = [[query, d.page_content] for d in docs]
         scores = self.model.predict(pairs).tolist()
         ranked = sorted(zip(docs, scores), key=lambda x: x[1], reverse=True)
@@ -1,59 +1,114 @@
-from langchain_community.vectorstores import FAISS
-from rank_bm25 import BM25Okapi
-from typing import List, Tuple
+from langchain.docstore.document import Document
+from langchain_community.vectorstores.utils import DistanceStrategy
+from typing import List, Tuple, Optional, Set
 import numpy as np
-from app.deps import vectorstore, embeddings
+from app.deps import vectorstore, query_embeddings, bm25_index, index_store
+from app.rag import ann_index
 from app.config import settings
 
-_bm25 = None
-_bm25_docs = []
-_bm25_paths = []
 
-
-def _ensure_bm25():
-    global _bm25
-    if _bm25 is not None:
-        return _bm25
-    # Build BM25 corpus from FAISS docstore to keep things in sync
-    vs = vectorstore()
-    store = vs.docstore._dict  # {id: Document}
-    texts = []
-    paths = []
-    for _id, doc in store.items():
-        texts.append(doc.page_content)
-        paths.append(doc.metadata.get("source", "unknown"))
-    tokenized = [t.lower().split() for t in texts]
-    bm25 = BM25Okapi(tokenized)
-    global _bm25_docs, _bm25_paths
-    _bm25_docs, _bm25_paths, _bm25 = texts, paths, bm25
-    return _bm25
-
-
-def hybrid_search(query: str, k: int) -> List:
-    """Combine FAISS (dense) + BM25 (sparse), then dedupe and score-union."""
+def _dense_candidates(query: str, fetch_k: int) -> Tuple[List[str], np.ndarray]:
+    """FAISS search with a single query embedding; returns chunk ids and similarities"""
     vs = vectorstore()
+    if ann_index.ntotal(vs) == 0:
+        return [], np.zeros(0, dtype=np.float32)
+    vector = query_embeddings().embed(query)[None, :].copy()
+    if vs._normalize_L2:
+        import faiss
+        faiss.normalize_L2(vector)
+    with index_store().search_lock.read():
+        vs = vectorstore()
+        ids, sims = ann_index.search(vs, vector, fetch_k)
+    # Higher is better for fusion: negate L2 distances, keep inner products as-is
+    if vs.distance_strategy != DistanceStrategy.MAX_INNER_PRODUCT:
+        sims = -sims
+    return ids, sims
+
+
+def _sparse_candidates(query: str, fetch_k: int) -> Tuple[List[str], np.ndarray]:
+    """Top BM25 hits; returns chunk ids and scores in descending order"""
+    with index_store().search_lock.read():
+        ids, scores = bm25_index().get_scores(query)
+    if not ids:
+        return [], scores
+    top = np.argpartition(-scores, min(fetch_k, len(ids)) - 1)[:fetch_k]
+    top = top[np.argsort(-scores[top])]
+    return [ids[i] for i in top], scores[top]
+
+
+def _min_max(values: np.ndarray, present: np.ndarray) -> np.ndarray:
+    """Scale present values to [0, 1]; absent entries become 0"""
+    out = np.zeros_like(values)
+    if present.any():
+        lo, hi = values[present].min(), values[present].max()
+        out[present] = (values[present] - lo) / (hi - lo) if hi > lo else 1.0
+    return out
+
+
+def _fuse(dense: np.ndarray, sparse: np.ndarray, method: str, alpha: float, rrf_k: int) -> np.ndarray:
+    """Fused score per candidate from dense and sparse scores (NaN where a list lacks it)"""
+    has_dense, has_sparse = ~np.isnan(dense), ~np.isnan(sparse)
+    if method == "weighted":
+        return alpha * _min_max(dense, has_dense) + (1 - alpha) * _min_max(sparse, has_sparse)
+    # Reciprocal-rank fusion: ranks are taken among the scored candidates only
+    fused = np.zeros(len(dense), dtype=np.float32)
+    for scores, present in ((dense, has_dense), (sparse, has_sparse)):
+        idx = np.flatnonzero(present)
+        ranks = np.empty(len(idx), dtype=np.float32)
+        ranks[np.argsort(-scores[idx], kind="stable")] = np.arange(len(idx))
+        fused[idx] += 1.0 / (rrf_k + ranks + 1)
+    return fused
+
+
+def hybrid_search(query: str, k: int, origins: Optional[Set[str]] = None) -> List[Document]:
+    """Combine FAISS (dense) + BM25 (sparse) candidates with score-aware fusion.
+
+    Returns up to `k` copies of the matched chunks, ordered by fused score, with their
+    full metadata plus `chunk_id`, `dense_score`, `sparse_score` and `fusion_score`.
+    If `origins` is given, only chunks whose `origin` metadata is in it are returned.
+    """
+    vectorstore()  # load the indexes before any search lock is taken
+    fetch_k = k * 5 if origins else k
+
+    dense_ids, dense_sims = _dense_candidates(query, fetch_k)
+    sparse_ids, sparse_scores = _sparse_candidates(query, fetch_k)
+
+    # Union of both candidate lists is the id space everything below is vectorized over
+    all_ids = list(dict.fromkeys(dense_ids + sparse_ids))
+    if not all_ids:
+        return []
+    with index_store().search_lock.read():
+        docstore = vectorstore().docstore
+        docs = [docstore.search(i) for i in all_ids]
+    keep = np.array([
+        isinstance(d, Document) and (not origins or d.metadata.get("origin") in origins)
+        for d in docs
+    ])
+    position = {chunk_id: i for i, chunk_id in enumerate(all_ids)}
 
-    # Dense candidates
-    dense_docs = vs.similarity_search(query, k=k)
-
-    # Sparse candidates
-    bm25 = _ensure_bm25()
-    scores = bm25.get_scores(query.lower().split())
-    top_idx = np.argsort(scores)[::-1][:k]
-    sparse_docs = []
-    for i in top_idx:
-        from langchain.docstore.document import Document
-        sparse_docs.append(Document(page_content=_bm25_docs[i], metadata={"source": _bm25_paths[i], "bm25": float(scores[i])}))
-
-    # Merge by simple max-score heuristic (dense has implicit cosine sim via FAISS ordering)
-    merged = []
-    seen = set()
-    for d in dense_docs + sparse_docs:
-        key = (d.metadata.get("source", ""), d.page_content[:80])
-        if key in seen:
-            continue
-        seen.add(key)
-        merged.append(d)
-
-    return merged[:k]
+    n = len(all_ids)
+    dense = np.full(n, np.nan, dtype=np.float32)
+    sparse = np.full(n, np.nan, dtype=np.float32)
+    dense[[position[i] for i in dense_ids]] = dense_sims
+    sparse[[position[i] for i in sparse_ids]] = sparse_scores
+    dense[~keep] = np.nan
+    sparse[~keep] = np.nan
+    has_dense, has_sparse = ~np.isnan(dense), ~np.isnan(sparse)
+    fused = _fuse(dense, sparse, settings.FUSION_METHOD, settings.HYBRID_ALPHA, settings.RRF_K)
+    fused[~keep] = -np.inf
 
+    results = []
+    for i in np.argsort(-fused, kind="stable")[:k]:
+        if not keep[i]:
+            break
+        results.append(Document(
+            page_content=docs[i].page_content,
+            metadata={
+                **docs[i].metadata,
+                "chunk_id": all_ids[i],
+                "dense_score": float(dense[i]) if has_dense[i] else None,
+                "sparse_score": float(sparse[i]) if has_sparse[i] else None,
+                "fusion_score": float(fused[i])
+            }
+        ))
+    return results
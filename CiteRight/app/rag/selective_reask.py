@@ -1,15 +1,132 @@
-from typing import List
+import asyncio
+import re
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Tuple
 from app.config import settings
+from app.rag.generator import generate_with_ollama, stream_with_ollama
+from app.logging_utils import timer
 
+# "[...]" markers or the "(Source: ...)" / "(Sources: ...)" form the prompt asks for
+_CITATION_MARKER = re.compile(r"\[[^\]\n]+\]|\(Sources?:")
 
-def should_reask(rerank_scores: List[float], used_context_chunks: int, answer_text: str) -> bool:
+
+def has_citation_marker(answer_text: str) -> bool:
+    return bool(_CITATION_MARKER.search(answer_text))
+
+
+def reask_certain(rerank_scores: List[float], used_context_chunks: int) -> bool:
+    """True when retrieval alone already forces a re-ask, whatever the first answer says"""
     if not rerank_scores:
         return True
-    # Confidence proxy: average of top rerank scores + presence of citation tokens
     avg_score = sum(rerank_scores) / len(rerank_scores)
-    has_citation_marker = "[" in answer_text and "]" in answer_text
     coverage_ok = used_context_chunks >= max(1, int(settings.CONTEXT_TOP_K * settings.MIN_CITATION_COVERAGE))
-    if avg_score < settings.MIN_RERANK_SCORE or (not has_citation_marker) or (not coverage_ok):
-        return True
-    return False
+    return avg_score < settings.MIN_RERANK_SCORE or not coverage_ok
+
+
+async def _timed_generate(query: str, context: str) -> str:
+    with timer("generate"):
+        return await generate_with_ollama(query, context)
+
+
+def should_reask(rerank_scores: List[float], used_context_chunks: int, answer_text: str) -> bool:
+    # Confidence proxy: average of top rerank scores + presence of citation tokens
+    return reask_certain(rerank_scores, used_context_chunks) or not has_citation_marker(answer_text)
+
+
+async def generate_with_reask(query: str, context: str, strict_query: str,
+                              strict_context: Callable[[], Awaitable[str]],
+                              rerank_scores: List[float], used_context_chunks: int) -> AsyncIterator[Tuple[str, Any]]:
+    """Generate an answer, re-asking with the strict variant at roughly one generation's cost.
+
+    `strict_context()` builds the strict variant's context; it is only awaited once a
+    re-ask actually starts.
+
+    The first attempt is timed as the "generate" stage and the strict one as "reask".
+    Yields ("token", text) as tokens arrive, ("reask", None) when the tokens streamed so
+    far are being replaced, and finally ("final", (answer, used_reask)).
+
+    - If retrieval already forces a re-ask, only the strict variant is generated and
+      its answer is returned. With REASK_SPECULATIVE, the normal answer is generated
+      concurrently instead and kept if it passes the citation check first (or if the
+      strict answer ends without a citation), at the cost of two generations at once.
+    - Otherwise the normal answer is streamed and aborted as soon as
+      REASK_CITATION_WINDOW_CHARS characters arrive without a citation marker, and
+      the strict variant replaces it.
+    """
+    if reask_certain(rerank_scores, used_context_chunks):
+        if settings.REASK_SPECULATIVE:
+            async for event in _race_strict(query, context, strict_query, strict_context):
+                yield event
+            return
+    else:
+        window = settings.REASK_CITATION_WINDOW_CHARS
+        stream = stream_with_ollama(query, context)
+        parts = []
+        length = 0
+        cited = False
+        try:
+            with timer("generate") as watch:
+                async for token in stream:
+                    parts.append(token)
+                    length += len(token)
+                    with watch.paused():  # the stage excludes time the consumer holds us up
+                        yield "token", token
+                    if not cited:
+                        cited = has_citation_marker("".join(parts))
+                        if not cited and window and length >= window:
+                            break  # closing the stream stops Ollama generating the rest
+        finally:
+            await stream.aclose()
+
+        answer = "".join(parts)
+        if cited or has_citation_marker(answer):
+            yield "final", (answer, False)
+            return
+        yield "reask", None
+
+    parts = []
+    stream = stream_with_ollama(strict_query, await strict_context())
+    try:
+        with timer("reask") as watch:
+            async for token in stream:
+                parts.append(token)
+                with watch.paused():
+                    yield "token", token
+    finally:
+        await stream.aclose()
+    yield "final", ("".join(parts), True)
+
 
+async def _race_strict(query: str, context: str, strict_query: str,
+                       strict_context: Callable[[], Awaitable[str]]) -> AsyncIterator[Tuple[str, Any]]:
+    """Stream the strict variant while the normal answer is generated; keep whichever cites first"""
+    normal = asyncio.create_task(_timed_generate(query, context))
+    stream = stream_with_ollama(strict_query, await strict_context())
+    parts = []
+    normal_won = False
+    try:
+        with timer("reask") as watch:
+            async for token in stream:
+                parts.append(token)
+                with watch.paused():
+                    yield "token", token
+                if normal.done() and not normal.exception() and has_citation_marker(normal.result()):
+                    # The normal answer passed first: drop the strict one mid-stream
+                    normal_won = True
+                    break
+        if not normal_won and not has_citation_marker("".join(parts)):
+            try:
+                normal_won = has_citation_marker(await normal)
+            except Exception:
+                pass
+    finally:
+        await stream.aclose()
+        if not normal.done():
+            normal.cancel()
+        elif not normal.cancelled():
+            normal.exception()  # retrieve it so a failed task isn't logged as unhandled
+    if normal_won:
+        yield "reask", None
+        yield "token", normal.result()
+        yield "final", (normal.result(), False)
+    else:
+        yield "final", ("".join(parts), True)
@@ -0,0 +1,251 @@
+"""
+Content-addressed on-disk cache of external source payloads for CiteRight-Multiverse
+
+Requests (source + parameters) map to payload blobs stored under their own sha256,
+so identical payloads fetched through different requests are stored once. Each
+entry keeps an opaque validator (revision id, ETag, last_activity_date, ...) that
+lets a caller reuse it past its TTL when the source's current revision is known,
+or revalidate it with a conditional request. In offline mode only cached payloads
+are served, which also makes ingestion reproducible without network access; a
+source whose circuit breaker is open is served the same way.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Returned by a loader when a conditional request says the cached payload is still current
+NOT_MODIFIED = object()
+
+
+class FetchSkipped(Exception):
+    """A payload could not be fetched without breaking offline mode or the caller's deadline"""
+
+
+class SourceCache:
+    def __init__(self, root: str, ttl_seconds: int, max_bytes: int, offline: bool = False,
+                 breaker_for: Optional[Callable[[str], Any]] = None):
+        self.root = Path(root)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.breaker_for = breaker_for
+        self.hits = 0
+        self.stale = 0
+        self.revalidated = 0
+        self.misses = 0
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(str(self.root / "index.sqlite"), check_same_thread=False)
+        self._init()
+
+    def _init(self):
+        with self._lock, self._con:
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, source TEXT, blob TEXT, "
+                "validator TEXT, size INTEGER, fetched_at REAL, last_access REAL)"
+            )
+            self._con.execute("CREATE INDEX IF NOT EXISTS entries_blob ON entries (blob)")
+            self._con.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+
+    @staticmethod
+    def request_key(source: str, request: Dict[str, Any]) -> str:
+        return hashlib.sha256(f"{source}\n{json.dumps(request, sort_keys=True)}".encode("utf-8")).hexdigest()
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.root / "objects" / digest[:2] / digest
+
+    def _read_blob(self, digest: str) -> Any:
+        return orjson.loads(zlib.decompress(self._blob_path(digest).read_bytes()))
+
+    def _write_blob(self, payload: Any) -> Tuple[str, int]:
+        data = zlib.compress(orjson.dumps(payload))
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            tmp = path.with_suffix(f".tmp{threading.get_ident()}")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        return digest, len(data)
+
+    def lookup(self, source: str, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Cached entry for a request as {"payload", "validator", "age"}, or None"""
+        key = self.request_key(source, request)
+        with self._lock:
+            row = self._con.execute(
+                "SELECT blob, validator, fetched_at FROM entries WHERE key=?", (key,)
+            ).fetchone()
+        if not row:
+            return None
+        try:
+            payload = self._read_blob(row[0])
+        except (OSError, ValueError, zlib.error):
+            # Blob evicted or corrupted underneath the index: treat as a miss
+            with self._lock, self._con:
+                self._con.execute("DELETE FROM entries WHERE key=?", (key,))
+            return None
+        return {"payload": payload, "validator": row[1], "age": time.time() - row[2]}
+
+    def store(self, source: str, request: Dict[str, Any], payload: Any, validator: Optional[str] = None):
+        digest, size = self._write_blob(payload)
+        now = time.time()
+        with self._lock, self._con:
+            self._con.execute(
+                "REPLACE INTO entries (key, source, blob, validator, size, fetched_at, last_access) VALUES (?,?,?,?,?,?,?)",
+                (self.request_key(source, request), source, digest,
+                 None if validator is None else str(validator), size, now, now)
+            )
+            self._evict()
+
+    def _touch(self, source: str, request: Dict[str, Any], refreshed: bool = False):
+        now = time.time()
+        with self._lock, self._con:
+            if refreshed:
+                self._con.execute("UPDATE entries SET fetched_at=?, last_access=? WHERE key=?",
+                                  (now, now, self.request_key(source, request)))
+            else:
+                self._con.execute("UPDATE entries SET last_access=? WHERE key=?",
+                                  (now, self.request_key(source, request)))
+
+    def _evict(self):
+        """Drop least recently used entries until the distinct blobs fit in max_bytes (lock held)"""
+        total = self._con.execute("SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT blob, size FROM entries)").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, digest in self._con.execute("SELECT key, blob FROM entries ORDER BY last_access").fetchall():
+            self._con.execute("DELETE FROM entries WHERE key=?", (key,))
+            if self._con.execute("SELECT 1 FROM entries WHERE blob=? LIMIT 1", (digest,)).fetchone():
+                continue
+            path = self._blob_path(digest)
+            try:
+                total -= path.stat().st_size
+                path.unlink()
+            except OSError:
+                pass
+            if total <= self.max_bytes:
+                break
+
+    def cache_only(self, source: str) -> bool:
+        """Offline, or the source's circuit breaker is refusing requests"""
+        return self.offline or (self.breaker_for is not None and self.breaker_for(source).is_open)
+
+    def _fresh(self, cached: Optional[Dict[str, Any]], validator: Optional[str]) -> bool:
+        if cached is None:
+            return False
+        if validator is not None:
+            return cached["validator"] == str(validator)
+        return cached["age"] < self.ttl_seconds
+
+    def _serve(self, source: str, request: Dict[str, Any], cached: Optional[Dict[str, Any]],
+               validator: Optional[str], cache_only: bool) -> bool:
+        """Count and touch a cached entry that can answer without the network"""
+        if self._fresh(cached, validator):
+            self.hits += 1
+        elif cache_only and cached is not None:
+            self.stale += 1
+        else:
+            return False
+        self._touch(source, request)
+        return True
+
+    def fetch(self, source: str, request: Dict[str, Any], loader: Callable[[Optional[str]], Tuple[Any, Optional[str]]],
+              validator: Optional[str] = None, limiter=None, deadline=None) -> Any:
+        """Return the payload for a request, calling `loader` only when the cache cannot answer.
+
+        - A cached entry whose validator equals `validator` (the source's known current
+          revision) is reused regardless of age; otherwise it is reused within the TTL.
+        - In offline mode, or while the source's circuit is open, any cached entry is
+          served (however old) and a miss raises FetchSkipped.
+        - Before going to the network, one token is taken from `limiter`; FetchSkipped is
+          raised if it would not be granted before `deadline`.
+        - `loader(cached_validator)` returns (payload, validator), or NOT_MODIFIED if a
+          conditional request showed the cached payload is still current. None payloads
+          are returned but not cached.
+        """
+        cached = self.lookup(source, request)
+        cache_only = self.cache_only(source)
+        if self._serve(source, request, cached, validator, cache_only):
+            return cached["payload"]
+        if cache_only:
+            self.misses += 1
+            raise FetchSkipped(f"{source}: {'offline' if self.offline else 'circuit open'} and not cached")
+        if limiter is not None and not limiter.acquire(deadline):
+            raise FetchSkipped(f"{source}: rate limit would miss the deadline")
+
+        result = loader(cached["validator"] if cached else None)
+        if result is NOT_MODIFIED:
+            self.revalidated += 1
+            self._touch(source, request, refreshed=True)
+            return cached["payload"]
+        self.misses += 1
+        payload, new_validator = result
+        if payload is not None:
+            self.store(source, request, payload, new_validator)
+        return payload
+
+    def fetch_many(self, source: str, requests: Dict[str, Dict[str, Any]],
+                   loader: Callable[[List[str]], Dict[str, Tuple[Any, Optional[str]]]], batch_size: int,
+                   validators: Optional[Dict[str, str]] = None, limiter=None, deadline=None) -> Dict[str, Any]:
+        """Batched `fetch` for APIs that accept many ids per request.
+
+        `requests` maps ids to their per-item cache requests. Cached items are served as
+        in `fetch`; the rest go to `loader(ids)` at most `batch_size` ids per call, one
+        `limiter` token each, and it returns {id: (payload, validator)} for the ids it
+        found. Returns {id: payload} for every id that could be served: misses in
+        offline mode or with the circuit open, and batches that would miss
+        `deadline`, are left out.
+        """
+        validators = validators or {}
+        cache_only = self.cache_only(source)
+        found, missing = {}, []
+        for item_id, request in requests.items():
+            cached = self.lookup(source, request)
+            if self._serve(source, request, cached, validators.get(item_id), cache_only):
+                found[item_id] = cached["payload"]
+            else:
+                missing.append(item_id)
+        if cache_only:
+            self.misses += len(missing)
+            return found
+
+        for start in range(0, len(missing), batch_size):
+            if limiter is not None and not limiter.acquire(deadline):
+                break
+            batch = missing[start:start + batch_size]
+            loaded = loader(batch)
+            self.misses += len(batch)
+            for item_id in batch:
+                payload, validator = loaded.get(item_id, (None, None))
+                if payload is not None:
+                    self.store(source, requests[item_id], payload, validator)
+                    found[item_id] = payload
+        return found
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._con.execute(
+                "SELECT COUNT(*), (SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT blob, size FROM entries)) FROM entries"
+            ).fetchone()
+        return {"hits": self.hits, "stale": self.stale, "revalidated": self.revalidated, "misses": self.misses,
+                "entries": entries, "bytes": size, "offline": int(self.offline)}
+
+    def clear_all(self):
+        with self._lock, self._con:
+            digests = [r[0] for r in self._con.execute("SELECT DISTINCT blob FROM entries")]
+            self._con.execute("DELETE FROM entries")
+        for digest in digests:
+            try:
+                self._blob_path(digest).unlink()
+            except OSError:
+                pass
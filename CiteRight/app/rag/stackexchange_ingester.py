@@ -1,40 +1,135 @@
 """
 StackExchange data ingestion module for CiteRight-Multiverse
 """
-from stackapi import StackAPI
-from typing import List, Dict, Any
+from typing import Any, Callable, Dict, List, Optional
+import html
+import re
+import threading
 import time
 import logging
+from app.rag.rate_limit import Deadline
+from app.rag.source_cache import FetchSkipped
+from app.deps import http_session, rate_limiter, circuit_breaker, source_cache
 
 logger = logging.getLogger(__name__)
 
+_IDS_PER_REQUEST = 100  # the API accepts up to 100 semicolon-delimited ids
+_ANSWERS_PER_QUESTION = 5
+
+# Tags and whitespace runs both collapse to one space, so "</p><p>" doesn't glue words together
+_MARKUP = re.compile(r'(?:<[^>]*>|\s)+')
+
+class StackExchangeAPI:
+    """Minimal StackExchange API 2.3 client on the shared keep-alive session.
+
+    Mirrors StackAPI.fetch (`{ids}` expansion, paging up to `max_pages`, merged
+    `items`) without its per-construction site lookup or per-call connections.
+    A call can lower `max_pages` or stop early once `until(items so far)` is true.
+    Every page takes a "stackexchange" rate-limiter token and waits out any backoff
+    the API asked for; past the caller's deadline it stops with the pages it has,
+    or raises FetchSkipped if it has none.
+    """
+    base_url = "https://api.stackexchange.com/2.3/"
+    
+    def __init__(self, site: str, max_pages: int = 5):
+        self.site = site
+        self.max_pages = max_pages
+        self._backoff_until = 0.0
+        self._lock = threading.Lock()
+    
+    def fetch(self, endpoint: str, ids: List[int] = None, max_pages: Optional[int] = None,
+              until: Optional[Callable[[List[Dict[str, Any]]], bool]] = None,
+              deadline: Optional[Deadline] = None, **params) -> Dict[str, Any]:
+        if ids is not None:
+            endpoint = endpoint.format(ids=';'.join(str(i) for i in ids))
+        items = []
+        data = {}
+        for page in range(1, (max_pages or self.max_pages) + 1):
+            if not (self._wait_for_backoff(deadline) and rate_limiter("stackexchange").acquire(deadline)):
+                if page == 1:
+                    raise FetchSkipped("stackexchange: backoff or rate limit would miss the deadline")
+                break
+            with circuit_breaker("stackexchange").guard():
+                response = http_session().get(self.base_url + endpoint, params={'site': self.site, 'page': page, **params})
+                data = response.json()
+                if 'error_id' in data:
+                    raise RuntimeError(f"StackExchange API error {data['error_id']}: {data.get('error_message')}")
+                response.raise_for_status()
+            if data.get('backoff'):
+                # The API asks clients to leave this method alone for `backoff` seconds
+                with self._lock:
+                    self._backoff_until = max(self._backoff_until, time.monotonic() + data['backoff'])
+            items.extend(data.get('items', []))
+            if not data.get('has_more') or (until is not None and until(items)):
+                break
+        return {'items': items, 'quota_remaining': data.get('quota_remaining')}
+    
+    def _wait_for_backoff(self, deadline: Optional[Deadline] = None) -> bool:
+        """Sleep out the API's backoff; False (deadline marked hit) if it outlasts `deadline`"""
+        wait = self._backoff_until - time.monotonic()
+        if wait <= 0:
+            return True
+        if deadline is not None and wait > deadline.remaining():
+            deadline.hit = True
+            return False
+        time.sleep(wait)
+        return True
+
+
 class StackExchangeIngester:
     def __init__(self, site: str = "stackoverflow"):
         """Initialize StackExchange ingester with site setting"""
-        self.api = StackAPI(site)
+        self.api = StackExchangeAPI(site)
         self.site = site
         
-    def search_questions(self, query: str, max_questions: int = 10) -> List[Dict[str, Any]]:
-        """Search StackExchange for questions related to query"""
+    def search_questions(self, query: str, max_questions: int = 10,
+                         deadline: Optional[Deadline] = None) -> List[Dict[str, Any]]:
+        """Search StackExchange for questions related to query, with their top answers.
+
+        Usually costs two API calls: one page of search results (with bodies) and a
+        batched answers request for all result ids, which pages further only while
+        some question still lacks answers. Questions whose last_activity_date matches
+        a cached copy skip the answers request. Once `deadline` leaves no room for the
+        answers, the questions are returned without them.
+        """
         try:
             # Search for questions
-            questions = self.api.fetch(
-                'search/advanced',
-                q=query,
-                sort='relevance',
-                order='desc',
-                pagesize=max_questions
+            items = source_cache().fetch(
+                "stackexchange",
+                {"op": "search/advanced", "site": self.site, "q": query, "pagesize": max_questions, "filter": "withbody"},
+                lambda _: (self.api.fetch(
+                    'search/advanced',
+                    q=query,
+                    sort='relevance',
+                    order='desc',
+                    filter='withbody',
+                    pagesize=max_questions,
+                    max_pages=1,
+                    deadline=deadline
+                ).get('items', [])[:max_questions], None)
+            )
+            
+            items_by_id = {item['question_id']: item for item in items if item.get('question_id') is not None}
+            payloads = source_cache().fetch_many(
+                "stackexchange",
+                {question_id: self._question_request(question_id) for question_id in items_by_id},
+                lambda batch: self._attach_answers([items_by_id[question_id] for question_id in batch], deadline),
+                batch_size=_IDS_PER_REQUEST,
+                validators={question_id: item.get('last_activity_date') for question_id, item in items_by_id.items()}
             )
             
             processed_questions = []
             
-            for item in questions.get('items', []):
+            for question_id, item in items_by_id.items():
                 try:
-                    processed_item = self._process_question(item)
+                    payload = payloads.get(question_id)
+                    # Answers unavailable (rate limit or offline): fall back to the question alone
+                    processed_item = (self._process_question_with_answers(payload['question'], payload['answers'])
+                                      if payload else self._process_question(item))
                     if processed_item:
                         processed_questions.append(processed_item)
                 except Exception as e:
-                    logger.warning(f"Failed to process question {item.get('question_id', 'unknown')}: {e}")
+                    logger.warning(f"Failed to process question {question_id}: {e}")
                     continue
                     
             return processed_questions
@@ -43,30 +138,103 @@ class StackExchangeIngester:
             logger.error(f"StackExchange search failed: {e}")
             return []
     
-    def get_question_with_answers(self, question_id: int) -> Dict[str, Any]:
-        """Get a specific question with its answers"""
+    def get_question_with_answers(self, question_id: int, last_activity_date: int = None) -> Dict[str, Any]:
+        """Get a specific question with its answers.
+
+        If the question's current `last_activity_date` is known, a cached copy with the
+        same date is reused without asking the API again.
+        """
+        validators = {int(question_id): last_activity_date} if last_activity_date is not None else None
+        questions = self.get_questions_with_answers([question_id], validators)
+        return questions[0] if questions else None
+    
+    def get_questions_with_answers(self, question_ids: List[int],
+                                   last_activity_dates: Dict[int, int] = None) -> List[Dict[str, Any]]:
+        """Get several questions with their top answers.
+
+        Uncached questions are fetched 100 ids at a time: one request for the questions
+        and one (paged) request for all of their answers.
+        """
+        ids = list(dict.fromkeys(int(question_id) for question_id in question_ids))
+        try:
+            payloads = source_cache().fetch_many(
+                "stackexchange",
+                {question_id: self._question_request(question_id) for question_id in ids},
+                self._fetch_questions_with_answers,
+                batch_size=_IDS_PER_REQUEST,
+                validators=last_activity_dates
+            )
+        except Exception as e:
+            logger.error(f"Failed to get questions {ids}: {e}")
+            return []
+        
+        questions = []
+        for question_id in ids:
+            payload = payloads.get(question_id)
+            if payload:
+                question = self._process_question_with_answers(payload['question'], payload['answers'])
+                if question:
+                    questions.append(question)
+        return questions
+    
+    def _question_request(self, question_id: int) -> Dict[str, Any]:
+        return {"op": "question_with_answers", "site": self.site, "id": question_id}
+    
+    def _fetch_questions_with_answers(self, question_ids: List[int]) -> Dict[int, Any]:
+        """Fetch questions and their top answers; returns {id: (payload, last_activity_date)}"""
+        questions = self.api.fetch('questions/{ids}', ids=question_ids, filter='withbody', pagesize=_IDS_PER_REQUEST)
+        return self._attach_answers(questions.get('items', []))
+    
+    def _attach_answers(self, questions: List[Dict[str, Any]], deadline: Optional[Deadline] = None) -> Dict[int, Any]:
+        """Fetch the top answers of up to 100 questions in one call; returns {id: (payload, last_activity_date)}
+
+        Returns {} if the deadline cuts the answers short, so the questions are used
+        without answers rather than cached with an incomplete set.
+        """
+        if not questions:
+            return {}
+        wanted = {
+            question['question_id']: min(question.get('answer_count', _ANSWERS_PER_QUESTION), _ANSWERS_PER_QUESTION)
+            for question in questions
+        }
+
+        def covered(items: List[Dict[str, Any]]) -> bool:
+            # Stop paging once every question has its top answers (or all it has)
+            counts: Dict[int, int] = {}
+            for answer in items:
+                counts[answer.get('question_id')] = counts.get(answer.get('question_id'), 0) + 1
+            return all(counts.get(question_id, 0) >= n for question_id, n in wanted.items())
+
         try:
-            # Get question
-            question = self.api.fetch('questions/{ids}', ids=[question_id])
-            question_item = question['items'][0] if question['items'] else None
-            
-            if not question_item:
-                return None
-                
-            # Get answers
             answers = self.api.fetch(
                 'questions/{ids}/answers',
-                ids=[question_id],
+                ids=list(wanted),
                 sort='votes',
                 order='desc',
-                pagesize=5
+                filter='withbody',
+                pagesize=100,
+                until=covered,
+                deadline=deadline
             )
-            
-            return self._process_question_with_answers(question_item, answers.get('items', []))
-            
-        except Exception as e:
-            logger.error(f"Failed to get question {question_id}: {e}")
-            return None
+        except FetchSkipped:
+            return {}
+        if deadline is not None and deadline.hit and not covered(answers.get('items', [])):
+            return {}
+        
+        # Answers come back sorted by votes across all questions; keep each question's top few
+        answers_by_question: Dict[int, List[Dict[str, Any]]] = {}
+        for answer in answers.get('items', []):
+            bucket = answers_by_question.setdefault(answer.get('question_id'), [])
+            if len(bucket) < _ANSWERS_PER_QUESTION:
+                bucket.append(answer)
+        
+        return {
+            question['question_id']: (
+                {"question": question, "answers": answers_by_question.get(question['question_id'], [])},
+                question.get('last_activity_date')
+            )
+            for question in questions
+        }
     
     def _process_question(self, item: Dict[str, Any]) -> Dict[str, Any]:
         """Process a single StackExchange question item"""
@@ -77,7 +245,7 @@ class StackExchangeIngester:
             
             return {
                 "title": title,
-                "content": f"Question: {title}\n\nAnswer: {body}",
+                "content": f"Question: {title}\n\n{body}",
                 "summary": title,
                 "url": item.get('link', ''),
                 "source": f"Question {item.get('question_id', 'unknown')}",
@@ -143,21 +311,9 @@ class StackExchangeIngester:
         """Clean HTML content from StackExchange"""
         if not html_content:
             return ""
-            
-        # Simple HTML cleaning - remove tags but keep content
-        import re
-        # Remove HTML tags
-        clean = re.sub(r'<[^>]+>', '', html_content)
-        # Decode HTML entities
-        clean = clean.replace('&amp;', '&')
-        clean = clean.replace('&lt;', '<')
-        clean = clean.replace('&gt;', '>')
-        clean = clean.replace('&quot;', '"')
-        clean = clean.replace('&#39;', "'")
-        # Clean up whitespace
-        clean = re.sub(r'\s+', ' ', clean).strip()
-        
-        return clean
+        # One pass strips tags and collapses whitespace; entities are decoded afterwards
+        # so an escaped "&lt;div&gt;" in a code sample survives as text
+        return html.unescape(_MARKUP.sub(' ', html_content)).strip()
     
     def get_trending_questions(self, max_questions: int = 10) -> List[Dict[str, Any]]:
         """Get trending questions from StackExchange"""
@@ -166,11 +322,12 @@ class StackExchangeIngester:
                 'questions',
                 sort='hot',
                 order='desc',
-                pagesize=max_questions
+                pagesize=max_questions,
+                max_pages=1
             )
             
             processed_questions = []
-            for item in questions.get('items', []):
+            for item in questions.get('items', [])[:max_questions]:
                 processed_item = self._process_question(item)
                 if processed_item:
                     processed_questions.append(processed_item)
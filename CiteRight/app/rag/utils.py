@@ -1,14 +1,15 @@
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from typing import Any, Dict, List, Tuple
 from app.config import settings
+from app.deps import tokenizer, chunker
 
-splitter = RecursiveCharacterTextSplitter(
-    chunk_size=settings.CHUNK_SIZE,
-    chunk_overlap=settings.CHUNK_OVERLAP,
-    separators=["\n\n", "\n", ". ", ".", " "]
-)
+# Chunk token counts are reusable for context budgeting when both use the same tokenizer
+_SHARED_TOKENIZER = settings.CONTEXT_TOKENIZER == settings.EMBEDDING_MODEL
+_SPAN_KEYS = ("char_start", "char_end", "token_count", "overlap_tokens")
 
-def chunk_text(text: str):
-    return splitter.split_text(text)
+
+def chunk_text(text: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """(chunk, span metadata) pairs: character offsets into `text`, token count, overlap with the previous chunk"""
+    return [(c["text"], {k: c[k] for k in _SPAN_KEYS}) for c in chunker().iter_chunks(text)]
 
 
 def diversify_sources(docs, max_per_source: int = 2):
@@ -67,6 +68,98 @@ def build_context(docs, max_chunks: int):
     return "\n\n---\n\n".join(chunks)
 
 
+def count_tokens(texts: List[str]) -> List[int]:
+    """Token counts from the context tokenizer (no special tokens)"""
+    if not texts:
+        return []
+    encoded = tokenizer()(list(texts), add_special_tokens=False)["input_ids"]
+    return [len(ids) for ids in encoded]
+
+
+def _strip_overlap(prev: str, nxt: str) -> str:
+    """Drop the prefix of `nxt` that repeats the end of `prev` (chunks indexed without offsets)"""
+    max_len = min(len(prev), len(nxt), 360)
+    for size in range(max_len, 0, -1):
+        if prev.endswith(nxt[:size]):
+            return nxt[size:]
+    return nxt
+
+
+def _continuation(prev_meta, prev: str, meta, nxt: str) -> str:
+    """The part of chunk `nxt` not already in the chunk `prev` right before it"""
+    if "char_start" in meta and "char_end" in prev_meta and prev_meta.get("page") == meta.get("page"):
+        return nxt[max(0, prev_meta["char_end"] - meta["char_start"]):]
+    return _strip_overlap(prev, nxt)
+
+
+def _chunk_header(meta) -> str:
+    header = f"({meta.get('origin', 'Unknown')} — \"{meta.get('source', 'unknown')}\", {meta.get('license', 'Unknown')})"
+    if meta.get("url"):
+        header += f" [{meta['url']}]"
+    return header
+
+
+def pack_context(docs, max_tokens: int, max_chunks: int = None):
+    """Pack the best chunks into a token budget.
+
+    `docs` must be ordered best-first (as returned by the reranker). Chunks are taken
+    greedily while they fit in `max_tokens`; chunks of the same document share one
+    metadata header, and adjacent chunks (by `chunk_index`) are merged with their
+    overlapping text removed.
+    """
+    groups = {}  # (origin, source, url) -> {chunk_index: content}; insertion order = best score
+    used = 0
+    taken = 0
+    for d in docs:
+        if max_chunks is not None and taken >= max_chunks:
+            break
+        meta = getattr(d, 'metadata', {}) or {}
+        content = getattr(d, 'page_content', str(d))
+        key = (meta.get("origin"), meta.get("source"), meta.get("url"))
+        group = groups.get(key)
+        index = meta.get("chunk_index")
+
+        # Only pay for text the context doesn't already contain
+        text = content
+        follows = group is not None and index is not None and index - 1 in group
+        if follows:
+            text = _continuation(*group[index - 1], meta, content)
+        if _SHARED_TOKENIZER and "token_count" in meta and (not follows or "char_start" in meta):
+            # Counted at chunking time; the overlap with the previous chunk is known too
+            cost = meta["token_count"] - (meta.get("overlap_tokens", 0) if follows else 0)
+            if group is None:
+                cost += sum(count_tokens([_chunk_header(meta)]))
+        else:
+            pieces = [text] if group is not None else [_chunk_header(meta), text]
+            cost = sum(count_tokens(pieces))
+        if used + cost > max_tokens:
+            continue
+
+        if group is None:
+            group = groups[key] = {}
+        group[index if index is not None else f"#{len(group)}"] = (meta, content)
+        used += cost
+        taken += 1
+
+    blocks = []
+    for group in groups.values():
+        indexed = sorted((k, v) for k, v in group.items() if isinstance(k, int))
+        others = [v for k, v in group.items() if not isinstance(k, int)]
+        meta = (indexed[0][1] if indexed else others[0])[0]
+        parts = []
+        prev_index, prev = None, None
+        for index, (chunk_meta, content) in indexed:
+            if prev_index is not None and index == prev_index + 1:
+                parts[-1] += _continuation(*prev, chunk_meta, content)
+            else:
+                parts.append(content)
+            prev_index, prev = index, (chunk_meta, content)
+        parts.extend(content for _, content in others)
+        blocks.append(f"{_chunk_header(meta)}\n" + "\n[...]\n".join(parts))
+
+    return "\n\n---\n\n".join(blocks)
+
+
 def format_citations(docs, max_per_source: int = 2):
     """
     Format citations for CiteRight-Multiverse with structured metadata
@@ -87,6 +180,7 @@ def format_citations(docs, max_per_source: int = 2):
         origin = meta.get("origin", "Unknown")
         license_info = meta.get("license", "Unknown")
         url = meta.get("url", "")
+        page = meta.get("page")
         
         # Check if we've reached the limit for this source
         if source_counts.get(origin, 0) >= max_per_source:
@@ -101,8 +195,9 @@ def format_citations(docs, max_per_source: int = 2):
             "origin": origin,
             "license": license_info,
             "url": url,
+            "page": page,
             "snippet": snippet,
-            "formatted_source": f"{origin} — \"{source}\" ({license_info})"
+            "formatted_source": f"{origin} — \"{source}\"{f', p. {page}' if page else ''} ({license_info})"
         })
         
         # Increment count for this origin
@@ -1,19 +1,27 @@
 """
 Wikidata data ingestion module for CiteRight-Multiverse
 """
-import requests
 from typing import List, Dict, Any, Optional
 import logging
+import re
+from app.rag.rate_limit import Deadline
+from app.deps import http_session, rate_limiter, circuit_breaker, source_cache, wikidata_labels
 
 logger = logging.getLogger(__name__)
 
+_BATCH_SIZE = 50  # wbgetentities accepts at most 50 ids per request
+_ENTITY_ID = re.compile(r"^Q\d+$")
+
 class WikidataIngester:
     def __init__(self):
         """Initialize Wikidata ingester"""
         self.base_url = "https://www.wikidata.org/w/api.php"
+        self.headers = {
+            'User-Agent': 'CiteRight-Multiverse/1.0 (https://github.com/your-repo/citeright-multiverse)'
+        }
         
-    def search_entities(self, query: str, max_results: int = 10) -> List[Dict[str, Any]]:
-        """Search Wikidata for entities related to query"""
+    def search_entities(self, query: str, max_results: int = 10, deadline: Optional[Deadline] = None) -> List[Dict[str, Any]]:
+        """Search Wikidata for entities related to query, stopping early at `deadline`"""
         try:
             params = {
                 'action': 'wbsearchentities',
@@ -23,26 +31,16 @@ class WikidataIngester:
                 'limit': max_results
             }
             
-            headers = {
-                'User-Agent': 'CiteRight-Multiverse/1.0 (https://github.com/your-repo/citeright-multiverse)'
-            }
-            
-            response = requests.get(self.base_url, params=params, headers=headers)
-            response.raise_for_status()
+            def load(_):
+                return self._get(params).get('search', []), None
             
-            data = response.json()
-            entities = []
+            results = source_cache().fetch(
+                "wikidata", {"op": "search", **params}, load,
+                limiter=rate_limiter("wikidata"), deadline=deadline
+            )
             
-            for item in data.get('search', []):
-                try:
-                    entity = self._get_entity_details(item['id'])
-                    if entity:
-                        entities.append(entity)
-                except Exception as e:
-                    logger.warning(f"Failed to get details for entity {item.get('id', 'unknown')}: {e}")
-                    continue
-                    
-            return entities
+            # One batched request for all hits instead of one per hit
+            return self.get_entities_by_ids([item['id'] for item in results], deadline)
             
         except Exception as e:
             logger.error(f"Wikidata search failed: {e}")
@@ -50,36 +48,108 @@ class WikidataIngester:
     
     def get_entity_by_id(self, entity_id: str) -> Optional[Dict[str, Any]]:
         """Get a specific Wikidata entity by ID"""
-        try:
-            return self._get_entity_details(entity_id)
-        except Exception as e:
-            logger.error(f"Failed to get entity {entity_id}: {e}")
-            return None
+        entities = self.get_entities_by_ids([entity_id])
+        return entities[0] if entities else None
     
-    def _get_entity_details(self, entity_id: str) -> Optional[Dict[str, Any]]:
-        """Get detailed information about a Wikidata entity"""
+    def get_entities_by_ids(self, entity_ids: List[str], deadline: Optional[Deadline] = None) -> List[Dict[str, Any]]:
+        """Get several entities with batched requests, in the order given.
+
+        Entity documents come from the source cache or `wbgetentities` (up to 50 ids
+        per request); entity ids referenced by their claims are then resolved to
+        labels in a second batched pass through the persistent label cache.
+        """
         try:
-            # Get entity data
-            params = {
-                'action': 'wbgetentities',
-                'ids': entity_id,
-                'format': 'json',
-                'props': 'labels|descriptions|claims|sitelinks'
+            raw = self._fetch_entities(entity_ids, deadline)
+            claims = {
+                entity_id: self._extract_key_properties(entity_data.get('claims', {}))
+                for entity_id, entity_data in raw.items()
             }
+            # The fetched entities' own labels are free; remember them before resolving references
+            wikidata_labels().set_many({
+                entity_id: entity_data.get('labels', {}).get('en', {}).get('value')
+                for entity_id, entity_data in raw.items()
+            })
+            referenced = [value for props in claims.values() for value in props.values() if _ENTITY_ID.match(value)]
+            labels = self._resolve_labels(referenced, deadline)
             
-            headers = {
-                'User-Agent': 'CiteRight-Multiverse/1.0 (https://github.com/your-repo/citeright-multiverse)'
-            }
+            entities = []
+            for entity_id in dict.fromkeys(entity_ids):
+                if entity_id not in raw:
+                    continue
+                key_properties = {
+                    prop: f"{labels[value]} ({value})" if labels.get(value) else value
+                    for prop, value in claims[entity_id].items()
+                }
+                entity = self._process_entity(entity_id, raw[entity_id], key_properties)
+                if entity:
+                    entities.append(entity)
+            return entities
             
-            response = requests.get(self.base_url, params=params, headers=headers)
+        except Exception as e:
+            logger.error(f"Failed to get entities {entity_ids}: {e}")
+            return []
+    
+    def _get(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """One Wikidata API request behind the source's circuit breaker"""
+        with circuit_breaker("wikidata").guard():
+            response = http_session().get(self.base_url, params=params, headers=self.headers)
             response.raise_for_status()
-            
-            data = response.json()
-            entity_data = data.get('entities', {}).get(entity_id)
-            
-            if not entity_data:
-                return None
-                
+            return response.json()
+    
+    def _get_entities_json(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._get({'action': 'wbgetentities', 'format': 'json', **params}).get('entities', {})
+    
+    def _fetch_entities(self, entity_ids: List[str], deadline: Optional[Deadline] = None) -> Dict[str, Dict[str, Any]]:
+        """Raw entity JSON by id, from the source cache or batched `wbgetentities` calls"""
+        def load(batch: List[str]):
+            entities = self._get_entities_json({
+                'ids': '|'.join(batch),
+                'props': 'labels|descriptions|claims|sitelinks'
+            })
+            return {
+                entity_id: (entity_data, entity_data.get('lastrevid'))
+                for entity_id, entity_data in entities.items()
+                if 'missing' not in entity_data
+            }
+        
+        return source_cache().fetch_many(
+            "wikidata",
+            {entity_id: {"op": "entity", "id": entity_id} for entity_id in entity_ids},
+            load,
+            batch_size=_BATCH_SIZE,
+            limiter=rate_limiter("wikidata"),
+            deadline=deadline
+        )
+    
+    def _resolve_labels(self, entity_ids: List[str], deadline: Optional[Deadline] = None) -> Dict[str, Optional[str]]:
+        """English labels for referenced entity ids; unresolved ids are simply left out"""
+        label_cache = wikidata_labels()
+        labels = label_cache.get_many(entity_ids)
+        missing = [entity_id for entity_id in dict.fromkeys(entity_ids) if entity_id not in labels]
+        if source_cache().offline or circuit_breaker("wikidata").is_open:
+            return labels
+        
+        for start in range(0, len(missing), _BATCH_SIZE):
+            if not rate_limiter("wikidata").acquire(deadline):
+                break
+            batch = missing[start:start + _BATCH_SIZE]
+            try:
+                entities = self._get_entities_json({'ids': '|'.join(batch), 'props': 'labels', 'languages': 'en'})
+            except Exception as e:
+                logger.warning(f"Failed to resolve Wikidata labels: {e}")
+                break
+            # Ids without an English label are remembered as None so they are not asked for again
+            resolved = {
+                entity_id: entities.get(entity_id, {}).get('labels', {}).get('en', {}).get('value')
+                for entity_id in batch
+            }
+            label_cache.set_many(resolved)
+            labels.update(resolved)
+        return labels
+    
+    def _process_entity(self, entity_id: str, entity_data: Dict[str, Any], key_properties: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """Turn raw entity JSON into a content item"""
+        try:
             # Extract labels and descriptions
             labels = entity_data.get('labels', {})
             descriptions = entity_data.get('descriptions', {})
@@ -87,9 +157,7 @@ class WikidataIngester:
             title = labels.get('en', {}).get('value', entity_id)
             description = descriptions.get('en', {}).get('value', '')
             
-            # Extract key claims (properties)
             claims = entity_data.get('claims', {})
-            key_properties = self._extract_key_properties(claims)
             
             # Get Wikipedia link if available
             sitelinks = entity_data.get('sitelinks', {})
@@ -119,6 +187,7 @@ class WikidataIngester:
                 "license": "CC0 1.0",
                 "metadata": {
                     "entity_id": entity_id,
+                    "revision_id": entity_data.get('lastrevid'),
                     "labels": {lang: data['value'] for lang, data in labels.items()},
                     "descriptions": {lang: data['value'] for lang, data in descriptions.items()},
                     "wikipedia_url": wikipedia_url,
@@ -207,23 +276,12 @@ class WikidataIngester:
                 'query': sparql_query
             }
             
-            headers = {
-                'User-Agent': 'CiteRight-Multiverse/1.0 (https://github.com/your-repo/citeright-multiverse)'
-            }
-            
-            response = requests.get(self.base_url, params=params, headers=headers)
-            response.raise_for_status()
-            
-            data = response.json()
-            entities = []
-            
-            for binding in data.get('query', {}).get('results', {}).get('bindings', []):
-                item_id = binding.get('item', {}).get('value', '').split('/')[-1]
-                entity = self._get_entity_details(item_id)
-                if entity:
-                    entities.append(entity)
-                    
-            return entities
+            data = self._get(params)
+            item_ids = [
+                binding.get('item', {}).get('value', '').split('/')[-1]
+                for binding in data.get('query', {}).get('results', {}).get('bindings', [])
+            ]
+            return self.get_entities_by_ids(item_ids)
             
         except Exception as e:
             logger.error(f"Failed to get entities by category {category_id}: {e}")
@@ -0,0 +1,58 @@
+"""
+Persistent Wikidata label cache for CiteRight-Multiverse
+
+Claims reference other entities by id (`Q5`); the ingester resolves them to labels
+(`human`) so the chunk text carries meaning. Labels rarely change, so they are kept
+in sqlite across restarts and only unknown ids are looked up, in batches.
+"""
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+
+class LabelCache:
+    def __init__(self, path: str, ttl_seconds: int = 30 * 86400):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._init()
+
+    def _init(self):
+        with self._lock, self._con:
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS labels (entity_id TEXT, lang TEXT, label TEXT, fetched_at REAL, "
+                "PRIMARY KEY (entity_id, lang))"
+            )
+
+    def get_many(self, entity_ids: Iterable[str], lang: str = "en") -> Dict[str, Optional[str]]:
+        """Known labels for the given ids; an id with no label in `lang` maps to None"""
+        ids = list(dict.fromkeys(entity_ids))
+        if not ids:
+            return {}
+        cutoff = time.time() - self.ttl_seconds
+        found = {}
+        with self._lock:
+            # Stay well under sqlite's bound-parameter limit
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                rows = self._con.execute(
+                    f"SELECT entity_id, label FROM labels WHERE lang=? AND fetched_at>? "
+                    f"AND entity_id IN ({','.join('?' * len(batch))})",
+                    (lang, cutoff, *batch)
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def set_many(self, labels: Dict[str, Optional[str]], lang: str = "en"):
+        now = time.time()
+        with self._lock, self._con:
+            self._con.executemany(
+                "REPLACE INTO labels (entity_id, lang, label, fetched_at) VALUES (?,?,?,?)",
+                [(entity_id, lang, label, now) for entity_id, label in labels.items()]
+            )
+
+    def clear_all(self):
+        with self._lock, self._con:
+            self._con.execute("DELETE FROM labels")
@@ -1,82 +1,249 @@
 """
 Wikipedia data ingestion module for CiteRight-Multiverse
+
+Talks to the MediaWiki Action API directly: one action=query request returns
+wikitext, revisions, categories, links and disambiguation flags for up to 50 pages,
+instead of the separate request per lazy property of the `wikipedia` package.
+Full-text extracts (prop=extracts) are limited to one page per response, so page
+text comes from the batched revision content and is reduced to plain text here.
 """
-import wikipedia
+import html
+import re
 import requests
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from bs4 import BeautifulSoup
-import time
 import logging
+from app.rag.rate_limit import Deadline
+from app.rag.source_cache import FetchSkipped
+from app.deps import http_session, rate_limiter, circuit_breaker, source_cache
 
 logger = logging.getLogger(__name__)
 
+_TITLES_PER_REQUEST = 50  # action=query limit for anonymous clients
+
+# Everything an article needs, for every page in the batch
+_PAGE_PROPS = {
+    'prop': 'revisions|categories|links|info|pageprops',
+    'rvprop': 'ids|timestamp|content',
+    'rvslots': 'main',
+    'cllimit': 'max',
+    'clshow': '!hidden',
+    'pllimit': 'max',
+    'plnamespace': 0,
+    'inprop': 'url',
+    'ppprop': 'disambiguation',
+    'redirects': 1
+}
+
+# Wikitext markup, stripped in order by _wikitext_to_text
+_COMMENT = re.compile(r'<!--.*?-->', re.S)
+_REF = re.compile(r'<ref[^>/]*/>|<ref[^>]*>.*?</ref>', re.S | re.I)
+_TEMPLATE = re.compile(r'\{\{[^{}]*\}\}')  # innermost first, repeated for nesting
+_TABLE = re.compile(r'\{\|(?:(?!\{\|).)*?\|\}', re.S)
+_FILE_LINK = re.compile(r'\[\[(?:File|Image|Category):[^\[\]]*(?:\[\[[^\[\]]*\]\][^\[\]]*)*\]\]', re.I)
+_LINK = re.compile(r'\[\[(?:[^\[\]|]*\|)?([^\[\]]*)\]\]')
+_EXTERNAL_LINK = re.compile(r'\[(?:https?:)?//[^\s\]]*\s*([^\]]*)\]')
+_EMPHASIS = re.compile(r"'{2,}")
+_TAG = re.compile(r'<[^>]+>')
+_INDENT = re.compile(r'^[*#:;]+\s*', re.M)
+_HEADING = re.compile(r'^(=+)\s*(.*?)\s*\1\s*$', re.M)
+_BLANK_LINES = re.compile(r'\n{3,}')
+
+
+def _strip_nested(pattern: re.Pattern, text: str) -> str:
+    while True:
+        text, count = pattern.subn('', text)
+        if not count:
+            return text
+
+
+def _wikitext_to_text(wikitext: str) -> str:
+    """Plain text of a page's wikitext, keeping "== Heading ==" lines for _clean_content.
+
+    Templates (infoboxes, citations), references, tables, files and categories are
+    dropped; links and external links keep their label. Not a full parser: the
+    output matches what explaintext extracts give for ordinary prose.
+    """
+    text = _REF.sub('', _COMMENT.sub('', wikitext))
+    text = _strip_nested(_TABLE, _strip_nested(_TEMPLATE, text))
+    text = _FILE_LINK.sub('', text)
+    text = _LINK.sub(r'\1', text)
+    text = _EXTERNAL_LINK.sub(r'\1', text)
+    text = _TAG.sub('', _EMPHASIS.sub('', text))
+    text = _INDENT.sub('', html.unescape(text))
+    text = _HEADING.sub(r'\1 \2 \1', text)
+    return _BLANK_LINES.sub('\n\n', '\n'.join(line.rstrip() for line in text.split('\n'))).strip()
+
+
+def _revision_text(page: Dict[str, Any]) -> Optional[str]:
+    """Wikitext of the page's current revision, or None if this response didn't carry it"""
+    revisions = page.get('revisions') or []
+    return revisions[0].get('slots', {}).get('main', {}).get('content') if revisions else None
+
+
 class WikipediaIngester:
     def __init__(self, language: str = "en"):
         """Initialize Wikipedia ingester with language setting"""
-        wikipedia.set_lang(language)
         self.language = language
+        self.api_url = f"https://{language}.wikipedia.org/w/api.php"
+        self.headers = {
+            'User-Agent': 'CiteRight-Multiverse/1.0 (https://github.com/your-repo/citeright-multiverse)'
+        }
         
-    def search_and_ingest(self, query: str, max_pages: int = 5) -> List[Dict[str, Any]]:
-        """Search Wikipedia for articles related to query and ingest them"""
+    def search_and_ingest(self, query: str, max_pages: int = 5, deadline: Optional[Deadline] = None) -> List[Dict[str, Any]]:
+        """Search Wikipedia for articles related to query and ingest them.
+
+        The search and the article contents come from the same batched query
+        (generator=search). Stops early, returning the articles fetched so far,
+        once `deadline` leaves no room for the next rate-limited request.
+        """
         try:
-            # Search for articles
-            search_results = wikipedia.search(query, results=max_pages)
-            articles = []
+            truncated = []
             
-            for title in search_results:
-                try:
-                    article = self._get_article(title)
+            def load(_):
+                pages, _renames = self._query_pages(
+                    {'generator': 'search', 'gsrsearch': query, 'gsrlimit': max_pages, 'gsrnamespace': 0},
+                    deadline
+                )
+                titles = []
+                for page in sorted(pages.values(), key=lambda p: p.get('index', 0)):
+                    article = self._page_to_article(page)
                     if article:
-                        articles.append(article)
-                        time.sleep(0.5)  # Rate limiting
-                except Exception as e:
-                    logger.warning(f"Failed to fetch article '{title}': {e}")
-                    continue
-                    
-            return articles
+                        source_cache().store("wikipedia", self._page_request(article['title']), article,
+                                             article['metadata']['revision_id'])
+                        titles.append(article['title'])
+                if deadline is not None and deadline.expired:
+                    # Partial result: use it, but don't cache it as the answer to this search
+                    truncated.extend(titles)
+                    return None, None
+                return titles, None
+            
+            titles = source_cache().fetch(
+                "wikipedia",
+                {"op": "search", "lang": self.language, "query": query, "results": max_pages},
+                load,
+                deadline=deadline
+            )
+            return self.get_articles_by_titles(titles if titles is not None else truncated, deadline=deadline)
             
         except Exception as e:
             logger.error(f"Wikipedia search failed: {e}")
             return []
     
-    def _get_article(self, title: str) -> Dict[str, Any]:
-        """Get a single Wikipedia article with metadata"""
-        try:
-            # Get page object
-            page = wikipedia.page(title)
-            
-            # Get additional metadata
-            url = page.url
-            summary = page.summary
-            
-            # Clean content (remove references, citations, etc.)
-            content = self._clean_content(page.content)
-            
-            return {
-                "title": title,
-                "content": content,
-                "summary": summary,
-                "url": url,
-                "source": title,
-                "origin": "Wikipedia",
-                "license": "CC BY-SA 3.0",
-                "metadata": {
-                    "page_id": page.pageid,
-                    "revision_id": page.revision_id,
-                    "last_modified": getattr(page, 'last_modified', None),
-                    "categories": getattr(page, 'categories', []),
-                    "links": getattr(page, 'links', [])[:10]  # Limit links
-                }
-            }
-            
-        except wikipedia.exceptions.DisambiguationError as e:
-            # Handle disambiguation pages
-            logger.info(f"Disambiguation page for '{title}', using first option: {e.options[0]}")
-            return self._get_article(e.options[0])
+    def _page_request(self, title: str) -> Dict[str, Any]:
+        return {"op": "page", "lang": self.language, "title": title}
+    
+    def _api(self, params: Dict[str, Any], deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """One rate-limited action=query request behind the source's circuit breaker"""
+        if not rate_limiter("wikipedia").acquire(deadline):
+            raise FetchSkipped("wikipedia: rate limit would miss the deadline")
+        with circuit_breaker("wikipedia").guard():
+            response = http_session().get(self.api_url, params={
+                'action': 'query',
+                'format': 'json',
+                'formatversion': 2,
+                **params
+            }, headers=self.headers)
+            response.raise_for_status()
+            data = response.json()
+        if 'error' in data:
+            raise RuntimeError(data['error'].get('info', 'MediaWiki API error'))
+        return data
+    
+    def _query_pages(self, params: Dict[str, Any], deadline: Optional[Deadline] = None) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+        """Run a batched page query, following continuation until every page has its text.
+
+        Revision content for the whole batch normally fits one response; when it
+        doesn't, continuation is followed until it is all in (or the batch completes). Returns (pages by canonical
+        title, {requested title: normalized/redirect target}). If the deadline cuts the
+        continuation short, the pages gathered so far are returned.
+        """
+        pages: Dict[str, Dict[str, Any]] = {}
+        renames: Dict[str, str] = {}
+        cont: Dict[str, Any] = {}
+        while True:
+            try:
+                data = self._api({**_PAGE_PROPS, **params, **cont}, deadline)
+            except FetchSkipped:
+                if pages:
+                    break
+                raise
+            query = data.get('query', {})
+            for step in ('normalized', 'redirects'):
+                for rename in query.get(step, []):
+                    renames[rename['from']] = rename['to']
+            for page in query.get('pages', []):
+                merged = pages.setdefault(page['title'], {'categories': [], 'links': []})
+                for key, value in page.items():
+                    if key in ('categories', 'links'):
+                        merged[key].extend(value)
+                    elif key != 'revisions' or _revision_text(page) is not None or 'revisions' not in merged:
+                        merged[key] = value
             
-        except Exception as e:
-            logger.error(f"Failed to get article '{title}': {e}")
+            cont = data.get('continue')
+            # A generator's own continuation (next search page) only shows up once the batch is complete
+            if not cont or data.get('batchcomplete'):
+                break
+            if all(_revision_text(p) is not None or p.get('missing') or p.get('invalid') for p in pages.values()):
+                break  # remaining continuation is only for categories/links, which are capped anyway
+        return pages, renames
+    
+    @staticmethod
+    def _resolve(title: str, renames: Dict[str, str]) -> str:
+        """Follow normalization then redirect renames for a requested title"""
+        for _ in range(3):
+            if title not in renames:
+                break
+            title = renames[title]
+        return title
+    
+    def _page_to_article(self, page: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Build a content item from one merged query page"""
+        title = page.get('title', '')
+        wikitext = _revision_text(page)
+        if page.get('missing') or not wikitext:
+            return None
+        if 'disambiguation' in page.get('pageprops', {}):
+            logger.info(f"Skipping disambiguation page '{title}'")
             return None
+        
+        revision = page['revisions'][0]
+        text = _wikitext_to_text(wikitext)
+        # Clean content (remove references, citations, etc.)
+        content = self._clean_content(text)
+        summary = text.split('\n==', 1)[0].strip()
+        
+        return {
+            "title": title,
+            "content": content,
+            "summary": summary,
+            "url": page.get('fullurl') or f"https://{self.language}.wikipedia.org/wiki/{title.replace(' ', '_')}",
+            "source": title,
+            "origin": "Wikipedia",
+            "license": "CC BY-SA 3.0",
+            "metadata": {
+                "page_id": page.get('pageid'),
+                "revision_id": revision.get('revid'),
+                "last_modified": revision.get('timestamp'),
+                "categories": [c['title'].split(':', 1)[-1] for c in page.get('categories', [])],
+                "links": [l['title'] for l in page.get('links', [])][:10]  # Limit links
+            }
+        }
+    
+    def _fetch_articles(self, titles: List[str], deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """Fetch up to 50 titles in one batched query; returns {requested title: (article, revision_id)}"""
+        try:
+            pages, renames = self._query_pages({'titles': '|'.join(titles)}, deadline)
+        except FetchSkipped:
+            return {}
+        
+        articles = {}
+        for title in titles:
+            page = pages.get(self._resolve(title, renames))
+            article = self._page_to_article(page) if page else None
+            if article:
+                articles[title] = (article, article['metadata']['revision_id'])
+        return articles
     
     def _clean_content(self, content: str) -> str:
         """Clean Wikipedia content by removing references and citations"""
@@ -98,21 +265,92 @@ class WikipediaIngester:
     
     def get_article_by_title(self, title: str) -> Dict[str, Any]:
         """Get a specific Wikipedia article by title"""
-        return self._get_article(title)
+        articles = self.get_articles_by_titles([title])
+        return articles[0] if articles else None
+    
+    def get_revisions(self, titles: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Current page id and revision id per requested title.
+
+        Goes through the source cache like the articles themselves: one action=query
+        request per 50 uncached titles, with normalization and redirects followed, so
+        `title` in each result is the canonical page title. Missing pages are left out.
+        Offline or while the circuit is open, cached lookups are trusted however old,
+        and titles without one fall back to the revision of their cached article.
+        """
+        titles = list(dict.fromkeys(titles))
+        revisions = source_cache().fetch_many(
+            "wikipedia",
+            {title: {"op": "revision", "lang": self.language, "title": title} for title in titles},
+            self._fetch_revisions,
+            batch_size=_TITLES_PER_REQUEST
+        )
+        if source_cache().cache_only("wikipedia"):
+            for title in titles:
+                cached = None if title in revisions else source_cache().lookup("wikipedia", self._page_request(title))
+                if cached:
+                    article = cached["payload"]
+                    revisions[title] = {
+                        "title": article["title"],
+                        "page_id": article["metadata"]["page_id"],
+                        "revision_id": article["metadata"]["revision_id"]
+                    }
+        return revisions
+    
+    def _fetch_revisions(self, titles: List[str]) -> Dict[str, Any]:
+        """One batched revision lookup; returns {requested title: (revision info, None)}"""
+        query = self._api({
+            'titles': '|'.join(titles),
+            'prop': 'revisions',
+            'rvprop': 'ids',
+            'redirects': 1
+        }).get('query', {})
+        
+        renames = {r['from']: r['to'] for step in ('normalized', 'redirects') for r in query.get(step, [])}
+        pages = {
+            page['title']: page for page in query.get('pages', [])
+            if not page.get('missing') and page.get('revisions')
+        }
+        revisions = {}
+        for title in titles:
+            canonical = self._resolve(title, renames)
+            page = pages.get(canonical)
+            if page:
+                revisions[title] = ({
+                    "title": canonical,
+                    "page_id": page['pageid'],
+                    "revision_id": page['revisions'][0]['revid']
+                }, None)
+        return revisions
+    
+    def get_articles_by_titles(self, titles: List[str], revisions: Optional[Dict[str, Dict[str, Any]]] = None,
+                               deadline: Optional[Deadline] = None) -> List[Dict[str, Any]]:
+        """Get several articles, 50 uncached titles per batched query.
+
+        With `revisions` (from get_revisions), titles it did not find are skipped and
+        cached copies of the current revision are reused regardless of age.
+        """
+        titles = list(dict.fromkeys(titles))
+        if revisions is not None:
+            titles = [title for title in titles if title in revisions]
+        try:
+            articles = source_cache().fetch_many(
+                "wikipedia",
+                {title: self._page_request(title) for title in titles},
+                lambda batch: self._fetch_articles(batch, deadline),
+                batch_size=_TITLES_PER_REQUEST,
+                validators={title: info['revision_id'] for title, info in (revisions or {}).items()}
+            )
+        except Exception as e:
+            logger.error(f"Failed to fetch Wikipedia articles: {e}")
+            return []
+        return [articles[title] for title in titles if title in articles]
     
     def get_random_articles(self, count: int = 5) -> List[Dict[str, Any]]:
         """Get random Wikipedia articles"""
         try:
-            random_titles = wikipedia.random(pages=count)
-            articles = []
-            
-            for title in random_titles:
-                article = self._get_article(title)
-                if article:
-                    articles.append(article)
-                time.sleep(0.5)  # Rate limiting
-                
-            return articles
+            pages, _renames = self._query_pages({'generator': 'random', 'grnnamespace': 0, 'grnlimit': count})
+            articles = [self._page_to_article(page) for page in pages.values()]
+            return [article for article in articles if article]
             
         except Exception as e:
             logger.error(f"Failed to get random articles: {e}")
@@ -0,0 +1,159 @@
+"""
+Vector index tuning harness for CiteRight-Multiverse
+
+Builds each index type from app/rag/ann_index.py over the same vectors and
+reports, against an exact flat scan: build time, recall@k, and p50/p99
+single-query latency, for a sweep of efSearch (hnsw) and nprobe (ivfpq) values.
+Use it to pick INDEX_TYPE and its knobs for a corpus size.
+
+With --rebuilds N it also runs N snapshot-time rebuilds of an ivfpq index
+(rebuild_if_needed, each after deleting 1% of the chunks) and reports recall@k
+after each one, rebuilding from the vectors stored in the docstore and, for
+comparison, from vectors reconstructed out of the previous index's PQ codes.
+
+    python -m benchmarks.ann_bench                       # synthetic 100k x 384
+    python -m benchmarks.ann_bench --n 1000000 --dim 384
+    python -m benchmarks.ann_bench --corpus              # vectors of the local index
+    python -m benchmarks.ann_bench --corpus --queries questions.txt
+    python -m benchmarks.ann_bench --types ivfpq --rebuilds 5
+"""
+import argparse
+import time
+from pathlib import Path
+from types import SimpleNamespace
+import numpy as np
+from app.config import settings
+from app.rag import ann_index
+from app.rag.ann_index import FLAT, HNSW, IVFPQ
+from app.rag.docstore import SqliteDocstore
+
+
+def synthetic_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Unit vectors around a few thousand centres, roughly like sentence embeddings"""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((max(1, n // 200), dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, len(centres), n)] + 0.35 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def corpus_vectors() -> np.ndarray:
+    from app.deps import vectorstore
+    vs = vectorstore()
+    positions = np.array(sorted(vs.index_to_docstore_id), dtype=np.int64)
+    return ann_index.live_vectors(vs, positions)
+
+
+def query_vectors(vectors: np.ndarray, count: int, queries_file: str = None, seed: int = 1) -> np.ndarray:
+    """Embedded questions from a file, else perturbed copies of corpus vectors"""
+    if queries_file:
+        from app.deps import embeddings
+        lines = [l.strip() for l in Path(queries_file).read_text().splitlines() if l.strip()]
+        return np.asarray(embeddings().embed_documents(lines), dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.integers(0, len(vectors), count)]
+    noisy = picked + 0.1 * rng.standard_normal(picked.shape).astype(np.float32)
+    return noisy / np.linalg.norm(noisy, axis=1, keepdims=True)
+
+
+def measure(index, queries: np.ndarray, truth: np.ndarray, k: int):
+    """(recall@k, p50 ms, p99 ms) with one query per search call, as /query does"""
+    found, latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        _, positions = index.search(q[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(positions[0])
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size, float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99))
+
+
+class _ReconstructingDocstore(SqliteDocstore):
+    """Keeps no vectors, so every rebuild falls back to reconstructing them from the index"""
+
+    def vectors(self, ids):
+        return {}
+
+
+def rebuild_recall(vectors: np.ndarray, queries: np.ndarray, k: int, rounds: int):
+    """recall@k of an ivfpq vectorstore after each of `rounds` compacting rebuilds"""
+    n, dim = vectors.shape
+    saved = settings.INDEX_TYPE, settings.INDEX_TRAIN_MIN, settings.INDEX_COMPACT_RATIO
+    # Every tombstone triggers a compaction, so each round is one rebuild
+    settings.INDEX_TYPE, settings.INDEX_TRAIN_MIN, settings.INDEX_COMPACT_RATIO = IVFPQ, 0, 0.0
+    ids = [str(i) for i in range(n)]
+    print(f"\n{'rebuild from':<16}" + "".join(f"{f'round {r}':>10}" for r in range(rounds + 1)))
+    try:
+        for label, docstore in (("stored vectors", SqliteDocstore()), ("reconstructed", _ReconstructingDocstore())):
+            vs = SimpleNamespace(index=ann_index.new_index(IVFPQ, dim, train=vectors), index_to_docstore_id={},
+                                 docstore=docstore, _normalize_L2=False)
+            ann_index.add_vectors(vs, [""] * n, vectors, [{}] * n, ids)
+            rng = np.random.default_rng(2)
+            recalls = []
+            for r in range(rounds + 1):
+                if r:
+                    live = list(vs.index_to_docstore_id.values())
+                    ann_index.remove_vectors(vs, list(rng.choice(live, max(1, len(live) // 100), replace=False)))
+                    ann_index.rebuild_if_needed(vs)
+                live_ids = np.array(sorted(int(i) for i in vs.index_to_docstore_id.values()))
+                exact = ann_index.new_index(FLAT, dim)
+                exact.add(vectors[live_ids])
+                _, truth = exact.search(queries, k)
+                hits = 0
+                for q, t in zip(queries, truth):
+                    found, _ = ann_index.search(vs, q[None, :], k)
+                    hits += len({int(i) for i in found} & set(live_ids[t].tolist()))
+                recalls.append(hits / truth.size)
+            print(f"{label:<16}" + "".join(f"{recall:>10.3f}" for recall in recalls))
+    finally:
+        settings.INDEX_TYPE, settings.INDEX_TRAIN_MIN, settings.INDEX_COMPACT_RATIO = saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", action="store_true", help="use the vectors of the local index")
+    parser.add_argument("--n", type=int, default=100_000, help="synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=384, help="synthetic vector dimension")
+    parser.add_argument("--queries", help="file with one query per line (embedded with EMBEDDING_MODEL)")
+    parser.add_argument("--num-queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=settings.RETRIEVE_K)
+    parser.add_argument("--ef-search", nargs="+", type=int, default=[16, 32, 64, 128, 256])
+    parser.add_argument("--nprobe", nargs="+", type=int, default=[1, 4, 16, 64])
+    parser.add_argument("--types", nargs="+", default=[FLAT, HNSW, IVFPQ], choices=ann_index.INDEX_TYPES)
+    parser.add_argument("--rebuilds", type=int, default=0, help="ivfpq rebuild rounds for the recall-drift check")
+    args = parser.parse_args()
+
+    vectors = corpus_vectors() if args.corpus else synthetic_vectors(args.n, args.dim)
+    queries = query_vectors(vectors, args.num_queries, args.queries)
+    n, dim = vectors.shape
+    k = min(args.k, n)
+    print(f"{n} vectors x {dim}, {len(queries)} queries, k={k}")
+
+    exact = ann_index.new_index(FLAT, dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    print(f"{'index':<28}{'knob':<14}{'build s':>9}{'recall@k':>10}{'p50 ms':>9}{'p99 ms':>9}")
+    for kind in args.types:
+        start = time.perf_counter()
+        index = ann_index.new_index(kind, dim, train=vectors if kind == IVFPQ else None)
+        index.add(vectors)
+        build = time.perf_counter() - start
+        name = ann_index.factory_string(kind, dim, n)
+        if kind == HNSW:
+            knobs = [("efSearch", ef, dict(ef_search=ef)) for ef in args.ef_search]
+        elif kind == IVFPQ:
+            knobs = [("nprobe", p, dict(nprobe=p)) for p in args.nprobe]
+        else:
+            knobs = [("-", "", {})]
+        for label, value, options in knobs:
+            ann_index.tune(index, **options)
+            recall, p50, p99 = measure(index, queries, truth, k)
+            knob = f"{label}={value}" if value != "" else label
+            print(f"{name:<28}{knob:<14}{build:>9.1f}{recall:>10.3f}{p50:>9.3f}{p99:>9.3f}")
+
+    if args.rebuilds:
+        rebuild_recall(vectors, queries, k, args.rebuilds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Chunking throughput benchmark for CiteRight-Multiverse
+
+Compares the token-aware chunker (app/rag/chunking.py) with LangChain's
+RecursiveCharacterTextSplitter at the old character settings (900/180) on large
+inputs: throughput in MB/s, chunk counts, and how many chunks exceed the
+embedding model's input length (and so get truncated when embedded).
+
+    python -m benchmarks.chunking_bench                  # synthetic text, 1/8/32 MB
+    python -m benchmarks.chunking_bench docs/*.txt       # your own files
+    python -m benchmarks.chunking_bench --sizes 4 64 --repeat 5
+"""
+import argparse
+import random
+import statistics
+import time
+from pathlib import Path
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from app.config import settings
+from app.deps import embedding_tokenizer
+from app.rag.chunking import TokenChunker
+
+_WORDS = (
+    "the of and to in is was for on as with by at from that this which model data "
+    "retrieval citation source article question answer evidence language network "
+    "results method analysis embedding vector index document paragraph sentence"
+).split()
+
+
+def synthetic_text(size_mb: float, seed: int = 0) -> str:
+    """Prose-like text: sentences of 5-40 words, paragraphs of 1-8 sentences"""
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    paragraphs, size = [], 0
+    while size < target:
+        sentences = []
+        for _ in range(rng.randint(1, 8)):
+            words = rng.choices(_WORDS, k=rng.randint(5, 40))
+            sentences.append(" ".join(words).capitalize() + rng.choice([".", ".", ".", "?", "!"]))
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def _time(fn, text: str, repeat: int):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = fn(text)
+        runs.append(time.perf_counter() - start)
+    return statistics.median(runs), chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="text files to chunk (default: synthetic text)")
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1, 8, 32], help="synthetic input sizes in MB")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (median is reported)")
+    args = parser.parse_args()
+
+    tok = embedding_tokenizer()
+    model_max = getattr(tok, "model_max_length", 512)
+    if model_max > 100_000:  # tokenizers without a configured limit
+        model_max = 512
+    chunker = TokenChunker(tok, settings.CHUNK_TOKENS, settings.CHUNK_OVERLAP_TOKENS)
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=900, chunk_overlap=180, separators=["\n\n", "\n", ". ", ".", " "]
+    )
+
+    if args.files:
+        inputs = [(f, Path(f).read_text(encoding="utf-8", errors="ignore")) for f in args.files]
+    else:
+        inputs = [(f"synthetic {size:g} MB", synthetic_text(size)) for size in args.sizes]
+
+    print(f"tokenizer={settings.EMBEDDING_MODEL} max_len={model_max} "
+          f"chunk_tokens={settings.CHUNK_TOKENS} overlap_tokens={settings.CHUNK_OVERLAP_TOKENS}")
+    print(f"{'input':<24}{'chunker':<12}{'MB/s':>9}{'chunks':>9}{'tokens p50':>12}{'over max':>10}")
+    for name, text in inputs:
+        mb = len(text.encode("utf-8")) / (1024 * 1024)
+        seconds, spans = _time(chunker.split, text, args.repeat)
+        token_counts = [c["token_count"] for c in spans]
+        print(f"{name:<24}{'token':<12}{mb / seconds:>9.2f}{len(spans):>9}"
+              f"{statistics.median(token_counts):>12.0f}{sum(n > model_max for n in token_counts):>10}")
+
+        seconds, texts = _time(splitter.split_text, text, args.repeat)
+        # Token counts of the character splitter's chunks are measured outside the timed run
+        counts = [len(ids) for ids in tok(texts, add_special_tokens=False)["input_ids"]]
+        print(f"{name:<24}{'recursive':<12}{mb / seconds:>9.2f}{len(texts):>9}"
+              f"{statistics.median(counts):>12.0f}{sum(n > model_max for n in counts):>10}")
+
+
+if __name__ == "__main__":
+    main()
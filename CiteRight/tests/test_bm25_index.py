@@ -0,0 +1,107 @@
+import math
+import random
+import pytest
+from app.rag.bm25_index import BM25Index, tokenize
+
+WORDS = "faiss index chunk query score term wiki arxiv paper answer".split()
+
+
+def _corpus(n, seed=0):
+    rng = random.Random(seed)
+    return {f"c{i}": " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12))) for i in range(n)}
+
+
+def _scores(index, query):
+    ids, scores = index.get_scores(query)
+    return dict(zip(ids, scores.tolist()))
+
+
+def _rebuilt(docs):
+    index = BM25Index()
+    index.add(list(docs), list(docs.values()))
+    return index
+
+
+def _assert_same(index, docs):
+    expected = _rebuilt(docs)
+    assert len(index) == len(expected) == len(docs)
+    assert index.total_len == expected.total_len
+    for query in ("faiss", "query score", "wiki paper answer", "missing"):
+        got, want = _scores(index, query), _scores(expected, query)
+        assert got.keys() == want.keys()
+        for chunk_id in want:
+            assert got[chunk_id] == pytest.approx(want[chunk_id], rel=1e-5)
+
+
+def test_scores_match_okapi_bm25():
+    docs = {"a": "faiss index faiss", "b": "chunk query", "c": "faiss chunk chunk chunk"}
+    index = _rebuilt(docs)
+    n, avgdl = 3, sum(len(tokenize(t)) for t in docs.values()) / 3
+    idf = math.log(1 + (n - 2 + 0.5) / (2 + 0.5))
+    scores = _scores(index, "faiss")
+    assert scores.keys() == {"a", "c"}
+    for chunk_id, tf in (("a", 2), ("c", 1)):
+        length = len(tokenize(docs[chunk_id]))
+        want = idf * tf * 2.5 / (tf + 1.5 * (0.25 + 0.75 * length / avgdl))
+        assert scores[chunk_id] == pytest.approx(want, rel=1e-6)
+
+
+def test_incremental_add_delete_matches_rebuild():
+    docs = _corpus(60)
+    index = BM25Index()
+    index.add(list(docs)[:40], list(docs.values())[:40])
+    index.add(list(docs)[40:], list(docs.values())[40:])
+    deleted = [f"c{i}" for i in range(0, 60, 4)]
+    index.delete(deleted)
+    for chunk_id in deleted:
+        del docs[chunk_id]
+    index.add(["c1"], ["arxiv arxiv paper"])  # replaces the old chunk
+    docs["c1"] = "arxiv arxiv paper"
+    assert "c0" not in index and "c1" in index
+    _assert_same(index, docs)
+
+
+def test_snapshot_rebase_keeps_changes_made_after_capture(tmp_path):
+    docs = _corpus(50, seed=1)
+    index = _rebuilt(docs)
+    index.delete(["c3"])
+    del docs["c3"]
+
+    base, added, deleted = index.pending()
+    # Changes while the snapshot is being written stay in the overlay
+    index.add(["c3", "new"], ["wiki wiki", "answer term"])
+    index.delete(["c5", "c3"])
+    docs["new"] = "answer term"
+    del docs["c5"]
+
+    path = str(tmp_path / "bm25.sqlite")
+    BM25Index.write(path, base, added, deleted)
+    index.rebase(path, added, deleted)
+    assert index.path == path
+    _assert_same(index, docs)
+
+    reopened = BM25Index(path)
+    reopened.add(["new"], ["answer term"])
+    reopened.delete(["c5"])
+    _assert_same(reopened, docs)
+
+
+def test_repeated_snapshots_of_a_changing_index(tmp_path):
+    rng = random.Random(2)
+    docs = _corpus(30, seed=2)
+    index = _rebuilt(docs)
+    for round_ in range(5):
+        base, added, deleted = index.pending()
+        for _ in range(10):
+            chunk_id = f"c{rng.randrange(45)}"
+            if chunk_id in docs and rng.random() < 0.5:
+                index.delete([chunk_id])
+                del docs[chunk_id]
+            else:
+                text = " ".join(rng.choice(WORDS) for _ in range(5))
+                index.add([chunk_id], [text])
+                docs[chunk_id] = text
+        path = str(tmp_path / f"bm25-{round_}.sqlite")
+        BM25Index.write(path, base, added, deleted)
+        index.rebase(path, added, deleted)
+        _assert_same(index, docs)
@@ -0,0 +1,89 @@
+import pytest
+from app.rag import chunking
+from app.rag.chunking import TokenChunker
+
+
+class WordTokenizer:
+    """One token per whitespace-separated word, with the HF tokenizer call signature"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, texts, add_special_tokens=False, **kwargs):
+        self.calls += 1
+        return {"input_ids": [text.split() for text in texts]}
+
+
+def _chunks(text, max_tokens=10, overlap_tokens=4):
+    return TokenChunker(WordTokenizer(), max_tokens, overlap_tokens).split(text)
+
+
+def _summary(chunks):
+    return [(c["text"], c["token_count"], c["overlap_tokens"]) for c in chunks]
+
+
+def test_spans_point_into_the_source_text():
+    text = "  Intro line here.\nFirst sentence is this. Second one?\n\n\tNext paragraph starts!  Then ends.  "
+    chunks = _chunks(text, max_tokens=6, overlap_tokens=2)
+    assert chunks
+    for c in chunks:
+        assert text[c["char_start"]:c["char_end"]] == c["text"]
+        assert c["text"] == c["text"].strip()
+        assert c["token_count"] == len(c["text"].split()) <= 6
+    assert chunks[0]["char_start"] == 2 and chunks[-1]["char_end"] == len(text.rstrip())
+
+
+def test_overlap_repeats_trailing_sentences():
+    text = "A1 a a. A2 b b b. A3 c c. A4 d d d d."
+    chunks = _chunks(text)
+    assert _summary(chunks) == [
+        ("A1 a a. A2 b b b. A3 c c.", 10, 0),
+        ("A3 c c. A4 d d d d.", 8, 3),
+    ]
+    assert chunks[1]["char_start"] == text.index("A3") < chunks[0]["char_end"]
+
+
+def test_overlap_that_fits_no_sentence_is_empty():
+    chunks = _chunks("A1 a a a a. A2 b b b b b b. A3 c.", max_tokens=10, overlap_tokens=2)
+    assert [c["overlap_tokens"] for c in chunks] == [0, 0]
+
+
+def test_paragraph_break_closes_a_half_full_chunk():
+    text = "P1 a a.\n\nP2 b b b b b b.\n\nP3 c c."
+    assert _summary(_chunks(text)) == [
+        ("P1 a a.\n\nP2 b b b b b b.", 10, 0),  # P1 alone was under half full
+        ("P3 c c.", 3, 0),
+    ]
+
+
+def test_overlap_never_crosses_a_paragraph_break():
+    text = "Q1 a. Q2 b.\n\nQ3 c c. Q4 d d d d."
+    assert _summary(_chunks(text, max_tokens=10, overlap_tokens=6)) == [
+        ("Q1 a. Q2 b.\n\nQ3 c c.", 7, 0),
+        ("Q3 c c. Q4 d d d d.", 8, 3),
+    ]
+
+
+def test_long_sentence_is_cut_at_word_boundaries():
+    text = " ".join(f"w{i}" for i in range(1, 11))
+    assert [c["text"] for c in _chunks(text, max_tokens=4, overlap_tokens=1)] == [
+        "w1 w2 w3 w4", "w5 w6 w7 w8", "w9 w10"
+    ]
+
+
+def test_tokenizes_in_batches(monkeypatch):
+    text = " ".join(f"S{i} x y." for i in range(20))
+    expected = _chunks(text)
+    monkeypatch.setattr(chunking, "_BATCH", 3)
+    tokenizer = WordTokenizer()
+    assert TokenChunker(tokenizer, 10, 4).split(text) == expected
+    assert tokenizer.calls == 7
+
+
+def test_empty_text_has_no_chunks():
+    assert _chunks("") == [] and _chunks(" \n\n ") == []
+
+
+def test_overlap_must_be_smaller_than_a_chunk():
+    with pytest.raises(ValueError):
+        TokenChunker(WordTokenizer(), 10, 10)
@@ -0,0 +1,107 @@
+import pytest
+from app.metrics import SOURCE_CIRCUIT
+from app.rag import circuit_breaker as cb
+from app.rag.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+from app.rag.source_cache import FetchSkipped
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cb.time, "monotonic", lambda: now[0])
+    return now
+
+
+def _breaker(name="test"):
+    return CircuitBreaker(name, error_rate=0.5, min_calls=4, window=4, slow_seconds=2.0, cooldown_seconds=30.0)
+
+
+def _call(breaker, fail=False):
+    with breaker.guard():
+        if fail:
+            raise RuntimeError("boom")
+
+
+def _fail(breaker):
+    with pytest.raises(RuntimeError):
+        _call(breaker, fail=True)
+
+
+def test_opens_once_the_error_rate_is_reached(clock):
+    breaker = _breaker()
+    _fail(breaker)
+    _fail(breaker)
+    _call(breaker)
+    assert breaker.state == CLOSED  # fewer than min_calls outcomes
+    _fail(breaker)
+    assert breaker.state == OPEN and breaker.is_open
+    assert SOURCE_CIRCUIT._values[("test",)] == 2
+
+
+def test_successes_keep_it_closed(clock):
+    breaker = _breaker()
+    for _ in range(3):
+        _fail(breaker)
+        _call(breaker)
+        _call(breaker)
+        _call(breaker)
+    assert breaker.state == CLOSED
+
+
+def test_open_refuses_without_calling(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        _fail(breaker)
+    ran = []
+    with pytest.raises(CircuitOpen):
+        with breaker.guard():
+            ran.append(True)
+    assert ran == []
+    assert issubclass(CircuitOpen, FetchSkipped)
+
+
+def test_slow_requests_count_as_failures(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        with breaker.guard():
+            clock[0] += 2.5
+    assert breaker.state == OPEN
+
+
+def test_half_open_admits_one_probe_and_closes_on_success(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        _fail(breaker)
+    clock[0] += 30
+    assert breaker.state == HALF_OPEN and not breaker.is_open
+    with breaker.guard():
+        with pytest.raises(CircuitOpen):
+            _call(breaker)  # only one probe at a time
+    assert breaker.state == CLOSED
+    assert SOURCE_CIRCUIT._values[("test",)] == 0
+    _fail(breaker)
+    assert breaker.state == CLOSED  # the window started over
+
+
+def test_failed_probe_reopens_for_another_cooldown(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        _fail(breaker)
+    clock[0] += 30
+    _fail(breaker)
+    assert breaker.state == OPEN
+    clock[0] += 29
+    assert breaker.state == OPEN
+    clock[0] += 1
+    assert breaker.state == HALF_OPEN
+
+
+def test_late_outcomes_do_not_move_an_open_breaker(clock):
+    breaker = _breaker()
+    admitted = breaker.guard()
+    admitted.__enter__()  # admitted while still closed
+    for _ in range(4):
+        _fail(breaker)
+    admitted.__exit__(None, None, None)
+    clock[0] += 30
+    assert breaker.state == HALF_OPEN
@@ -0,0 +1,69 @@
+import sqlite3
+import numpy as np
+import pytest
+from app.rag.embedding_cache import QueryEmbeddingCache, normalize_text
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, text):
+        self.calls.append(text)
+        return [float(len(text)), float(sum(map(ord, text)) % 97)]
+
+
+def test_normalize_text_keeps_case():
+    assert normalize_text("  What is   FAISS?\n") == "What is FAISS?"
+
+
+def test_hit_returns_same_read_only_vector():
+    embed = CountingEmbedder()
+    cache = QueryEmbeddingCache(embed, "m", maxsize=4)
+    first = cache.embed("what is bm25")
+    assert cache.embed("  what   is bm25 ") is first
+    assert embed.calls == ["what is bm25"]
+    assert first.dtype == np.float32
+    with pytest.raises(ValueError):
+        first[0] = 1.0
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_lru_is_bounded_and_evicts_least_recently_used():
+    embed = CountingEmbedder()
+    cache = QueryEmbeddingCache(embed, "m", maxsize=2)
+    cache.embed("a")
+    cache.embed("b")
+    cache.embed("a")  # "b" is now the oldest
+    cache.embed("c")
+    assert cache.stats()["size"] == 2
+    cache.embed("a")
+    cache.embed("b")
+    assert embed.calls == ["a", "b", "c", "b"]
+
+
+def test_spill_file_survives_restart_and_is_bounded(tmp_path):
+    path = str(tmp_path / "emb.sqlite")
+    embed = CountingEmbedder()
+    cache = QueryEmbeddingCache(embed, "m", maxsize=1, spill_path=path, spill_maxsize=3)
+    for text in ("q1", "q2", "q3"):
+        cache.embed(text)
+    cache.embed("q1")  # from disk; refreshes its last access
+    assert cache.stats()["disk_hits"] == 1
+    cache.embed("q4")  # evicts q2, the least recently used spilled row
+    assert cache.stats()["spilled"] == 3
+
+    restarted = QueryEmbeddingCache(embed, "m", maxsize=1, spill_path=path, spill_maxsize=2)
+    assert restarted.stats()["spilled"] == 2
+    con = sqlite3.connect(path)
+    assert {r[0] for r in con.execute("SELECT text FROM query_embeddings")} == {"q1", "q4"}
+    calls = len(embed.calls)
+    np.testing.assert_array_equal(restarted.embed("q4"), cache.embed("q4"))
+    assert len(embed.calls) == calls
+
+
+def test_spill_is_keyed_by_model(tmp_path):
+    path = str(tmp_path / "emb.sqlite")
+    QueryEmbeddingCache(lambda t: [1.0], "model-a", spill_path=path).embed("q")
+    other = QueryEmbeddingCache(lambda t: [2.0], "model-b", spill_path=path)
+    assert other.embed("q").tolist() == [2.0]
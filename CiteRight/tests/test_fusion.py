@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+from app.config import settings
+from app.rag import retriever
+from app.rag.index_store import ReadWriteLock
+
+nan = np.nan
+
+
+def test_rrf_sums_reciprocal_ranks():
+    dense = np.array([0.9, 0.5, nan, 0.7], dtype=np.float32)
+    sparse = np.array([nan, 3.0, 5.0, 1.0], dtype=np.float32)
+    fused = retriever._fuse(dense, sparse, "rrf", 0.5, 60)
+    expected = [1 / 61, 1 / 63 + 1 / 62, 1 / 61, 1 / 62 + 1 / 63]
+    assert fused.tolist() == pytest.approx(expected)
+
+
+def test_rrf_ignores_score_scale():
+    dense = np.array([3.0, 2.0, 1.0], dtype=np.float32)
+    sparse = np.array([1.0, 2.0, 3.0], dtype=np.float32)
+    a = retriever._fuse(dense, sparse, "rrf", 0.5, 60)
+    b = retriever._fuse(dense * 1000, sparse / 1000, "rrf", 0.5, 60)
+    assert a.tolist() == pytest.approx(b.tolist())
+
+
+def test_weighted_min_max_normalizes_each_list():
+    dense = np.array([-1.0, -3.0, nan], dtype=np.float32)  # negated L2 distances
+    sparse = np.array([nan, 10.0, 20.0], dtype=np.float32)
+    fused = retriever._fuse(dense, sparse, "weighted", 0.75, 60)
+    assert fused.tolist() == pytest.approx([0.75, 0.0, 0.25])
+
+
+def test_weighted_single_candidate_scores_full():
+    fused = retriever._fuse(np.array([2.0], dtype=np.float32), np.array([nan], dtype=np.float32),
+                            "weighted", 0.5, 60)
+    assert fused.tolist() == pytest.approx([0.5])
+
+
+@pytest.fixture
+def fake_indexes(monkeypatch):
+    docs = {
+        "a": Document(page_content="alpha", metadata={"origin": "wikipedia"}),
+        "b": Document(page_content="beta", metadata={"origin": "arxiv"}),
+        "c": Document(page_content="gamma", metadata={"origin": "wikipedia"}),
+    }
+    vs = SimpleNamespace(docstore=SimpleNamespace(search=lambda i: docs.get(i, f"ID {i} not found.")))
+    monkeypatch.setattr(retriever, "vectorstore", lambda: vs)
+    monkeypatch.setattr(retriever, "index_store", lambda: SimpleNamespace(search_lock=ReadWriteLock()))
+    monkeypatch.setattr(retriever, "_dense_candidates",
+                        lambda q, k: (["b", "a", "gone"], np.array([0.9, 0.8, 0.7], dtype=np.float32)))
+    monkeypatch.setattr(retriever, "_sparse_candidates",
+                        lambda q, k: (["c", "a"], np.array([7.0, 5.0], dtype=np.float32)))
+    monkeypatch.setattr(settings, "FUSION_METHOD", "rrf")
+    monkeypatch.setattr(settings, "RRF_K", 60)
+
+
+def test_hybrid_search_fuses_and_annotates(fake_indexes):
+    results = retriever.hybrid_search("q", 3)
+    assert [d.metadata["chunk_id"] for d in results] == ["a", "b", "c"]
+    top = results[0].metadata
+    assert top["dense_score"] == pytest.approx(0.8) and top["sparse_score"] == pytest.approx(5.0)
+    assert top["fusion_score"] == pytest.approx(1 / 62 + 1 / 62)
+    assert results[2].metadata["dense_score"] is None
+
+
+def test_hybrid_search_ranks_within_allowed_origins(fake_indexes):
+    results = retriever.hybrid_search("q", 5, origins={"wikipedia"})
+    assert [d.metadata["chunk_id"] for d in results] == ["a", "c"]
+    # "a" is the best remaining dense hit once "b" is filtered out
+    assert results[0].metadata["fusion_score"] == pytest.approx(1 / 61 + 1 / 62)
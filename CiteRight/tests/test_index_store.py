@@ -0,0 +1,168 @@
+import numpy as np
+import orjson
+import pytest
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+from app.rag import ann_index
+from app.rag.bm25_index import BM25Index
+from app.rag.docstore import SqliteDocstore
+from app.rag.index_store import IndexStore, add_record, apply_record
+
+DIM = 8
+EMBEDDINGS = DeterministicFakeEmbedding(size=DIM)
+
+
+def _empty():
+    return FAISS(EMBEDDINGS, ann_index.new_index("flat", DIM), SqliteDocstore(), {}), BM25Index()
+
+
+def _vector(chunk_id):
+    return np.random.default_rng(int(chunk_id[1:])).random(DIM, dtype=np.float32)
+
+
+def _add(store, vs, bm25, ids):
+    record = add_record(ids, [f"text of {i}" for i in ids], [{"source": i} for i in ids],
+                        np.stack([_vector(i) for i in ids]))
+    with store.lock:
+        apply_record(vs, bm25, record)
+        store.append(record)
+
+
+def _delete(store, vs, bm25, ids):
+    record = {"op": "delete", "ids": ids}
+    with store.lock:
+        apply_record(vs, bm25, record)
+        store.append(record)
+
+
+def _store(root):
+    return IndexStore(str(root), snapshot_seconds=3600, snapshot_wal_bytes=1 << 30)
+
+
+def _restart(root):
+    """What startup does: load the current snapshot (if any) and replay the log over it"""
+    store = _store(root)
+    loaded = store.load(EMBEDDINGS)
+    vs, bm25, seq = loaded if loaded else (*_empty(), 0)
+    store.replay(vs, bm25, seq)
+    return store, vs, bm25
+
+
+def _live(vs, bm25):
+    ids = sorted(i for i, _ in vs.docstore.items())
+    assert len(bm25) == len(ids) == len(vs.docstore)
+    for chunk_id in ids:
+        assert vs.docstore.search(chunk_id).page_content == f"text of {chunk_id}"
+        found, _ = ann_index.search(vs, _vector(chunk_id)[None, :], 1)
+        assert found == [chunk_id]
+    return ids
+
+
+@pytest.fixture
+def root(tmp_path):
+    return tmp_path / "index"
+
+
+@pytest.fixture
+def opened(root):
+    store = _store(root)
+    vs, bm25 = _empty()
+    store.replay(vs, bm25, 0)
+    return store, vs, bm25
+
+
+def test_replay_restores_logged_changes(root, opened):
+    store, vs, bm25 = opened
+    _add(store, vs, bm25, ["c1", "c2", "c3"])
+    _delete(store, vs, bm25, ["c2"])
+    _add(store, vs, bm25, ["c4"])
+
+    store2 = _store(root)
+    vs2, bm25_2 = _empty()
+    assert store2.replay(vs2, bm25_2, 0) == 3
+    assert _live(vs2, bm25_2) == ["c1", "c3", "c4"]
+    assert store2.replay(*_empty(), after_seq=3) == 0  # records up to a snapshot's seq are skipped
+
+
+def test_torn_tail_is_dropped_and_truncated(root, opened):
+    store, vs, bm25 = opened
+    _add(store, vs, bm25, ["c1"])
+    _add(store, vs, bm25, ["c2"])
+    size = store.wal_path.stat().st_size
+    _add(store, vs, bm25, ["c3"])
+    # Crash part-way through the last write
+    with open(store.wal_path, "r+b") as f:
+        f.truncate(store.wal_path.stat().st_size - 5)
+
+    store2, vs2, bm25_2 = _restart(root)
+    assert _live(vs2, bm25_2) == ["c1", "c2"]
+    assert store2.wal_path.stat().st_size == size
+    _add(store2, vs2, bm25_2, ["c4"])
+    assert _live(*_restart(root)[1:]) == ["c1", "c2", "c4"]
+
+
+def test_corrupt_record_stops_replay(root, opened):
+    store, vs, bm25 = opened
+    _add(store, vs, bm25, ["c1"])
+    offset = store.wal_path.stat().st_size
+    _add(store, vs, bm25, ["c2"])
+    _add(store, vs, bm25, ["c3"])
+    data = bytearray(store.wal_path.read_bytes())
+    data[offset + 20] ^= 0xFF  # inside the second record's payload
+    store.wal_path.write_bytes(bytes(data))
+
+    assert _live(*_restart(root)[1:]) == ["c1"]
+
+
+def test_snapshot_swaps_current_and_drops_covered_log(root, opened):
+    store, vs, bm25 = opened
+    _add(store, vs, bm25, ["c1", "c2"])
+    store.snapshot(vs, bm25)
+    first = (root / "CURRENT").read_text()
+    snap = root / "snapshots" / first
+    assert {p.name for p in snap.iterdir()} >= {"index.faiss", "docs.sqlite", "bm25.sqlite", "ids.json", "meta.json"}
+    assert orjson.loads((snap / "meta.json").read_bytes())["seq"] == 1
+    assert store.wal_path.stat().st_size == 0 and not list(root.glob("wal-*.log"))
+    # The live indexes now read from the snapshot
+    assert vs.docstore.path == str(snap / "docs.sqlite") and bm25.path == str(snap / "bm25.sqlite")
+    assert _live(vs, bm25) == ["c1", "c2"]
+
+    _add(store, vs, bm25, ["c3"])
+    _delete(store, vs, bm25, ["c1"])
+    store.snapshot(vs, bm25)
+    second = (root / "CURRENT").read_text()
+    assert second > first
+    _add(store, vs, bm25, ["c5"])
+    assert _live(vs, bm25) == ["c2", "c3", "c5"]
+
+    store2, vs2, bm25_2 = _restart(root)
+    assert isinstance(vs2.docstore, SqliteDocstore)
+    assert _live(vs2, bm25_2) == ["c2", "c3", "c5"]
+    _add(store2, vs2, bm25_2, ["c6"])
+    store2.snapshot(vs2, bm25_2)
+    # Only the current snapshot and the one before it are kept
+    assert sorted(p.name for p in (root / "snapshots").iterdir()) == [second, (root / "CURRENT").read_text()]
+
+
+def test_failed_snapshot_keeps_current_and_log(root, opened, monkeypatch):
+    store, vs, bm25 = opened
+    _add(store, vs, bm25, ["c1"])
+    store.snapshot(vs, bm25)
+    current = (root / "CURRENT").read_text()
+    _add(store, vs, bm25, ["c2"])
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(BM25Index, "write", staticmethod(fail))
+    with pytest.raises(OSError):
+        store.snapshot(vs, bm25)
+    assert (root / "CURRENT").read_text() == current
+    assert _live(vs, bm25) == ["c1", "c2"]
+    monkeypatch.undo()
+
+    # The rotated log segment still holds c2
+    assert _live(*_restart(root)[1:]) == ["c1", "c2"]
+    store.snapshot(vs, bm25)
+    assert not list(root.glob("wal-*.log")) and not list((root / "snapshots").glob(".tmp-*"))
+    assert _live(*_restart(root)[1:]) == ["c1", "c2"]
@@ -0,0 +1,96 @@
+import threading
+import pytest
+from app.jobs import CANCELLED, FAILED, SUCCEEDED, JobManager, QueueFull, report_progress
+
+
+@pytest.fixture
+def jobs():
+    manager = JobManager(concurrency=1, queue_limit=2)
+    yield manager
+    manager.shutdown()
+
+
+def _blocker(started: threading.Event, release: threading.Event):
+    def run():
+        started.set()
+        release.wait(5)
+        return "done"
+    return run
+
+
+def test_progress_and_result(jobs):
+    def run(n):
+        for i in range(n):
+            report_progress("index", i + 1, n)
+        return n
+
+    done = threading.Event()
+    job = jobs.submit("ingest", run, 3, on_done=done.set)
+    assert done.wait(5)
+    assert job.status == SUCCEEDED and job.result == 3
+    assert job.stage == "index" and job.progress == {"index": {"done": 3, "total": 3}}
+
+
+def test_failure_is_recorded(jobs):
+    def run():
+        raise ValueError("bad path")
+
+    job = jobs.submit("ingest", run)
+    job.future.result(5)
+    assert job.status == FAILED and job.error == "bad path"
+
+
+def test_cancel_running_job_stops_at_next_report(jobs):
+    started, release = threading.Event(), threading.Event()
+    reached = []
+
+    def run():
+        report_progress("fetch")
+        started.set()
+        release.wait(5)
+        report_progress("embed")
+        reached.append("embed")
+
+    job = jobs.submit("ingest", run)
+    assert started.wait(5)
+    assert jobs.cancel(job.id).cancel_requested
+    release.set()
+    job.future.result(5)
+    assert job.status == CANCELLED and reached == []
+    assert job.stage == "fetch"
+
+
+def test_cancel_queued_job_never_runs(jobs):
+    started, release = threading.Event(), threading.Event()
+    first = jobs.submit("ingest", _blocker(started, release))
+    assert started.wait(5)
+    ran, done = [], threading.Event()
+    queued = jobs.submit("ingest", lambda: ran.append(True), on_done=done.set)
+    jobs.cancel(queued.id)
+    assert queued.status == CANCELLED
+    assert done.wait(5)  # on_done still runs for a job that never started
+    release.set()
+    first.future.result(5)
+    assert ran == [] and first.status == SUCCEEDED
+
+
+def test_cancel_finished_job_is_a_no_op(jobs):
+    job = jobs.submit("ingest", lambda: 1)
+    job.future.result(5)
+    assert jobs.cancel(job.id).status == SUCCEEDED
+    assert jobs.cancel("unknown") is None
+
+
+def test_queue_limit(jobs):
+    started, release = threading.Event(), threading.Event()
+    jobs.submit("ingest", _blocker(started, release))
+    assert started.wait(5)
+    jobs.submit("ingest", lambda: None)
+    jobs.submit("ingest", lambda: None)
+    with pytest.raises(QueueFull):
+        jobs.submit("ingest", lambda: None)
+    release.set()
+
+
+def test_report_progress_outside_a_job_is_a_no_op():
+    report_progress("fetch", 1, 2)
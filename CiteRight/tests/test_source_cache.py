@@ -0,0 +1,135 @@
+from types import SimpleNamespace
+import pytest
+from app.rag import source_cache as sc
+from app.rag.source_cache import NOT_MODIFIED, FetchSkipped, SourceCache
+
+
+class Loader:
+    def __init__(self, payload, validator=None):
+        self.payload = payload
+        self.validator = validator
+        self.calls = []
+
+    def __call__(self, cached_validator):
+        self.calls.append(cached_validator)
+        return self.payload, self.validator
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sc.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    return SourceCache(str(tmp_path), ttl_seconds=60, max_bytes=10 ** 6)
+
+
+REQ = {"op": "page", "title": "FAISS"}
+
+
+def test_hit_within_ttl_then_refetch_after(cache, clock):
+    loader = Loader({"text": "v1"}, validator="rev1")
+    assert cache.fetch("wikipedia", REQ, loader) == {"text": "v1"}
+    clock[0] += 59
+    assert cache.fetch("wikipedia", REQ, loader) == {"text": "v1"}
+    assert loader.calls == [None]
+
+    clock[0] += 2
+    loader.payload, loader.validator = {"text": "v2"}, "rev2"
+    assert cache.fetch("wikipedia", REQ, loader) == {"text": "v2"}
+    assert loader.calls == [None, "rev1"]  # the expired entry's validator is offered
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_not_modified_refreshes_the_entry(cache, clock):
+    cache.fetch("wikipedia", REQ, Loader({"text": "v1"}, "rev1"))
+    clock[0] += 120
+    assert cache.fetch("wikipedia", REQ, lambda validator: NOT_MODIFIED) == {"text": "v1"}
+    assert cache.stats()["revalidated"] == 1
+    clock[0] += 30
+    assert cache.fetch("wikipedia", REQ, Loader("unused")) == {"text": "v1"}
+
+
+def test_known_validator_overrides_ttl(cache, clock):
+    cache.fetch("stackexchange", REQ, Loader(["q"], "1700000000"))
+    clock[0] += 10 ** 6
+    loader = Loader(["new"], "1800000000")
+    assert cache.fetch("stackexchange", REQ, loader, validator="1700000000") == ["q"]
+    assert loader.calls == []
+    # Fresh by age, but the source is known to have changed
+    clock[0] += 1
+    assert cache.fetch("stackexchange", REQ, loader, validator="1800000000") == ["new"]
+
+
+def test_none_payloads_are_not_cached(cache):
+    loader = Loader(None)
+    assert cache.fetch("arxiv", REQ, loader) is None
+    assert cache.fetch("arxiv", REQ, loader) is None
+    assert len(loader.calls) == 2
+
+
+def test_offline_serves_stale_and_skips_misses(tmp_path, clock):
+    online = SourceCache(str(tmp_path), ttl_seconds=60, max_bytes=10 ** 6)
+    online.fetch("wikipedia", REQ, Loader({"text": "v1"}))
+    clock[0] += 10 ** 6
+
+    offline = SourceCache(str(tmp_path), ttl_seconds=60, max_bytes=10 ** 6, offline=True)
+    loader = Loader({"text": "v2"})
+    assert offline.fetch("wikipedia", REQ, loader) == {"text": "v1"}
+    with pytest.raises(FetchSkipped):
+        offline.fetch("wikipedia", {"op": "page", "title": "BM25"}, loader)
+    assert loader.calls == []
+    assert offline.stats()["stale"] == 1 and offline.stats()["misses"] == 1
+
+
+def test_open_circuit_is_served_like_offline(tmp_path):
+    breakers = {"arxiv": SimpleNamespace(is_open=True), "wikipedia": SimpleNamespace(is_open=False)}
+    cache = SourceCache(str(tmp_path), ttl_seconds=60, max_bytes=10 ** 6, breaker_for=breakers.get)
+    assert cache.cache_only("arxiv") and not cache.cache_only("wikipedia")
+    with pytest.raises(FetchSkipped, match="circuit open"):
+        cache.fetch("arxiv", REQ, Loader(["paper"]))
+    assert cache.fetch("wikipedia", REQ, Loader(["page"])) == ["page"]
+
+
+def test_fetch_many_batches_misses_only(cache):
+    requests = {t: {"op": "page", "title": t} for t in "abcde"}
+    cache.store("wikipedia", requests["c"], "cached c")
+    batches = []
+
+    def loader(ids):
+        batches.append(ids)
+        return {i: (f"page {i}", None) for i in ids if i != "e"}
+
+    got = cache.fetch_many("wikipedia", requests, loader, batch_size=2)
+    assert batches == [["a", "b"], ["d", "e"]]
+    assert got == {"a": "page a", "b": "page b", "c": "cached c", "d": "page d"}
+
+    cache.offline = True
+    assert cache.fetch_many("wikipedia", requests, loader, batch_size=2) == got
+    assert len(batches) == 2
+
+
+def test_identical_payloads_share_one_blob(cache, tmp_path):
+    cache.store("wikipedia", {"title": "A"}, {"text": "same"})
+    cache.store("wikipedia", {"title": "B"}, {"text": "same"})
+    assert cache.stats()["entries"] == 2
+    assert len(list((tmp_path / "objects").glob("*/*"))) == 1
+
+
+def test_evicts_least_recently_used_past_max_bytes(tmp_path, clock):
+    cache = SourceCache(str(tmp_path), ttl_seconds=60, max_bytes=10 ** 6)
+    for i in range(3):
+        clock[0] += 1
+        cache.store("arxiv", {"id": i}, {"body": str(i) * 500, "n": i})
+    size = cache.stats()["bytes"] // 3
+    cache.max_bytes = 3 * size
+    clock[0] += 1
+    cache.fetch("arxiv", {"id": 0}, Loader("unused"))  # 0 is now the most recently used
+    clock[0] += 1
+    cache.store("arxiv", {"id": 3}, {"body": "3" * 500, "n": 3})
+    assert cache.lookup("arxiv", {"id": 1}) is None
+    assert all(cache.lookup("arxiv", {"id": i}) for i in (0, 2, 3))
+    assert cache.stats()["bytes"] <= cache.max_bytes
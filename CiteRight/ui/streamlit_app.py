@@ -1,5 +1,5 @@
 import streamlit as st
-import requests, os
+import requests, os, time
 
 API = os.getenv("API_URL", "http://localhost:8000")
 
@@ -21,15 +21,33 @@ with st.sidebar:
     uploaded_file = st.file_uploader("Choose a PDF file", type="pdf")
     if uploaded_file is not None:
         if st.button("📤 Upload PDF"):
-            with st.spinner("Processing PDF..."):
-                files = {"file": (uploaded_file.name, uploaded_file.getvalue(), "application/pdf")}
-                r = requests.post(f"{API}/upload-pdf", files=files)
-                if r.ok:
-                    result = r.json()
+            files = {"file": (uploaded_file.name, uploaded_file.getvalue(), "application/pdf")}
+            r = requests.post(f"{API}/upload-pdf", files=files)
+            if r.ok and "job_id" in r.json():
+                # Processing runs as a background job; poll it instead of blocking on the upload
+                job_id = r.json()["job_id"]
+                status = st.empty()
+                bar = st.progress(0.0)
+                while True:
+                    job = requests.get(f"{API}/jobs/{job_id}").json()
+                    if job["status"] in ("succeeded", "failed", "cancelled"):
+                        break
+                    stage = job.get("stage")
+                    progress = job["progress"].get(stage, {}) if stage else {}
+                    if progress.get("done") and progress.get("total"):
+                        bar.progress(min(1.0, progress["done"] / progress["total"]))
+                    status.info(f"⏳ {job['status'].capitalize()}{f' — {stage}' if stage else ''}...")
+                    time.sleep(1)
+                status.empty()
+                bar.empty()
+                if job["status"] == "succeeded":
+                    result = job["result"]
                     st.success(f"✅ Uploaded: {result['filename']}")
                     st.info(f"📄 {result['page_count']} pages, {result['chunks_added']} chunks")
                 else:
-                    st.error(f"❌ Upload failed: {r.text}")
+                    st.error(f"❌ Upload {job['status']}: {job.get('error') or ''}")
+            else:
+                st.error(f"❌ Upload failed: {r.text}")
 
 # Main query interface
 